@@ -0,0 +1,7 @@
+#!/usr/bin/env python
+
+from .run import main
+
+
+if __name__ == '__main__':
+    main()
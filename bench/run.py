@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+"""
+Benchmarks of msir on synthetic microsatellite datasets
+
+Usage:
+    bench generate [--size=<str>] [--depth=<int>] [--instability=<float>]
+                   [--seed=<int>] <dir>
+    bench run [--sizes=<str>] [--processes=<str>] [--readers=<str>]
+              [--repeats=<int>] [--depth=<int>] [--instability=<float>]
+              [--seed=<int>] [--work-dir=<path>] [--results=<path>]
+    bench compare [--threshold=<float>] <base_json> <new_json>
+    bench stage <name> <dir>
+    bench -h|--help
+
+Options:
+    -h, --help              Print help and exit
+    --size=<str>            Set a dataset size {tiny, small, medium, large}
+                            [default: tiny]
+    --sizes=<str>           Set comma-separated dataset sizes
+                            [default: tiny,small]
+    --depth=<int>           Override read depth per locus and sample
+    --instability=<float>   Override a fraction of unstable loci in tumor
+    --seed=<int>            Set a random seed [default: 0]
+    --processes=<str>       Set comma-separated values for --processes
+                            [default: 1,2,4]
+    --readers=<str>         Set comma-separated readers for indexed detect
+                            {auto, pysam, native, samtools} [default: auto]
+    --repeats=<int>         Repeat each measurement [default: 3]
+    --work-dir=<path>       Set a directory for datasets and outputs
+                            [default: bench_work]
+    --results=<path>        Write results into a JSON file
+                            [default: bench_results.json]
+    --threshold=<float>     Flag slowdowns over this ratio [default: 0.1]
+
+Arguments:
+    <dir>                   Path to a dataset directory
+    <base_json>             Path to a results JSON of a baseline
+    <new_json>              Path to a results JSON to compare
+    <name>                  Stage name {units, regex, scan, sam_parse, spawn}
+
+Commands:
+    generate                Generate a synthetic genome, BED, and reads
+    run                     Time msir end to end, per stage, and at startup
+    compare                 Compare two results files
+    stage                   Time a single stage (used by `run`)
+"""
+
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from docopt import docopt
+from msir import __version__
+from msir.util.helper import fetch_abspath, fetch_executable, print_log
+from .samtools import write_samtools_wrapper
+from .synth import SIZES, generate_dataset, load_manifest
+
+
+_STAGES = ['units', 'regex', 'scan', 'sam_parse', 'spawn']
+
+_RSS_UNIT_SIZE = 1 if sys.platform == 'darwin' else 1024
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class BenchmarkError(RuntimeError):
+    pass
+
+
+def main():
+    args = docopt(__doc__)
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S', level=logging.WARNING
+    )
+    overrides = {
+        k: t(args[o]) for k, o, t in [
+            ('depth', '--depth', int),
+            ('instability', '--instability', float)
+        ] if args[o] is not None
+    }
+    if args['generate']:
+        generate_dataset(
+            out_dir=args['<dir>'], **{**SIZES[args['--size']], **overrides},
+            seed=int(args['--seed'])
+        )
+    elif args['run']:
+        run_benchmarks(
+            sizes=args['--sizes'].split(','),
+            processes=[int(n) for n in args['--processes'].split(',')],
+            readers=args['--readers'].split(','),
+            repeats=int(args['--repeats']), overrides=overrides,
+            seed=int(args['--seed']), work_dir=args['--work-dir'],
+            results_path=args['--results']
+        )
+    elif args['compare']:
+        n_slower = compare_results(
+            base_path=args['<base_json>'], new_path=args['<new_json>'],
+            threshold=float(args['--threshold'])
+        )
+        sys.exit(1 if n_slower else 0)
+    elif args['stage']:
+        print(
+            json.dumps(
+                _time_stage(name=args['<name>'], data_dir=args['<dir>'])
+            )
+        )
+
+
+def run_benchmarks(sizes, processes, readers=['auto'], repeats=3,
+                   overrides={}, seed=0, work_dir='bench_work',
+                   results_path='bench_results.json'):
+    work = fetch_abspath(work_dir)
+    os.makedirs(work, exist_ok=True)
+    samtools = fetch_executable('samtools')
+    if 'samtools' in readers and not samtools:
+        samtools = write_samtools_wrapper(path=os.path.join(work, 'samtools'))
+    results = list()
+    for size in sizes:
+        params = {**SIZES[size], **overrides, 'seed': seed}
+        data_dir = os.path.join(work, size)
+        manifest = _prepare_dataset(data_dir=data_dir, params=params)
+        paths = manifest['paths']
+        n_loci = manifest['params']['n_loci']
+        n_reads = sum(manifest['n_reads'].values())
+        print_log('Time stages:\t{}'.format(size))
+        for s in _STAGES:
+            results.append(
+                _measure(
+                    size=size, stage=s, mode='kernel', processes=1,
+                    args=[
+                        sys.executable, '-m', 'bench', 'stage', s, data_dir
+                    ],
+                    repeats=repeats, log_dir=data_dir
+                )
+            )
+        print_log('Time startup:\t{}'.format(size))
+        results.extend(
+            _measure_startup(
+                size=size, data_dir=data_dir, paths=paths, repeats=repeats
+            )
+        )
+        unit_tsv = os.path.join(data_dir, 'tr_unit.tsv')
+        obs_tsv = os.path.join(data_dir, 'tr_obs.tsv')
+        detect_modes = [
+            ('sweep', ['--sweep'], [paths['normal'], paths['tumor']])
+        ]
+        if 'normal_bam' in paths:
+            detect_modes.extend([
+                (
+                    'indexed-{}'.format(r),
+                    [
+                        '--reader={}'.format(r),
+                        *(['--samtools={}'.format(samtools)]
+                          if r == 'samtools' else [])
+                    ],
+                    [paths['normal_bam'], paths['tumor_bam']]
+                ) for r in readers
+            ])
+        for n in processes:
+            print_log('Time msir with {0} processes:\t{1}'.format(n, size))
+            results.append(
+                _measure(
+                    size=size, stage='id', mode='scan', processes=n,
+                    n_items=n_loci, unit='loci',
+                    args=_msir_args(
+                        'id', '--engine=scan', '--no-cache',
+                        '--unit-tsv={}'.format(unit_tsv),
+                        '--processes={}'.format(n), paths['bed'],
+                        paths['fasta']
+                    ),
+                    repeats=repeats, log_dir=data_dir
+                )
+            )
+            for mode, opts, bam_paths in detect_modes:
+                results.append(
+                    _measure(
+                        size=size, stage='detect', mode=mode, processes=n,
+                        n_items=n_reads, unit='reads',
+                        args=_msir_args(
+                            'detect', *opts,
+                            '--unit-tsv={}'.format(unit_tsv),
+                            '--obs-tsv={}'.format(obs_tsv),
+                            '--processes={}'.format(n), *bam_paths
+                        ),
+                        repeats=repeats, log_dir=data_dir
+                    )
+                )
+    _add_scaling_efficiency(results=results)
+    output = {
+        'meta': {
+            **_fetch_environment(), 'repeats': repeats,
+            'created': datetime.now(timezone.utc).isoformat(),
+            'datasets': {
+                s: {**SIZES[s], **overrides, 'seed': seed} for s in sizes
+            }
+        },
+        'results': results
+    }
+    with open(fetch_abspath(results_path), 'w') as f:
+        json.dump(output, f, indent=2)
+    print_log('Write benchmark results:\t{}'.format(results_path))
+    _print_results(results=results)
+    return output
+
+
+def compare_results(base_path, new_path, threshold=0.1):
+    records = list()
+    for p in [base_path, new_path]:
+        with open(fetch_abspath(p)) as f:
+            records.append(
+                {_result_key(r): r for r in json.load(f)['results']}
+            )
+    base, new = records
+    n_slower = 0
+    print('\t'.join(
+        ['size', 'stage', 'mode', 'processes', 'base_s', 'new_s', 'ratio']
+    ))
+    for k in [k for k in new if k in base]:
+        ratio = new[k]['median_seconds'] / base[k]['median_seconds']
+        slower = ratio > 1 + threshold
+        n_slower += slower
+        print('\t'.join([
+            *[str(v) for v in k],
+            '{:.3f}'.format(base[k]['median_seconds']),
+            '{:.3f}'.format(new[k]['median_seconds']),
+            '{:.3f}{}'.format(ratio, '\tSLOWER' if slower else '')
+        ]))
+    print_log(
+        'Slower results:\t{0}/{1}'.format(
+            n_slower, len([k for k in new if k in base])
+        )
+    )
+    return n_slower
+
+
+def _prepare_dataset(data_dir, params):
+    if os.path.isfile(os.path.join(data_dir, 'manifest.json')):
+        manifest = load_manifest(data_dir=data_dir)
+        if all(manifest['params'].get(k) == v for k, v in params.items()):
+            print_log('Reuse a synthetic dataset:\t{}'.format(data_dir))
+            return manifest
+    generate_dataset(out_dir=data_dir, **params)
+    return load_manifest(data_dir=data_dir)
+
+
+def _msir_args(*args):
+    return [
+        sys.executable, '-c', 'from msir.cli.main import main; main()', *args
+    ]
+
+
+def _measure_startup(size, data_dir, paths, repeats=3):
+    bed_path = os.path.join(data_dir, 'startup.bed')
+    with open(paths['bed']) as f, open(bed_path, 'w') as o:
+        o.write(f.readline())
+    return [
+        _measure(
+            size=size, stage='startup', mode=m, processes=1, n_items=1,
+            unit='runs', args=_msir_args(*a), repeats=repeats,
+            log_dir=data_dir
+        ) for m, a in [
+            ('version', ['--version']),
+            (
+                'id', [
+                    'id', '--no-cache', '--processes=1',
+                    '--unit-tsv={}'.format(
+                        os.path.join(data_dir, 'startup.tsv')
+                    ),
+                    bed_path, paths['fasta']
+                ]
+            )
+        ]
+    ]
+
+
+def _measure(size, stage, mode, processes, args, repeats=3, n_items=None,
+             unit=None, log_dir='.'):
+    logger = logging.getLogger(__name__)
+    env = {
+        **os.environ,
+        'PYTHONPATH': os.pathsep.join(
+            [_REPO_DIR, *[p for p in [os.environ.get('PYTHONPATH')] if p]]
+        )
+    }
+    log_path = os.path.join(
+        log_dir, '{0}.{1}.{2}.log'.format(stage, mode, processes)
+    )
+    seconds = list()
+    peak_rss = 0
+    for _ in range(repeats):
+        logger.debug('args: {}'.format(args))
+        with open(log_path, 'w') as log:
+            t0 = time.perf_counter()
+            p = subprocess.Popen(
+                args=args,
+                stdout=(subprocess.PIPE if stage in _STAGES else log),
+                stderr=(log if stage in _STAGES else subprocess.STDOUT),
+                env=env, cwd=log_dir
+            )
+            outs = p.stdout.read() if p.stdout else b''
+            _, status, rusage = os.wait4(p.pid, 0)
+            t1 = time.perf_counter()
+            if p.stdout:
+                p.stdout.close()
+            p.returncode = os.waitstatus_to_exitcode(status)
+        if p.returncode != 0:
+            raise BenchmarkError(
+                'benchmark failed ({0}): {1}'.format(p.returncode, log_path)
+            )
+        peak_rss = max(peak_rss, rusage.ru_maxrss)
+        if stage in _STAGES:
+            timed = json.loads(outs.decode('utf-8'))
+            seconds.append(timed['seconds'])
+            n_items, unit = timed['n_items'], timed['unit']
+        else:
+            seconds.append(t1 - t0)
+    median_seconds = statistics.median(seconds)
+    result = {
+        'size': size, 'stage': stage, 'mode': mode, 'processes': processes,
+        'n_items': n_items, 'unit': unit, 'seconds': seconds,
+        'median_seconds': median_seconds,
+        'throughput': n_items / median_seconds,
+        'peak_rss_mb': peak_rss * _RSS_UNIT_SIZE / 1024 / 1024
+    }
+    print(
+        '  {0}\t{1}\t{2:.3f} s\t{3:.1f} {4}/s\t{5:.1f} MB'.format(
+            stage, mode, median_seconds, result['throughput'], unit,
+            result['peak_rss_mb']
+        ), flush=True
+    )
+    return result
+
+
+def _time_stage(name, data_dir):
+    manifest = load_manifest(data_dir=data_dir)
+    paths = manifest['paths']
+    if name == 'units':
+        from msir.util.biotools import iterate_unique_repeat_units
+        n_loops = 20
+        t0 = time.perf_counter()
+        for _ in range(n_loops):
+            for _ in iterate_unique_repeat_units(max_unit_len=6):
+                pass
+        return {
+            'n_items': n_loops, 'unit': 'loops',
+            'seconds': time.perf_counter() - t0
+        }
+    elif name in ['regex', 'scan']:
+        from msir.call.identifier import extract_longest_repeat_df
+        from msir.call.matcher import _compile_repeat_unit_regex_patterns
+        from msir.util.faidx import IndexedFasta
+        with IndexedFasta(path=paths['fasta']) as fa, \
+                open(paths['bed']) as f:
+            seqs = list()
+            for s in f:
+                chrom, start, end = s.split('\t')[:3]
+                seqs.append(fa.fetch(chrom, int(start) - 20, int(end) + 20))
+        t0 = time.perf_counter()
+        if name == 'regex':
+            matcher = _compile_repeat_unit_regex_patterns(
+                max_unit_len=8, min_rep_times=2
+            )
+        else:
+            matcher = {'engine': 'scan', 'max_unit_len': 8, 'min_rep_times': 2}
+        for s in seqs:
+            extract_longest_repeat_df(
+                sequence=s, regex_patterns=matcher, min_rep_len=5,
+                flanking_len=5
+            )
+        return {
+            'n_items': len(seqs), 'unit': 'loci',
+            'seconds': time.perf_counter() - t0
+        }
+    elif name == 'sam_parse':
+        from msir.util.samrecord import parse_sam_line
+        n = 0
+        t0 = time.perf_counter()
+        for p in [paths['normal'], paths['tumor']]:
+            with open(p) as f:
+                for s in f:
+                    if not s.startswith('@'):
+                        parse_sam_line(line=s)
+                        n += 1
+        return {
+            'n_items': n, 'unit': 'reads',
+            'seconds': time.perf_counter() - t0
+        }
+    elif name == 'spawn':
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import get_context
+        from msir.call.matcher import init_matcher_worker, \
+            match_repeat_units
+        from msir.util.metrics import init_profiled_worker
+        n_loops = 5
+        t0 = time.perf_counter()
+        for _ in range(n_loops):
+            with ProcessPoolExecutor(
+                    max_workers=1, mp_context=get_context('spawn'),
+                    initializer=init_profiled_worker,
+                    initargs=(
+                        None, init_matcher_worker,
+                        {'engine': 'scan', 'max_unit_len': 8,
+                         'min_rep_times': 2},
+                        5, 5
+                    )
+            ) as ppx:
+                ppx.submit(match_repeat_units, []).result()
+        return {
+            'n_items': n_loops, 'unit': 'workers',
+            'seconds': time.perf_counter() - t0
+        }
+    else:
+        raise ValueError('invalid stage: {}'.format(name))
+
+
+def _add_scaling_efficiency(results):
+    groups = dict()
+    for r in results:
+        groups.setdefault((r['size'], r['stage'], r['mode']), []).append(r)
+    for rs in groups.values():
+        base = min(rs, key=lambda r: r['processes'])
+        for r in rs:
+            r['scaling_efficiency'] = (
+                base['median_seconds'] * base['processes']
+                / (r['median_seconds'] * r['processes'])
+            )
+
+
+def _result_key(result):
+    return (
+        result['size'], result['stage'], result['mode'], result['processes']
+    )
+
+
+def _fetch_environment():
+    git = ['git', '-C', _REPO_DIR]
+    try:
+        commit = subprocess.run(
+            args=[*git, 'rev-parse', 'HEAD'], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, check=True
+        ).stdout.decode('utf-8').strip()
+        dirty = bool(
+            subprocess.run(
+                args=[*git, 'status', '--porcelain', '--untracked-files=no'],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+            ).stdout.strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        'msir_version': __version__, 'commit': commit, 'dirty': dirty,
+        'python': platform.python_version(), 'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def _print_results(results):
+    print('\t'.join([
+        'size', 'stage', 'mode', 'processes', 'median_s', 'throughput',
+        'peak_rss_mb', 'scaling_efficiency'
+    ]))
+    for r in results:
+        print('\t'.join([
+            *[str(v) for v in _result_key(r)],
+            '{:.3f}'.format(r['median_seconds']),
+            '{0:.1f} {1}/s'.format(r['throughput'], r['unit']),
+            '{:.1f}'.format(r['peak_rss_mb']),
+            '{:.2f}'.format(r['scaling_efficiency'])
+        ]), flush=True)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Minimal samtools stand-in backed by pysam for benchmarks
+
+Usage:
+    samtools view [-q <int>] [-f <int>] [-F <int>] <bam> [<region>...]
+    samtools index [-@ <int>] <bam>
+
+Options:
+    -q <int>                Skip reads with MAPQ below this [default: 0]
+    -f <int>                Use only reads with all of these FLAG bits
+                            [default: 0]
+    -F <int>                Skip reads with any of these FLAG bits
+                            [default: 0]
+    -@ <int>                Ignored
+"""
+
+import os
+import stat
+import sys
+from docopt import docopt
+
+
+def main(argv=None):
+    args = docopt(__doc__, argv=argv)
+    import pysam
+    if args['view']:
+        min_mapq = int(args['-q'])
+        include_flags = int(args['-f'], 0)
+        exclude_flags = int(args['-F'], 0)
+        with pysam.AlignmentFile(args['<bam>']) as f:
+            reads = (
+                f.fetch(region=r) for r in args['<region>']
+            ) if args['<region>'] else [f.fetch(until_eof=True)]
+            for rs in reads:
+                for r in rs:
+                    if (r.mapping_quality >= min_mapq
+                            and r.flag & include_flags == include_flags
+                            and not r.flag & exclude_flags):
+                        sys.stdout.write(r.to_string() + '\n')
+    elif args['index']:
+        pysam.index(args['<bam>'])
+
+
+def write_samtools_wrapper(path):
+    with open(path, 'w') as f:
+        f.write(
+            '#!/bin/sh\nPYTHONPATH={0} exec {1} -m bench.samtools "$@"\n'
+            .format(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                sys.executable
+            )
+        )
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+import json
+import os
+import random
+import subprocess
+from msir.util.biotools import iterate_unique_repeat_units
+from msir.util.helper import fetch_abspath, fetch_executable, print_log
+
+
+SIZES = {
+    'tiny': {
+        'n_chroms': 1, 'chrom_len': 200000, 'n_loci': 200, 'depth': 20
+    },
+    'small': {
+        'n_chroms': 2, 'chrom_len': 1000000, 'n_loci': 2000, 'depth': 30
+    },
+    'medium': {
+        'n_chroms': 4, 'chrom_len': 5000000, 'n_loci': 20000, 'depth': 30
+    },
+    'large': {
+        'n_chroms': 8, 'chrom_len': 20000000, 'n_loci': 100000, 'depth': 40
+    }
+}
+
+_SAMPLES = ['normal', 'tumor']
+
+
+def generate_dataset(out_dir, n_chroms=1, chrom_len=200000, n_loci=200,
+                     depth=20, read_len=150, max_unit_len=6,
+                     instability=0.3, stutter=0.05, seed=0):
+    out = fetch_abspath(out_dir)
+    os.makedirs(out, exist_ok=True)
+    rng = random.Random(seed)
+    print_log('Generate a synthetic dataset:\t{}'.format(out))
+    if read_len < 120:
+        raise ValueError('read length too short: {}'.format(read_len))
+    margin = read_len + 50
+    chrom_lens = {
+        'chr{}'.format(i + 1): chrom_len for i in range(n_chroms)
+    }
+    loci_per_chrom = -(-n_loci // n_chroms)
+    if chrom_len < loci_per_chrom * margin * 2 + margin * 2:
+        raise ValueError(
+            'chromosomes too short for {} loci'.format(n_loci)
+        )
+    units = [
+        u for u in iterate_unique_repeat_units(max_unit_len=max_unit_len)
+    ]
+    genome = dict()
+    loci = list()
+    for chrom, cl in chrom_lens.items():
+        seq = rng.choices('ACGT', k=cl)
+        n = min(loci_per_chrom, n_loci - len(loci))
+        step = (cl - margin * 2) // max(n, 1)
+        for i in range(n):
+            unit = rng.choice(units)
+            times = rng.randint(max(3, -(-10 // len(unit))), 40 // len(unit))
+            start = margin + step * i + rng.randrange(step - margin)
+            end = start + len(unit) * times
+            seq[start:end] = unit * times
+            seq[start - 1] = _pick_other_base(rng, unit[-1])
+            seq[end] = _pick_other_base(rng, unit[0])
+            loci.append((chrom, start, end, unit, times))
+        genome[chrom] = ''.join(seq)
+    paths = {
+        'fasta': os.path.join(out, 'genome.fa'),
+        'bed': os.path.join(out, 'loci.bed'),
+        'truth': os.path.join(out, 'truth.tsv'),
+        **{s: os.path.join(out, '{}.sam'.format(s)) for s in _SAMPLES}
+    }
+    _write_fasta(path=paths['fasta'], genome=genome)
+    with open(paths['bed'], 'w') as f:
+        for chrom, start, end, _, _ in loci:
+            f.write('{0}\t{1}\t{2}\n'.format(chrom, start, end))
+    truth = {s: list() for s in _SAMPLES}
+    n_reads = dict()
+    for s in _SAMPLES:
+        n_reads[s] = _write_sam(
+            path=paths[s], sample=s, genome=genome, loci=loci, depth=depth,
+            read_len=read_len, stutter=stutter, rng=rng, truth=truth[s],
+            instability=(instability if s == 'tumor' else 0)
+        )
+        print('  {0}:\t{1} reads'.format(paths[s], n_reads[s]), flush=True)
+        bam_path = _convert_sam_to_bam(sam_path=paths[s])
+        if bam_path:
+            paths['{}_bam'.format(s)] = bam_path
+            print('  {}'.format(bam_path), flush=True)
+    with open(paths['truth'], 'w') as f:
+        f.write('chrom\tchromStart\tchromEnd\trepeat_unit\tref_times\t')
+        f.write('\t'.join('{}_times'.format(s) for s in _SAMPLES) + '\n')
+        for i, (chrom, start, end, unit, times) in enumerate(loci):
+            f.write(
+                '{0}\t{1}\t{2}\t{3}\t{4}\t{5}\n'.format(
+                    chrom, start, end, unit, times,
+                    '\t'.join(str(truth[s][i]) for s in _SAMPLES)
+                )
+            )
+    params = {
+        'n_chroms': n_chroms, 'chrom_len': chrom_len, 'n_loci': len(loci),
+        'depth': depth, 'read_len': read_len, 'max_unit_len': max_unit_len,
+        'instability': instability, 'stutter': stutter, 'seed': seed
+    }
+    manifest = {
+        'params': params, 'n_reads': n_reads,
+        'paths': {k: os.path.basename(v) for k, v in paths.items()}
+    }
+    with open(os.path.join(out, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(data_dir):
+    d = fetch_abspath(data_dir)
+    with open(os.path.join(d, 'manifest.json')) as f:
+        manifest = json.load(f)
+    manifest['paths'] = {
+        k: os.path.join(d, v) for k, v in manifest['paths'].items()
+    }
+    return manifest
+
+
+def _convert_sam_to_bam(sam_path):
+    bam_path = os.path.splitext(sam_path)[0] + '.bam'
+    try:
+        import pysam
+    except ImportError:
+        samtools = fetch_executable('samtools')
+        if not samtools:
+            return None
+        subprocess.run(
+            args=[samtools, 'view', '-b', '-o', bam_path, sam_path],
+            check=True
+        )
+        subprocess.run(args=[samtools, 'index', bam_path], check=True)
+    else:
+        with pysam.AlignmentFile(sam_path, 'r') as fi:
+            with pysam.AlignmentFile(bam_path, 'wb', template=fi) as fo:
+                for r in fi:
+                    fo.write(r)
+        pysam.index(bam_path)
+    return bam_path
+
+
+def _pick_other_base(rng, base):
+    return rng.choice([b for b in 'ACGT' if b != base])
+
+
+def _write_fasta(path, genome, line_len=60):
+    with open(path, 'w') as f:
+        for chrom, seq in genome.items():
+            f.write('>{}\n'.format(chrom))
+            for i in range(0, len(seq), line_len):
+                f.write(seq[i:(i + line_len)] + '\n')
+
+
+def _write_sam(path, sample, genome, loci, depth, read_len, instability,
+               stutter, rng, truth):
+    records = list()
+    for i, (chrom, start, end, unit, times) in enumerate(loci):
+        ref = genome[chrom]
+        if rng.random() < instability:
+            allele = max(1, times - rng.choice([1, 1, 2, 2, 3, 4]))
+        else:
+            allele = times
+        truth.append(allele)
+        for k in range(depth):
+            t = allele
+            if rng.random() < stutter:
+                t = max(1, t + rng.choice([-1, 1]))
+            records.append(
+                _simulate_read(
+                    ref=ref, chrom=chrom, start=start, end=end, unit=unit,
+                    times=times, alt_times=t, read_len=read_len, rng=rng,
+                    name='{0}:{1}:{2}'.format(sample, i, k)
+                )
+            )
+    chrom_ranks = {c: i for i, c in enumerate(genome)}
+    records.sort(key=lambda r: (chrom_ranks[r[2]], r[3], r[0]))
+    with open(path, 'w') as f:
+        f.write('@HD\tVN:1.6\tSO:coordinate\n')
+        for chrom, seq in genome.items():
+            f.write('@SQ\tSN:{0}\tLN:{1}\n'.format(chrom, len(seq)))
+        f.write('@RG\tID:{0}\tSM:{0}\n'.format(sample))
+        for r in records:
+            f.write(
+                '{0}\t{1}\t{2}\t{3}\t60\t{4}\t*\t0\t0\t{5}\t{6}'
+                '\tRG:Z:{7}\n'.format(*r, 'I' * len(r[5]), sample)
+            )
+    return len(records)
+
+
+def _simulate_read(ref, chrom, start, end, unit, times, alt_times, read_len,
+                   rng, name, min_flank_len=30):
+    alt_len = len(unit) * alt_times
+    offset = rng.randint(
+        min_flank_len, read_len - alt_len - min_flank_len
+    )
+    left = ref[(start - offset):start]
+    seq = (left + unit * alt_times + ref[end:(end + read_len)])[:read_len]
+    shared_len = offset + len(unit) * min(times, alt_times)
+    indel_len = abs(alt_times - times) * len(unit)
+    if alt_times > times:
+        cigar = '{0}M{1}I{2}M'.format(
+            shared_len, indel_len, read_len - shared_len - indel_len
+        )
+    elif alt_times < times:
+        cigar = '{0}M{1}D{2}M'.format(
+            shared_len, indel_len, read_len - shared_len
+        )
+    else:
+        cigar = '{}M'.format(read_len)
+    flag = rng.choice([0, 16])
+    return (name, flag, chrom, start - offset + 1, cigar, seq)
@@ -1,127 +1,754 @@
 #!/usr/bin/env python
 
-from collections import OrderedDict
-from concurrent.futures import as_completed, ProcessPoolExecutor
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import logging
 import os
+import random
+import tempfile
+import time
 import traceback
+import numpy as np
 import pandas as pd
-from ..util.helper import fetch_abspath, print_log, validate_files_and_dirs
+from ..util.bamreader import calculate_alignment_end, \
+    estimate_region_bytes, make_read_filter, open_bam_reader, \
+    reset_bam_readers
+from ..util.helper import fetch_abspath, print_log, \
+    run_tasks_with_bounded_queue, validate_files_and_dirs
+from ..util.metrics import init_profiled_worker, Metrics, ProgressReporter, \
+    task_metrics
 from ..util.biotools import convert_bed_line_to_sam_region, \
-    validate_or_prepare_bam_indexes, view_bam_lines_including_region
-from .identifier import compile_str_regex, extract_longest_repeat_df
+    validate_or_prepare_bam_indexes
+from ..util.cache import make_cache_key
+from ..util.catalog import RepeatCatalog, write_repeat_catalog
+from ..util.checkpoint import describe_input_file, make_catalog_digest, \
+    make_checkpoint_path, TaskCheckpoint
+from ..util.shard import find_shard_range, parse_shard, \
+    write_shard_manifest
+from ..util.tablewriter import OrderedTableWriter
+from .matcher import compile_str_regex, extract_flanked_repeat, \
+    extract_longest_repeat
 
 
 def detect_tandem_repeats_in_reads(bam_paths, trunit_tsv_path, obs_tsv_path,
                                    index_bam=False, append_read_seq=False,
-                                   samtools=None, n_proc=8):
-    validate_files_and_dirs(files=[trunit_tsv_path, *bam_paths])
-    validate_or_prepare_bam_indexes(
-        bam_paths=bam_paths, index_bam=index_bam, n_proc=n_proc,
-        samtools_path=samtools
+                                   sweep=False, summary=False, reader='auto',
+                                   samtools=None, min_mapq=0, include_flags=0,
+                                   exclude_flags=0, skip_duplicates=False,
+                                   max_reads_per_locus=None, early_stop=None,
+                                   seed=0, max_buffer_mb=256,
+                                   catalog_path=None, catalog=None,
+                                   resume=False, shard=None, metrics=None,
+                                   profile_dir=None, n_proc=8):
+    t0 = time.perf_counter()
+    metrics = metrics or Metrics()
+    validate_files_and_dirs(
+        files=[
+            *([catalog_path or trunit_tsv_path] if catalog is None else []),
+            *[p for p in bam_paths if p != '-']
+        ]
     )
-    print_log('Load repeat units data:\t{}'.format(trunit_tsv_path))
-    df_ru = pd.read_csv(trunit_tsv_path, sep='\t')
-    print_log('Compile regular expression patterns:', end='')
-    regex_dict = _compile_repeat_unit_regex_patterns_from_df(df=df_ru)
-    print('\t{}'.format(len(regex_dict)), flush=True)
-    tsv_abspath = fetch_abspath(obs_tsv_path)
-    if os.path.exists(tsv_abspath):
-        os.remove(tsv_abspath)
-    for i, p in enumerate(bam_paths):
-        print_log('Detect tandem repeats within reads:\t{}'.format(p))
-        df_obs = _extract_repeats_within_reads(
-            bam_path=p, regex_dict=regex_dict, df_ru=df_ru,
-            append_read_seq=append_read_seq, samtools=samtools, n_proc=n_proc
+    if resume and '-' in bam_paths:
+        raise ValueError('reads on stdin cannot be resumed')
+    elif not sweep:
+        validate_or_prepare_bam_indexes(
+            bam_paths=bam_paths, index_bam=index_bam, n_proc=n_proc,
+            samtools_path=samtools
+        )
+    tmp_dir = None
+    if catalog is not None:
+        print_log('Use repeat units in memory:')
+        own_catalog = False
+    else:
+        with metrics.timer('load_catalog'):
+            if catalog_path:
+                print_log('Load a repeat catalog:\t{}'.format(catalog_path))
+            else:
+                print_log(
+                    'Load repeat units data:\t{}'.format(trunit_tsv_path)
+                )
+                tmp_dir = tempfile.TemporaryDirectory()
+                catalog_path = os.path.join(tmp_dir.name, 'tr_unit.msircat')
+                write_repeat_catalog(
+                    tsv_path=trunit_tsv_path, catalog_path=catalog_path
+                )
+            catalog = RepeatCatalog(path=catalog_path)
+        own_catalog = True
+    n_loci = len(catalog)
+    print('  loci:\t{}'.format(n_loci), flush=True)
+    read_filter = make_read_filter(
+        min_mapq=min_mapq, include_flags=include_flags,
+        exclude_flags=exclude_flags, skip_duplicates=skip_duplicates
+    )
+    if read_filter:
+        print_log(
+            'Filter reads:\tmin MAPQ {0}, required FLAG 0x{1:x},'
+            ' excluded FLAG 0x{2:x}'.format(*read_filter)
         )
-        if df_obs.size:
-            print_log('Write observed repeat data:\t{}'.format(obs_tsv_path))
-            df_obs.to_csv(
-                tsv_abspath, header=(not os.path.exists(tsv_abspath)),
-                mode='a', sep=(',' if tsv_abspath.endswith('.csv') else '\t')
+    sampling = make_read_sampling(
+        max_reads_per_locus=max_reads_per_locus, early_stop=early_stop,
+        seed=seed
+    )
+    if sampling:
+        print_log(
+            'Sample reads per locus:\tmax {0}, tolerance {1}, seed {2}'.format(
+                *[
+                    ('-' if sampling[k] is None else sampling[k])
+                    for k in ['max_reads', 'tolerance', 'seed']
+                ]
             )
-        else:
-            print_log('No repeats were detected:\t{}'.format(p))
+        )
+    shard = parse_shard(shard) if shard else None
+    locus_ranges = _make_locus_ranges(
+        bam_paths=bam_paths, catalog=catalog, shard=shard
+    )
+    n_tasks = sum(len(r) for r in locus_ranges)
+    if shard:
+        print_log(
+            'Process a shard of loci:\t{0}/{1} ({2}/{3} sample loci)'.format(
+                shard[0] + 1, shard[1], n_tasks, n_loci * len(bam_paths)
+            )
+        )
+    key_offsets = [
+        sum(len(r) for r in locus_ranges[:i]) - r.start
+        for i, r in enumerate(locus_ranges)
+    ]
+    print_log('Detect tandem repeats within reads:')
+    for p in bam_paths:
+        print('  {}'.format(p), flush=True)
+    n_done = [0 for _ in bam_paths]
+    n_rows = [0 for _ in bam_paths]
+    read_counts = [Counter() for _ in bam_paths]
+    progress = ProgressReporter(total=n_tasks)
+    try:
+        checkpoint = None
+        if resume:
+            with metrics.timer('checkpoint'):
+                checkpoint = TaskCheckpoint(
+                    path=make_checkpoint_path(obs_tsv_path),
+                    fingerprint=make_cache_key(
+                        _CHECKPOINT_VERSION,
+                        *[describe_input_file(p) for p in bam_paths],
+                        make_catalog_digest(catalog), append_read_seq,
+                        summary, read_filter, sampling, shard
+                    )
+                )
+            print_log(
+                'Resume from a checkpoint:\t{0} ({1} parts)'.format(
+                    checkpoint.path, len(checkpoint)
+                )
+            )
+        with OrderedTableWriter(
+                path=obs_tsv_path,
+                max_buffer_size=(int(max_buffer_mb) * 1024 * 1024),
+                keep_empty=bool(shard)
+        ) as writer:
+            for i, results in _iterate_resumed_results(
+                    checkpoint=checkpoint, bam_paths=bam_paths,
+                    catalog=catalog, ids=(locus_ranges if shard else None),
+                    sweep=sweep,
+                    append_read_seq=append_read_seq, summary=summary,
+                    reader=reader, samtools=samtools,
+                    read_filter=read_filter, sampling=sampling,
+                    metrics=metrics, profile_dir=profile_dir, n_proc=n_proc
+            ):
+                for id, df_locus, c in results:
+                    with metrics.timer('write'):
+                        writer.write(key=(key_offsets[i] + id), df=df_locus)
+                    n_rows[i] += df_locus.shape[0]
+                    read_counts[i].update(c)
+                    metrics.counts['reads'] += c['total']
+                n_done[i] += len(results)
+                metrics.counts['loci'] += len(results)
+                progress.update(len(results))
+                if n_done[i] == len(locus_ranges[i]):
+                    _print_sample_summary(
+                        bam_path=bam_paths[i], n=n_rows[i],
+                        read_counts=read_counts[i]
+                    )
+        if shard:
+            write_shard_manifest(path=obs_tsv_path, shard=shard)
+        if checkpoint is not None:
+            checkpoint.remove()
+    finally:
+        if own_catalog:
+            catalog.close()
+        if tmp_dir:
+            tmp_dir.cleanup()
+    progress.close()
+    metrics.counts['rows'] += writer.n_rows
+    if writer.n_rows:
+        print_log('Write observed repeat data:\t{}'.format(obs_tsv_path))
+    metrics.seconds['total'] += time.perf_counter() - t0
     print_log('All the processes done.')
 
 
-def _compile_repeat_unit_regex_patterns_from_df(df):
-    return {
-        i: {
-            'patterns': {
-                r['repeat_unit']: compile_str_regex(
-                    repeat_unit=r['repeat_unit'], min_rep_times=1,
-                    left_seq=r['left_seq'], right_seq=r['right_seq']
+def iterate_observed_repeats(bam_paths, catalog, regions=None, sweep=False,
+                             summary=False, append_read_seq=False,
+                             reader='auto', samtools=None, min_mapq=0,
+                             include_flags=0, exclude_flags=0,
+                             skip_duplicates=False, max_reads_per_locus=None,
+                             early_stop=None, seed=0, executor=None,
+                             metrics=None, profile_dir=None, n_proc=8):
+    validate_files_and_dirs(files=[p for p in bam_paths if p != '-'])
+    metrics = metrics or Metrics()
+    locus_results = dict()
+    j_next = 0
+    for i, j, results in _iterate_locus_results(
+            bam_paths=bam_paths, catalog=catalog,
+            ids=(
+                None if regions is None
+                else [catalog.find_loci(regions)] * len(bam_paths)
+            ),
+            sweep=sweep, append_read_seq=append_read_seq, summary=summary,
+            reader=reader, samtools=samtools,
+            read_filter=make_read_filter(
+                min_mapq=min_mapq, include_flags=include_flags,
+                exclude_flags=exclude_flags, skip_duplicates=skip_duplicates
+            ),
+            sampling=make_read_sampling(
+                max_reads_per_locus=max_reads_per_locus,
+                early_stop=early_stop, seed=seed
+            ),
+            executor=executor, metrics=metrics, profile_dir=profile_dir,
+            n_proc=n_proc
+    ):
+        metrics.counts['loci'] += len(results)
+        locus_results[j] = results
+        while j_next in locus_results:
+            for _, df_locus, c in locus_results.pop(j_next):
+                metrics.counts['reads'] += c['total']
+                yield from _convert_df_to_records(
+                    df=df_locus, summary=summary
                 )
-            },
-            'left_seq': r['left_seq'], 'right_seq': r['right_seq']
-        } for i, r in df.iterrows()
+            j_next += 1
+
+
+def make_detection_executor(catalog, append_read_seq=False, summary=False,
+                            max_open_bams=64, sampling=None, profile_dir=None,
+                            n_proc=8):
+    return ProcessPoolExecutor(
+        max_workers=n_proc, initializer=init_profiled_worker,
+        initargs=(
+            profile_dir, _init_worker, catalog, append_read_seq, summary,
+            max_open_bams, sampling
+        )
+    )
+
+
+def make_read_sampling(max_reads_per_locus=None, early_stop=None, seed=0):
+    if not (max_reads_per_locus or early_stop):
+        return None
+    sampling = {
+        'max_reads': (int(max_reads_per_locus) if max_reads_per_locus
+                      else None),
+        'tolerance': (float(early_stop) if early_stop else None),
+        'seed': int(seed)
     }
+    if sampling['max_reads'] is not None and sampling['max_reads'] < 1:
+        raise ValueError(
+            'invalid max reads per locus: {}'.format(max_reads_per_locus)
+        )
+    elif sampling['tolerance'] is not None and sampling['tolerance'] <= 0:
+        raise ValueError('invalid early stop: {}'.format(early_stop))
+    return sampling
 
 
-def _extract_repeats_within_reads(bam_path, regex_dict, df_ru, append_read_seq,
-                                  samtools, n_proc=8):
-    logger = logging.getLogger(__name__)
-    ppx = ProcessPoolExecutor(max_workers=n_proc)
-    fs = [
-        ppx.submit(
-            _extract_repeats_at_region, bam_path, line, id, regex_dict,
-            append_read_seq, samtools
-        ) for id, line in df_ru.iterrows()
+class ReadOrderError(RuntimeError):
+    pass
+
+
+def _make_locus_ranges(bam_paths, catalog, shard=None, max_cost=1000):
+    n_loci = len(catalog)
+    if not shard:
+        return [range(n_loci) for _ in bam_paths]
+    elif '-' in bam_paths:
+        raise ValueError('reads on stdin cannot be sharded')
+    elif not n_loci:
+        return [range(0) for _ in bam_paths]
+    regions = [None] * n_loci
+    for chrom, (_, loci) in catalog.make_locus_index().items():
+        for start_pos, end_pos, id in loci:
+            regions[id] = (chrom, start_pos, end_pos)
+    sizes = [os.path.getsize(fetch_abspath(p)) for p in bam_paths]
+    costs = list()
+    for p, s in zip(bam_paths, sizes):
+        weights = np.array(
+            estimate_region_bytes(bam_path=p, regions=regions)
+            or np.ones(n_loci), dtype=np.float64
+        )
+        if not weights.sum():
+            weights[:] = 1
+        costs.append(
+            np.maximum(
+                1, np.rint(
+                    weights * (n_loci * max_cost * s / max(max(sizes), 1))
+                    / weights.sum()
+                )
+            ).astype(np.int64)
+        )
+    total_cost = sum(int(c.sum()) for c in costs)
+    return [
+        find_shard_range(
+            costs=c, total_cost=total_cost, shard=shard,
+            start_cost=sum(int(d.sum()) for d in costs[:i])
+        ) for i, c in enumerate(costs)
     ]
+
+
+def _iterate_resumed_results(checkpoint, bam_paths, **kwargs):
+    done_ids = [set() for _ in bam_paths]
+    if checkpoint is not None:
+        for i, results in checkpoint.load():
+            done_ids[i].update(r[0] for r in results)
+            yield i, results
+    for i, _, results in _iterate_locus_results(
+            bam_paths=bam_paths, done_ids=done_ids, **kwargs
+    ):
+        if checkpoint is not None:
+            checkpoint.save(
+                name='{0}.{1}'.format(i, results[0][0]), obj=(i, results)
+            )
+        yield i, results
+
+
+def _iterate_locus_results(bam_paths, catalog, ids=None, done_ids=None,
+                           sweep=False, append_read_seq=False, summary=False,
+                           reader='auto', samtools=None, read_filter=None,
+                           sampling=None, executor=None, metrics=None,
+                           profile_dir=None, n_proc=8):
+    logger = logging.getLogger(__name__)
+    ppx = executor or make_detection_executor(
+        catalog=catalog, append_read_seq=append_read_seq, summary=summary,
+        sampling=sampling, profile_dir=profile_dir, n_proc=n_proc
+    )
     try:
-        df_obs = pd.concat(
-            [f.result() for f in as_completed(fs)], sort=False
-        )
+        with metrics.timer('pool'):
+            for (i, j), results in run_tasks_with_bounded_queue(
+                    executor=ppx,
+                    tasks=_iterate_sample_tasks(
+                        bam_paths=bam_paths, catalog=catalog, ids=ids,
+                        done_ids=done_ids, sweep=sweep, reader=reader,
+                        samtools=samtools, read_filter=read_filter,
+                        metrics=metrics, n_proc=n_proc
+                    ),
+                    max_in_flight=(n_proc * 4), metrics=metrics
+            ):
+                yield i, j, results
     except Exception as e:
         logger.error(os.linesep + traceback.format_exc())
-        ppx.shutdown(wait=False)
+        if not executor:
+            ppx.shutdown(wait=False)
         raise e
+    except GeneratorExit:
+        if not executor:
+            ppx.shutdown(wait=False, cancel_futures=True)
+        raise
+    else:
+        if not executor:
+            ppx.shutdown(wait=True)
+
+
+def _convert_df_to_records(df, summary=False):
+    if not df.size:
+        return list()
+    rows = df.reset_index().to_dict(orient='records')
+    if summary:
+        return [
+            OrderedDict([
+                *[
+                    (k, rows[0][k]) for k in [*_LOCUS_COLS, *_SAMPLING_COLS]
+                    if k in rows[0]
+                ],
+                (
+                    'read_counts', OrderedDict([
+                        (r['observed_repeat_times'], r['read_count'])
+                        for r in rows if r['read_count']
+                    ])
+                )
+            ])
+        ]
+    else:
+        return [OrderedDict(r) for r in rows]
+
+
+def _print_sample_summary(bam_path, n, read_counts):
+    print_log(
+        'Reject reads lacking flanks:\t{0}\t{1}/{2}'.format(
+            bam_path, read_counts['rejected'], read_counts['total']
+        )
+    )
+    if read_counts['spanning'] > read_counts['total']:
+        print_log(
+            'Skip reads over the per-locus limit:\t{0}\t{1}/{2}'.format(
+                bam_path, read_counts['spanning'] - read_counts['total'],
+                read_counts['spanning']
+            )
+        )
+    if n:
+        print_log('Detected repeats:\t{0}\t{1} rows'.format(bam_path, n))
     else:
-        logger.debug('df_obs:{0}{1}'.format(os.linesep, df_obs))
-        ppx.shutdown(wait=True)
-    if df_obs.size:
-        return df_obs.sort_values(by='bed_id').drop(columns='bed_id')
+        print_log('No repeats were detected:\t{}'.format(bam_path))
+
+
+_CHECKPOINT_VERSION = 1
+
+_BED_COLS = ['chrom', 'chromStart', 'chromEnd']
+
+_LOCUS_COLS = [
+    'sam_path', *_BED_COLS, 'sam_region', 'repeat_unit', 'repeat_unit_length',
+    'referenced_repeat_times', 'left_seq', 'right_seq'
+]
+
+_SAMPLING_COLS = ['max_reads', 'spanning_reads', 'matched_reads']
+
+_worker_state = dict()
+
+
+def _init_worker(catalog, append_read_seq=False, summary=False,
+                 max_open_bams=64, sampling=None):
+    reset_bam_readers(max_size=max_open_bams)
+    _worker_state.update({
+        'catalog': catalog, 'append_read_seq': append_read_seq,
+        'summary': summary, 'sampling': sampling
+    })
+
+
+@lru_cache(maxsize=None)
+def _compile_locus_regex_patterns(repeat_unit, left_seq, right_seq):
+    return {
+        'patterns': {
+            repeat_unit: compile_str_regex(
+                repeat_unit=repeat_unit, min_rep_times=1, left_seq=left_seq,
+                right_seq=right_seq
+            )
+        },
+        'left_seq': left_seq, 'right_seq': right_seq
+    }
+
+
+def _iterate_sample_tasks(bam_paths, catalog, ids=None, done_ids=None,
+                          sweep=False, **kwargs):
+    j = 0
+    for i, p in enumerate(bam_paths):
+        sample_ids = None if ids is None else ids[i]
+        if done_ids and done_ids[i]:
+            sample_ids = [
+                id for id in (
+                    range(len(catalog)) if sample_ids is None else sample_ids
+                ) if id not in done_ids[i]
+            ]
+        if sample_ids is not None and not len(sample_ids):
+            continue
+        for t in (_iterate_sweep_tasks if sweep else _iterate_region_tasks)(
+                bam_path=p, catalog=catalog, ids=sample_ids, **kwargs
+        ):
+            yield ((i, j), *t)
+            j += 1
+
+
+def _iterate_region_tasks(bam_path, catalog, ids=None, reader='auto',
+                          samtools=None, read_filter=None, n_proc=8,
+                          max_chunk_size=100, **kwargs):
+    ids = range(len(catalog)) if ids is None else ids
+    chunk_size = max(1, min(max_chunk_size, -(-len(ids) // (n_proc * 4))))
+    for i in range(0, len(ids), chunk_size):
+        yield _extract_repeats_at_loci, (
+            bam_path, ids[i:(i + chunk_size)], reader, samtools, read_filter
+        )
+
+
+def _iterate_sweep_tasks(bam_path, catalog, ids=None, reader='auto',
+                         samtools=None, read_filter=None, metrics=None,
+                         max_chunk_size=100, **kwargs):
+    bam_reader = open_bam_reader(
+        bam_path=(bam_path if bam_path == '-' else fetch_abspath(bam_path)),
+        reader=reader, samtools_path=samtools, read_filter=read_filter
+    )
+    locus_reads = list()
+    assigned = _assign_reads_to_loci(
+        reads=bam_reader.iterate_reads(),
+        locus_index=_restrict_locus_index(
+            locus_index=catalog.make_locus_index(), ids=ids
+        ),
+        include_empty=True
+    )
+    for t in (metrics.time_iter(assigned, 'fetch') if metrics else assigned):
+        locus_reads.append(t)
+        if len(locus_reads) >= max_chunk_size:
+            yield _extract_repeats_at_swept_loci, (bam_path, locus_reads)
+            locus_reads = list()
+    if locus_reads:
+        yield _extract_repeats_at_swept_loci, (bam_path, locus_reads)
+
+
+def _restrict_locus_index(locus_index, ids=None):
+    if ids is None:
+        return locus_index
     else:
-        return df_obs
+        selected = set(ids)
+        restricted = dict()
+        for chrom, (_, loci) in locus_index.items():
+            kept = [t for t in loci if t[2] in selected]
+            if kept:
+                restricted[chrom] = ([t[0] for t in kept], kept)
+        return restricted
+
+
+def _assign_reads_to_loci(reads, locus_index, include_empty=False):
+    reads_by_locus = dict()
+    chrom = None
+    cursor = 0
+    visited = set()
+    pos = 0
+    for b in reads:
+        if b['RNAME'] != chrom:
+            if b['RNAME'] in visited:
+                raise ReadOrderError(
+                    'reads are not sorted by coordinate:'
+                    ' {0} reappears after {1}'.format(b['RNAME'], chrom)
+                )
+            elif chrom in locus_index:
+                yield from _retire_loci(
+                    loci=locus_index[chrom][1][cursor:],
+                    reads_by_locus=reads_by_locus, include_empty=include_empty
+                )
+            chrom = b['RNAME']
+            cursor = 0
+            visited.add(chrom)
+        elif b['POS'] < pos:
+            raise ReadOrderError(
+                'reads are not sorted by coordinate:'
+                ' {0}:{1} follows {0}:{2}'.format(chrom, b['POS'], pos)
+            )
+        pos = b['POS']
+        if chrom not in locus_index:
+            continue
+        starts, loci = locus_index[chrom]
+        while cursor < len(starts) and starts[cursor] < b['POS']:
+            yield from _retire_loci(
+                loci=loci[cursor:(cursor + 1)], reads_by_locus=reads_by_locus,
+                include_empty=include_empty
+            )
+            cursor += 1
+        end = calculate_alignment_end(
+            flag=b['FLAG'], pos=b['POS'], cigar=b['CIGAR']
+        )
+        for start_pos, end_pos, id in loci[
+                bisect_left(starts, b['POS']):bisect_right(starts, end)
+        ]:
+            if end_pos <= end:
+                reads_by_locus.setdefault(id, list()).append(b)
+    if chrom in locus_index:
+        yield from _retire_loci(
+            loci=locus_index[chrom][1][cursor:],
+            reads_by_locus=reads_by_locus, include_empty=include_empty
+        )
+    if include_empty:
+        for k in sorted(set(locus_index.keys()).difference(visited)):
+            yield from _retire_loci(
+                loci=locus_index[k][1], reads_by_locus=reads_by_locus,
+                include_empty=True
+            )
+
+
+def _retire_loci(loci, reads_by_locus, include_empty=False):
+    for _, _, id in loci:
+        if id in reads_by_locus:
+            yield id, reads_by_locus.pop(id)
+        elif include_empty:
+            yield id, list()
+
+
+def _calculate_spanning_region(tsvline):
+    return (
+        tsvline['repeat_start'] + 1 - len(tsvline['left_seq']),
+        tsvline['repeat_end'] + len(tsvline['right_seq'])
+    )
+
+
+def _extract_repeats_at_loci(bam_path, bed_ids, reader='auto', samtools=None,
+                             read_filter=None):
+    bam_reader = open_bam_reader(
+        bam_path=fetch_abspath(bam_path), reader=reader,
+        samtools_path=samtools, read_filter=read_filter
+    )
+    results = list()
+    for id in bed_ids:
+        tsvline = _worker_state['catalog'][id]
+        start_pos, end_pos = _calculate_spanning_region(tsvline=tsvline)
+        with task_metrics.timer('fetch'):
+            reads = bam_reader.fetch_spanning_reads(
+                rname=tsvline['chrom'], start_pos=start_pos, end_pos=end_pos
+            )
+            if not _worker_state.get('sampling'):
+                reads = list(reads)
+        results.append((
+            id,
+            *_extract_repeats_from_reads(
+                bam_path=bam_path, bed_id=id, reads=reads
+            )
+        ))
+    return results
+
+
+def _extract_repeats_at_swept_loci(bam_path, locus_reads):
+    return [
+        (
+            id,
+            *_extract_repeats_from_reads(
+                bam_path=bam_path, bed_id=id, reads=reads
+            )
+        ) for id, reads in locus_reads
+    ]
 
 
-def _extract_repeats_at_region(bam_path, tsvline, bed_id, regex_dict,
-                               append_read_seq, samtools):
+def _extract_repeats_from_reads(bam_path, bed_id, reads):
     logger = logging.getLogger(__name__)
-    bed_cols = ['chrom', 'chromStart', 'chromEnd']
+    tsvline = _worker_state['catalog'][bed_id]
+    region = convert_bed_line_to_sam_region(tsvline)
+    logger.debug('region: %s', region)
+    read_counts = Counter()
+    hits = list()
+    ru, ls, rs = [
+        tsvline[k] for k in ['repeat_unit', 'left_seq', 'right_seq']
+    ]
+    sampling = _worker_state.get('sampling')
+    if sampling:
+        with task_metrics.timer('fetch'):
+            reads = _sample_reads(
+                reads=reads, bed_id=bed_id, read_counts=read_counts,
+                **sampling
+            )
+        if sampling['tolerance']:
+            reads = _iterate_until_converged(
+                reads=reads, hits=hits, tolerance=sampling['tolerance']
+            )
+    if isinstance(ls, str) and isinstance(rs, str):
+        regex_patterns = None
+    else:
+        with task_metrics.timer('compile_patterns'):
+            regex_patterns = _compile_locus_regex_patterns(
+                repeat_unit=ru, left_seq=(ls if isinstance(ls, str) else ''),
+                right_seq=(rs if isinstance(rs, str) else '')
+            )
+        logger.debug('regex_patterns:\t%s', regex_patterns)
+    t0 = time.perf_counter()
+    if regex_patterns is None:
+        for b in reads:
+            read_counts['total'] += 1
+            seq = b['SEQ']
+            if ls not in seq or rs not in seq:
+                read_counts['rejected'] += 1
+            else:
+                hits.append((
+                    extract_flanked_repeat(
+                        sequence=seq, repeat_unit=ru, left_seq=ls,
+                        right_seq=rs, start_pos=b['POS']
+                    ),
+                    b
+                ))
+    else:
+        for b in reads:
+            read_counts['total'] += 1
+            hits.append((
+                extract_longest_repeat(
+                    sequence=b['SEQ'], regex_patterns=regex_patterns,
+                    min_rep_len=1, flanking_len=0, start_pos=b['POS']
+                ),
+                b
+            ))
+    task_metrics.seconds['match'] += time.perf_counter() - t0
+    with task_metrics.timer('format'):
+        if _worker_state.get('summary'):
+            df_region = _make_repeat_times_hist_df(
+                hits=hits, tsvline=tsvline, bam_path=bam_path, region=region,
+                keep_empty=bool(sampling)
+            )
+        else:
+            df_region = _make_repeat_read_df(
+                hits=hits, tsvline=tsvline, bam_path=bam_path, region=region,
+                append_read_seq=_worker_state.get('append_read_seq')
+            )
+        if sampling and df_region.size:
+            df_region = df_region.assign(
+                max_reads=sampling['max_reads'],
+                spanning_reads=read_counts['spanning'],
+                matched_reads=read_counts['total']
+            )
+    if df_region.size:
+        logger.debug('df_region:%s%s', os.linesep, df_region)
+    return df_region, read_counts
+
+
+def _sample_reads(reads, bed_id, read_counts, max_reads=None, tolerance=None,
+                  seed=0):
+    rng = random.Random('{0}:{1}'.format(seed, bed_id))
+    sampled = list()
+    for b in reads:
+        read_counts['spanning'] += 1
+        if max_reads is None or len(sampled) < max_reads:
+            sampled.append(b)
+        else:
+            x = rng.randrange(read_counts['spanning'])
+            if x < max_reads:
+                sampled[x] = b
+    if tolerance:
+        rng.shuffle(sampled)
+    return sampled
+
+
+def _iterate_until_converged(reads, hits, tolerance, step=100):
+    counts = Counter()
+    last_counts = None
+    n_hits = 0
+    for i, b in enumerate(reads):
+        yield b
+        if (i + 1) % step == 0 and i + 1 < len(reads):
+            counts.update(
+                hit.repeat_times for hit, _ in hits[n_hits:]
+                if hit is not None
+            )
+            n_hits = len(hits)
+            if (counts and last_counts and
+                    _calculate_distribution_distance(
+                        counts, last_counts
+                    ) <= tolerance):
+                break
+            last_counts = Counter(counts)
+
+
+def _calculate_distribution_distance(counts, other_counts):
+    n, m = sum(counts.values()), sum(other_counts.values())
+    return sum(
+        abs(counts[k] / n - other_counts[k] / m)
+        for k in set(counts).union(other_counts)
+    ) / 2
+
+
+def _make_repeat_read_df(hits, tsvline, bam_path, region,
+                         append_read_seq=False):
     sam_cols = [
         'QNAME', 'FLAG', 'RNAME', 'POS', 'MAPQ', 'CIGAR', 'RNEXT', 'PNEXT',
         'TLEN', *(['SEQ', 'QUAL'] if append_read_seq else [])
     ]
-    region = convert_bed_line_to_sam_region(tsvline)
-    logger.debug('region: {}'.format(region))
-    view_args = {
-        'bam_path': fetch_abspath(bam_path), 'rname': tsvline['chrom'],
-        'start_pos': (tsvline['repeat_start'] + 1 - len(tsvline['left_seq'])),
-        'end_pos': (tsvline['repeat_end'] + len(tsvline['right_seq'])),
-        'samtools_path': samtools
-    }
-    region_df_list = []
-    regex_patterns = regex_dict[bed_id]
-    logger.debug('regex_patterns:\t{}'.format(regex_patterns))
-    region_df_list_raw = [
-        extract_longest_repeat_df(
-            sequence=b['SEQ'], regex_patterns=regex_patterns, min_rep_len=1,
-            flanking_len=0, start_pos=b['POS']
-        ).pipe(
-            lambda d: d.drop(
-                columns=['start_x', 'end_x', 'repeat_seq']
-            ).assign(
-                **OrderedDict([(k, b[k]) for k in sam_cols])
-            ) if d.size else d
-        ) for b in view_bam_lines_including_region(**view_args)
+    hit_cols = [
+        'repeat_unit', 'repeat_start', 'repeat_end', 'repeat_unit_length',
+        'left_seq', 'right_seq', 'repeat_seq_length', 'repeat_times'
     ]
-    region_df_list = [d for d in region_df_list_raw if d.size]
-    if not region_df_list:
+    region_cols = OrderedDict([(k, []) for k in [*hit_cols, *sam_cols]])
+    for hit, b in hits:
+        if hit is not None:
+            for k in hit_cols:
+                region_cols[k].append(getattr(hit, k))
+            for k in sam_cols:
+                region_cols[k].append(b[k])
+    if not region_cols['repeat_unit']:
         return pd.DataFrame()
     else:
-        df_region = pd.concat(region_df_list, sort=False).rename(
+        return pd.DataFrame(region_cols).rename(
             columns={
                 'repeat_start': 'observed_repeat_start',
                 'repeat_end': 'observed_repeat_end',
@@ -129,25 +756,28 @@ def _extract_repeats_at_region(bam_path, tsvline, bed_id, regex_dict,
                 'repeat_times': 'observed_repeat_times'
             }
         ).assign(
-            bed_id=bed_id, sam_path=bam_path, sam_region=region,
+            sam_path=bam_path, sam_region=region,
             referenced_repeat_times=tsvline['repeat_times'],
-            **{k: tsvline[k] for k in bed_cols}
-        ).set_index([
-            'sam_path', *bed_cols, 'sam_region', 'repeat_unit',
-            'repeat_unit_length', 'referenced_repeat_times', 'left_seq',
-            'right_seq'
-        ]).sort_index()
-        logger.debug('df_region:{0}{1}'.format(os.linesep, df_region))
-        _print_state_line(region=region, df=df_region, bam_path=bam_path)
-        return df_region
-
-
-def _print_state_line(region, df, bam_path):
-    bam_name = os.path.basename(bam_path)
-    ru = df.reset_index()['repeat_unit'].iloc[0]
-    df_hist = df['observed_repeat_times'].value_counts().to_frame(name='c')
-    for i, r in df_hist.iterrows():
-        line = '  {0}\t{1:<25}\t{2:<10}\t{3}'.format(
-            bam_name, region, '{0}x{1}'.format(i, ru), r['c']
-        )
-        print(line, flush=True)
+            **{k: tsvline[k] for k in _BED_COLS}
+        ).set_index(_LOCUS_COLS).sort_index()
+
+
+def _make_repeat_times_hist_df(hits, tsvline, bam_path, region,
+                               keep_empty=False):
+    counts = Counter(hit.repeat_times for hit, _ in hits if hit is not None)
+    if not (counts or keep_empty):
+        return pd.DataFrame()
+    else:
+        return pd.DataFrame({
+            'observed_repeat_times': (sorted(counts.keys()) or [np.nan]),
+            'read_count': ([counts[k] for k in sorted(counts.keys())] or [0])
+        }).assign(
+            sam_path=bam_path, sam_region=region,
+            referenced_repeat_times=tsvline['repeat_times'],
+            **{
+                k: tsvline[k] for k in [
+                    *_BED_COLS, 'repeat_unit', 'repeat_unit_length',
+                    'left_seq', 'right_seq'
+                ]
+            }
+        ).set_index([*_LOCUS_COLS, 'observed_repeat_times'])
@@ -1,192 +1,720 @@
 #!/usr/bin/env python
 
 from collections import OrderedDict
-from concurrent.futures import as_completed, ProcessPoolExecutor
-from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 import logging
 import os
 import traceback
 from pprint import pformat
-import re
+import time
+import numpy as np
 import pandas as pd
-from ..util.biotools import convert_bed_line_to_sam_region, \
-    iterate_unique_repeat_units, read_fasta, read_bed
-from ..util.helper import fetch_abspath, print_log, validate_files_and_dirs
+from ..util.biotools import iterate_bed_chunks, \
+    iterate_unique_repeat_units
+from ..util.cache import IntervalCache, make_cache_key
+from ..util.catalog import make_catalog_record, MemoryRepeatCatalog, \
+    write_repeat_catalog
+from ..util.checkpoint import describe_input_file, make_checkpoint_path, \
+    TaskCheckpoint
+from ..util.faidx import IndexedFasta
+from ..util.helper import print_log, run_tasks_with_bounded_queue, \
+    validate_files_and_dirs
+from ..util.metrics import init_profiled_worker, Metrics, ProgressReporter, \
+    task_metrics
+from ..util.shard import assign_shards, parse_shard, \
+    write_shard_manifest
+from ..util.tablewriter import OrderedTableWriter
+from .matcher import extract_longest_repeat, init_matcher_worker, \
+    match_repeat_units, RepeatHit
+from .scanner import scan_tandem_repeats
 
 
 def identify_repeat_units_on_bed(bed_path, genome_fa_path, trunit_tsv_path,
                                  max_unit_len=6, min_rep_times=3,
                                  min_rep_len=10, flanking_len=10,
-                                 ex_region_len=20, n_proc=8):
+                                 ex_region_len=20, engine='scan',
+                                 bed_chunksize=100000, max_buffer_mb=256,
+                                 no_cache=False, cache_dir=None,
+                                 max_cache_mb=1024, catalog_path=None,
+                                 return_catalog=False, resume=False,
+                                 shard=None, metrics=None, profile_dir=None,
+                                 n_proc=8):
+    t0 = time.perf_counter()
+    metrics = metrics or Metrics()
     validate_files_and_dirs(files=[bed_path, genome_fa_path])
-    print_log('Load input data:')
-    df_exbed = _make_extented_bed_df(
-        bed_path=bed_path, genome_fa_path=genome_fa_path,
-        ex_region_len=int(ex_region_len)
-    )
-    print_log('Compile regular expression patterns:', end='')
-    regex_patterns = _compile_repeat_unit_regex_patterns(
-        max_unit_len=int(max_unit_len), min_rep_times=int(min_rep_times)
+    matcher_args = _make_matcher_args(
+        engine=engine, max_unit_len=max_unit_len, min_rep_times=min_rep_times
     )
-    print('\t{}'.format(len(regex_patterns['patterns'])), flush=True)
+    if engine == 'regex':
+        print_log(
+            'Use regular expression patterns:\t{}'.format(
+                sum(1 for _ in iterate_unique_repeat_units(
+                    max_unit_len=int(max_unit_len)
+                ))
+            )
+        )
+    else:
+        print_log(
+            'Scan tandem repeats with unit lengths:\t1-{}'.format(max_unit_len)
+        )
+    print_log('Load input data:')
+    print('  FASTA:\t{}'.format(genome_fa_path), flush=True)
+    print('  BED:\t{}'.format(bed_path), flush=True)
+    shard = parse_shard(shard) if shard else None
+    if shard:
+        print_log(
+            'Process a shard of BED regions:\t{0}/{1}'.format(
+                shard[0] + 1, shard[1]
+            )
+        )
     print_log('Identify repeat units on BED regions:')
-    df_ru = _make_repeat_unit_df(
-        df_exbed=df_exbed, regex_patterns=regex_patterns,
-        min_rep_len=int(min_rep_len), flanking_len=int(flanking_len),
-        n_proc=n_proc
+    cache_path = _make_cache_path(cache_dir=cache_dir)
+    if not no_cache:
+        print_log('Use a cache of repeat units:\t{}'.format(cache_path))
+    cache = (
+        None if no_cache else IntervalCache(
+            path=cache_path, max_size=(int(max_cache_mb) * 1024 * 1024)
+        )
     )
-    if df_ru.size:
+    try:
+        checkpoint = None
+        if resume:
+            checkpoint = TaskCheckpoint(
+                path=make_checkpoint_path(trunit_tsv_path),
+                fingerprint=make_cache_key(
+                    _CATALOG_CACHE_VERSION,
+                    *[
+                        describe_input_file(p)
+                        for p in [bed_path, genome_fa_path]
+                    ],
+                    *[matcher_args[k] for k in ['max_unit_len',
+                                                'min_rep_times']],
+                    min_rep_len, flanking_len, ex_region_len, shard
+                )
+            )
+            print_log(
+                'Resume from a checkpoint:\t{0} ({1} parts)'.format(
+                    checkpoint.path, len(checkpoint)
+                )
+            )
+        n_rows, rows = _write_repeat_unit_tsv(
+            regions=(
+                _iterate_shard_regions(
+                    bed_path=bed_path, shard=shard,
+                    ex_region_len=int(ex_region_len),
+                    chunksize=int(bed_chunksize)
+                ) if shard else bed_path
+            ),
+            genome_fa_path=genome_fa_path,
+            trunit_tsv_path=trunit_tsv_path, matcher_args=matcher_args,
+            min_rep_len=int(min_rep_len), flanking_len=int(flanking_len),
+            ex_region_len=int(ex_region_len), chunksize=int(bed_chunksize),
+            cache=cache, checkpoint=checkpoint,
+            max_buffer_mb=int(max_buffer_mb), keep_rows=return_catalog,
+            keep_empty=bool(shard), metrics=metrics, profile_dir=profile_dir,
+            n_proc=n_proc
+        )
+        if shard:
+            write_shard_manifest(path=trunit_tsv_path, shard=shard)
+        if checkpoint is not None:
+            checkpoint.remove()
+    finally:
+        if cache:
+            cache.close()
+    metrics.counts['rows'] += n_rows
+    if n_rows:
         print_log('Write repeat units data:\t{}'.format(trunit_tsv_path))
-        df_ru.to_csv(fetch_abspath(trunit_tsv_path), sep='\t')
+        if catalog_path:
+            _write_catalog(
+                trunit_tsv_path=trunit_tsv_path, catalog_path=catalog_path,
+                metrics=metrics
+            )
     else:
         print_log('Failed to identify repeat units.')
+    metrics.seconds['total'] += time.perf_counter() - t0
+    return MemoryRepeatCatalog(records=rows) if return_catalog else None
+
+
+def iterate_repeat_units(regions, genome_fa_path, max_unit_len=6,
+                         min_rep_times=3, min_rep_len=10, flanking_len=10,
+                         ex_region_len=20, engine='scan', chunksize=100000,
+                         no_cache=False, cache_dir=None, max_cache_mb=1024,
+                         metrics=None, profile_dir=None, n_proc=8):
+    validate_files_and_dirs(
+        files=[
+            genome_fa_path, *([regions] if isinstance(regions, str) else [])
+        ]
+    )
+    matcher_args = _make_matcher_args(
+        engine=engine, max_unit_len=max_unit_len, min_rep_times=min_rep_times
+    )
+    cache = (
+        None if no_cache else IntervalCache(
+            path=_make_cache_path(cache_dir=cache_dir),
+            max_size=(int(max_cache_mb) * 1024 * 1024)
+        )
+    )
+    try:
+        block_rows = dict()
+        i_next = 0
+        for i, rows, _ in _iterate_repeat_unit_rows(
+                regions=regions, genome_fa_path=genome_fa_path,
+                matcher_args=matcher_args, min_rep_len=int(min_rep_len),
+                flanking_len=int(flanking_len),
+                ex_region_len=int(ex_region_len), chunksize=int(chunksize),
+                cache=cache, metrics=(metrics or Metrics()),
+                profile_dir=profile_dir, n_proc=n_proc
+        ):
+            block_rows[i] = rows
+            while i_next in block_rows:
+                for r in block_rows.pop(i_next):
+                    yield OrderedDict([
+                        (k, v) for k, v in r.items() if k != 'bed_id'
+                    ])
+                i_next += 1
+    finally:
+        if cache:
+            cache.close()
 
 
-def _make_extented_bed_df(bed_path, genome_fa_path, ex_region_len=10):
+def identify_repeat_units_on_genome(genome_fa_path, trunit_tsv_path,
+                                    chroms=None, max_unit_len=6,
+                                    min_rep_times=3, min_rep_len=10,
+                                    flanking_len=10, chunk_len=1000000,
+                                    max_buffer_mb=256, catalog_path=None,
+                                    metrics=None, profile_dir=None,
+                                    n_proc=8):
     logger = logging.getLogger(__name__)
+    t0 = time.perf_counter()
+    metrics = metrics or Metrics()
+    validate_files_and_dirs(files=[genome_fa_path])
+    print_log(
+        'Scan tandem repeats with unit lengths:\t1-{}'.format(max_unit_len)
+    )
+    print_log('Load input data:')
     print('  FASTA:\t{}'.format(genome_fa_path), flush=True)
-    ref_genome = read_fasta(path=genome_fa_path)
-    seq_lens = {k: len(v.seq) for k, v in ref_genome.items()}
-    logger.debug('seq_lens:' + os.linesep + pformat(seq_lens))
-    print('  BED:\t{}'.format(bed_path), flush=True)
-    df_exbed = read_bed(
-        path=bed_path
-    )[['chrom', 'chromStart', 'chromEnd']].assign(
-        search_start=lambda d: d['chromStart'].apply(
-            lambda i: max(0, i - ex_region_len)
+    with metrics.timer('load_fasta'):
+        with IndexedFasta(path=genome_fa_path) as ref_genome:
+            chrom_lens = OrderedDict(ref_genome.lengths)
+    unknown_chroms = [c for c in (chroms or []) if c not in chrom_lens]
+    if unknown_chroms:
+        raise ValueError(
+            'unknown chromosomes: {}'.format(', '.join(unknown_chroms))
+        )
+    target_lens = OrderedDict([
+        (c, chrom_lens[c]) for c in (chroms or chrom_lens)
+    ])
+    print_log('Identify repeat units on the genome:')
+    progress = ProgressReporter(
+        total=sum(-(-v // int(chunk_len)) for v in target_lens.values()),
+        unit='chunks'
+    )
+    ppx = ProcessPoolExecutor(
+        max_workers=n_proc, initializer=init_profiled_worker,
+        initargs=(
+            profile_dir, _init_genome_worker, genome_fa_path,
+            int(max_unit_len), int(min_rep_times), int(min_rep_len),
+            int(flanking_len)
+        )
+    )
+    try:
+        with OrderedTableWriter(
+                path=trunit_tsv_path,
+                max_buffer_size=(int(max_buffer_mb) * 1024 * 1024)
+        ) as writer, metrics.timer('pool'):
+            chunk_rows = dict()
+            i_next = 0
+            last_row = None
+            for i, rows in run_tasks_with_bounded_queue(
+                    executor=ppx,
+                    tasks=_iterate_genome_chunk_tasks(
+                        chrom_lens=target_lens, chunk_len=int(chunk_len)
+                    ),
+                    max_in_flight=(n_proc * 4), metrics=metrics
+            ):
+                chunk_rows[i] = rows
+                metrics.counts['chunks'] += 1
+                progress.update()
+                while i_next in chunk_rows:
+                    merged_rows, last_row = _merge_overlapping_repeats(
+                        rows=chunk_rows.pop(i_next), last_row=last_row
+                    )
+                    with metrics.timer('write'):
+                        writer.write(
+                            key=i_next,
+                            df=_make_genome_repeat_unit_df(merged_rows)
+                        )
+                    i_next += 1
+            writer.write(
+                key=i_next,
+                df=_make_genome_repeat_unit_df([last_row] if last_row else [])
+            )
+    except Exception as e:
+        logger.error(os.linesep + traceback.format_exc())
+        ppx.shutdown(wait=False)
+        raise e
+    else:
+        ppx.shutdown(wait=True)
+    progress.close()
+    metrics.counts['bases'] += sum(target_lens.values())
+    metrics.counts['loci'] += writer.n_rows
+    if writer.n_rows:
+        print_log(
+            'Write repeat units data:\t{0}\t{1} loci'.format(
+                trunit_tsv_path, writer.n_rows
+            )
+        )
+        if catalog_path:
+            _write_catalog(
+                trunit_tsv_path=trunit_tsv_path, catalog_path=catalog_path,
+                metrics=metrics
+            )
+    else:
+        print_log('Failed to identify repeat units.')
+    metrics.seconds['total'] += time.perf_counter() - t0
+
+
+def _make_matcher_args(engine='scan', max_unit_len=6, min_rep_times=3):
+    if engine not in {'scan', 'regex'}:
+        raise ValueError('invalid engine: {}'.format(engine))
+    else:
+        return {
+            'engine': engine, 'max_unit_len': int(max_unit_len),
+            'min_rep_times': int(min_rep_times)
+        }
+
+
+def _make_cache_path(cache_dir=None):
+    return os.path.join(
+        cache_dir or os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or '~/.cache', 'msir'
         ),
-        search_end=lambda d: d[['chrom', 'chromEnd']].apply(
-            lambda r: min(seq_lens[r[0]] - 1, r[1] + ex_region_len), axis=1
+        'catalog.sqlite3'
+    )
+
+
+def _write_catalog(trunit_tsv_path, catalog_path, metrics):
+    with metrics.timer('write_catalog'):
+        write_repeat_catalog(
+            tsv_path=trunit_tsv_path, catalog_path=catalog_path
         )
-    ).assign(
-        search_seq=lambda d: d[['chrom', 'search_start', 'search_end']].apply(
-            lambda r: str(ref_genome[r[0]].seq[int(r[1]):int(r[2])].upper()),
-            axis=1
+    print_log('Write a repeat catalog:\t{}'.format(catalog_path))
+
+
+def _init_genome_worker(genome_fa_path, max_unit_len, min_rep_times,
+                        min_rep_len, flanking_len, overlap_len=1000):
+    _worker_state.update({
+        'ref_genome': IndexedFasta(path=genome_fa_path),
+        'max_unit_len': max_unit_len, 'min_rep_times': min_rep_times,
+        'min_rep_len': min_rep_len, 'flanking_len': flanking_len,
+        'overlap_len': max(overlap_len, max_unit_len + flanking_len)
+    })
+
+
+def _iterate_genome_chunk_tasks(chrom_lens, chunk_len=1000000):
+    i = 0
+    for chrom, chrom_len in chrom_lens.items():
+        for start in range(0, chrom_len, chunk_len):
+            yield i, _scan_genome_chunk, (
+                chrom, start, min(chrom_len, start + chunk_len), chrom_len
+            )
+            i += 1
+
+
+def _scan_genome_chunk(chrom, core_start, core_end, chrom_len):
+    ref_genome = _worker_state['ref_genome']
+    flanking_len = _worker_state['flanking_len']
+    win_start = max(0, core_start - _worker_state['overlap_len'])
+    win_end = min(chrom_len, core_end + _worker_state['overlap_len'])
+    with task_metrics.timer('fetch'):
+        seq = ref_genome.fetch(chrom, win_start, win_end).upper()
+    t0 = time.perf_counter()
+    hits = list()
+    for rs, ru, start_x, end_x in scan_tandem_repeats(
+            sequence=seq, max_unit_len=_worker_state['max_unit_len'],
+            min_rep_times=_worker_state['min_rep_times'],
+            min_rep_len=_worker_state['min_rep_len']
+    ):
+        start, end = win_start + start_x, win_start + end_x
+        if start - len(ru) < win_start:
+            start -= len(ru) * _count_adjacent_units(
+                ref_genome=ref_genome, chrom=chrom, repeat_unit=ru,
+                pos=start, chrom_len=chrom_len, upstream=True
+            )
+        if end + len(ru) > win_end:
+            end += len(ru) * _count_adjacent_units(
+                ref_genome=ref_genome, chrom=chrom, repeat_unit=ru, pos=end,
+                chrom_len=chrom_len
+            )
+        hits.append((start, end, ru))
+    selected = _select_longest_repeats(hits=hits)
+    task_metrics.seconds['match'] += time.perf_counter() - t0
+    rows = list()
+    for start, end, ru in selected:
+        if (core_start <= start < core_end and start >= flanking_len and
+                end + flanking_len <= chrom_len):
+            search_start = start - flanking_len
+            search_end = end + flanking_len
+            search_seq = (
+                seq[(search_start - win_start):(search_end - win_start)]
+                if search_end <= win_end else
+                ref_genome.fetch(chrom, search_start, search_end).upper()
+            )
+            rows.append(OrderedDict([
+                ('chrom', chrom), ('chromStart', start), ('chromEnd', end),
+                ('repeat_start', start), ('repeat_end', end),
+                ('repeat_unit', ru), ('repeat_unit_length', len(ru)),
+                ('repeat_times', (end - start) // len(ru)),
+                ('repeat_seq_length', end - start),
+                ('left_seq', search_seq[:flanking_len]),
+                ('repeat_seq', ru * ((end - start) // len(ru))),
+                ('right_seq', search_seq[(end - start + flanking_len):]),
+                ('search_start', search_start), ('search_end', search_end),
+                ('search_seq', search_seq)
+            ]))
+    return rows
+
+
+def _count_adjacent_units(ref_genome, chrom, repeat_unit, pos, chrom_len,
+                          upstream=False, fetch_len=10000):
+    ul = len(repeat_unit)
+    n = 0
+    while (pos > 0) if upstream else (pos < chrom_len):
+        if upstream:
+            seq = ref_genome.fetch(chrom, max(0, pos - fetch_len), pos)
+            seq = seq[(len(seq) % ul):].upper()
+            units = [seq[(i - ul):i] for i in range(len(seq), 0, -ul)]
+        else:
+            seq = ref_genome.fetch(chrom, pos, min(chrom_len, pos + fetch_len))
+            seq = seq[:(len(seq) - len(seq) % ul)].upper()
+            units = [seq[i:(i + ul)] for i in range(0, len(seq), ul)]
+        for u in units:
+            if u != repeat_unit:
+                return n
+            n += 1
+        if not seq:
+            break
+        pos += -len(seq) if upstream else len(seq)
+    return n
+
+
+def _select_longest_repeats(hits):
+    if not hits:
+        return list()
+    offset = min(h[0] for h in hits)
+    occupied = bytearray(max(h[1] for h in hits) - offset)
+    selected = list()
+    for start, end, ru in sorted(
+            hits,
+            key=lambda h: (-(h[1] - h[0]), -((h[1] - h[0]) // len(h[2])), h[0])
+    ):
+        if occupied.find(1, start - offset, end - offset) < 0:
+            occupied[(start - offset):(end - offset)] = b'\x01' * (end - start)
+            selected.append((start, end, ru))
+    return sorted(selected)
+
+
+def _merge_overlapping_repeats(rows, last_row=None):
+    merged_rows = list()
+    for r in rows:
+        if (last_row is not None and r['chrom'] == last_row['chrom'] and
+                r['repeat_start'] < last_row['repeat_end']):
+            if ((r['repeat_seq_length'], r['repeat_times']) >
+                    (last_row['repeat_seq_length'],
+                     last_row['repeat_times'])):
+                last_row = r
+        else:
+            if last_row is not None:
+                merged_rows.append(last_row)
+            last_row = r
+    return merged_rows, last_row
+
+
+def _make_genome_repeat_unit_df(rows):
+    if rows:
+        return pd.DataFrame(rows).set_index(
+            ['chrom', 'chromStart', 'chromEnd']
         )
+    else:
+        return pd.DataFrame()
+
+
+def _make_extented_bed_df(df_bed, ref_genome, ex_region_len=10):
+    logger = logging.getLogger(__name__)
+    df_exbed = df_bed[['chrom', 'chromStart', 'chromEnd']].assign(
+        search_start=lambda d: (d['chromStart'] - ex_region_len).clip(lower=0),
+        search_end=lambda d: np.minimum(
+            d['chrom'].map(ref_genome.lengths) - 1,
+            d['chromEnd'] + ex_region_len
+        )
+    ).assign(
+        search_seq=lambda d: [
+            s.upper() for s in ref_genome.fetch_many(
+                zip(d['chrom'], d['search_start'], d['search_end'])
+            )
+        ]
     )
-    logger.debug('df_exbed:{0}{1}'.format(os.linesep, df_exbed))
+    logger.debug('df_exbed:%s%s', os.linesep, df_exbed)
     return df_exbed
 
 
-def _compile_repeat_unit_regex_patterns(max_unit_len=6, **kwargs):
-    return {
-        'patterns': OrderedDict([
-            (s, compile_str_regex(repeat_unit=s, **kwargs))
-            for s in iterate_unique_repeat_units(max_unit_len=max_unit_len)
-        ]),
-        'max_unit_len': max_unit_len,
-        **kwargs
-    }
+_worker_state = dict()
 
 
-def compile_str_regex(repeat_unit, min_rep_times=1, left_seq='', right_seq=''):
-    if left_seq or right_seq:
-        return re.compile(
-            r'%s(%s){%d,}%s' %
-            (left_seq, repeat_unit, min_rep_times, right_seq)
+def _write_repeat_unit_tsv(regions, genome_fa_path, trunit_tsv_path,
+                           matcher_args, min_rep_len=10, flanking_len=0,
+                           ex_region_len=20, chunksize=100000, cache=None,
+                           checkpoint=None, max_buffer_mb=256,
+                           keep_rows=False, keep_empty=False, metrics=None,
+                           profile_dir=None, n_proc=8):
+    logger = logging.getLogger(__name__)
+    metrics = metrics or Metrics()
+    n_cached = metrics.counts['cached_loci']
+    n_loci = metrics.counts['loci']
+    kept_rows = dict()
+    progress = ProgressReporter()
+    with OrderedTableWriter(
+            path=trunit_tsv_path,
+            max_buffer_size=(max_buffer_mb * 1024 * 1024),
+            keep_empty=keep_empty
+    ) as writer:
+        for i, rows, n in _iterate_repeat_unit_rows(
+                regions=regions, genome_fa_path=genome_fa_path,
+                matcher_args=matcher_args, min_rep_len=min_rep_len,
+                flanking_len=flanking_len, ex_region_len=ex_region_len,
+                chunksize=chunksize, cache=cache, checkpoint=checkpoint,
+                metrics=metrics, profile_dir=profile_dir, n_proc=n_proc
+        ):
+            progress.update(n)
+            if keep_rows:
+                kept_rows[i] = [make_catalog_record(record=r) for r in rows]
+            df_ru = _make_repeat_unit_df(rows=rows)
+            logger.debug('df_ru:%s%s', os.linesep, df_ru)
+            with metrics.timer('write'):
+                writer.write(key=i, df=df_ru)
+    progress.close()
+    if cache or checkpoint is not None:
+        print_log(
+            'Reuse cached BED regions:\t{0}/{1}'.format(
+                metrics.counts['cached_loci'] - n_cached,
+                metrics.counts['loci'] - n_loci
+            )
         )
-    else:
-        return re.compile(r'(%s){%d,}' % (repeat_unit, min_rep_times))
+    return writer.n_rows, (
+        r for i in sorted(kept_rows.keys()) for r in kept_rows.pop(i)
+    )
 
 
-def _make_repeat_unit_df(df_exbed, regex_patterns, min_rep_len=10,
-                         flanking_len=0, n_proc=8):
+def _iterate_repeat_unit_rows(regions, genome_fa_path, matcher_args,
+                              min_rep_len=10, flanking_len=0,
+                              ex_region_len=20, chunksize=100000, cache=None,
+                              checkpoint=None, metrics=None, profile_dir=None,
+                              n_proc=8):
     logger = logging.getLogger(__name__)
-    ppx = ProcessPoolExecutor(max_workers=n_proc)
-    fs = [
-        ppx.submit(
-            _identify_repeat_unit, bedline, id, regex_patterns, min_rep_len,
+    metrics = metrics or Metrics()
+    done = dict()
+    if checkpoint is not None:
+        for rows in checkpoint.load():
+            done.update(rows)
+    ppx = ProcessPoolExecutor(
+        max_workers=n_proc, initializer=init_profiled_worker,
+        initargs=(
+            profile_dir, init_matcher_worker, matcher_args, min_rep_len,
             flanking_len
-        ) for id, bedline in df_exbed.iterrows()
-    ]
-    try:
-        df_ru = pd.concat(
-            [f.result() for f in as_completed(fs)], sort=False
         )
+    )
+    try:
+        with metrics.timer('load_fasta'):
+            ref_genome = IndexedFasta(path=genome_fa_path)
+        with ref_genome, metrics.timer('pool'):
+            logger.debug(
+                'seq_lens:' + os.linesep + pformat(ref_genome.lengths)
+            )
+            cache_ns = (
+                make_cache_key(
+                    _CATALOG_CACHE_VERSION,
+                    cache.fetch_file_digest(path=genome_fa_path),
+                    *[matcher_args[k] for k in ['max_unit_len',
+                                                'min_rep_times']],
+                    min_rep_len, flanking_len, ex_region_len
+                ) if cache else None
+            )
+            for (i, cached, new_keys), rows in run_tasks_with_bounded_queue(
+                    executor=ppx,
+                    tasks=_iterate_repeat_unit_tasks(
+                        regions=regions, ref_genome=ref_genome,
+                        ex_region_len=ex_region_len, chunksize=chunksize,
+                        cache=cache, cache_ns=cache_ns, done=done,
+                        metrics=metrics, n_proc=n_proc
+                    ),
+                    max_in_flight=(n_proc * 4), metrics=metrics
+            ):
+                rows = rows or list()
+                if new_keys and (cache or checkpoint is not None):
+                    computed = {r['bed_id']: r for r in rows}
+                    entries = OrderedDict([
+                        (
+                            id, (
+                                OrderedDict([
+                                    (c, v) for c, v in computed[id].items()
+                                    if c != 'bed_id'
+                                ]) if id in computed else None
+                            )
+                        ) for id in new_keys.keys()
+                    ])
+                    if cache:
+                        cache.put_many(
+                            (k, entries[id]) for id, k in new_keys.items()
+                        )
+                    if checkpoint is not None:
+                        checkpoint.save(name=next(iter(entries)), obj=entries)
+                metrics.counts['cached_loci'] += len(cached)
+                metrics.counts['loci'] += len(cached) + len(new_keys)
+                yield i, sorted(
+                    [
+                        *rows,
+                        *[
+                            {**r, 'bed_id': id} for id, r in cached.items()
+                            if r is not None
+                        ]
+                    ],
+                    key=lambda r: r['bed_id']
+                ), len(cached) + len(new_keys)
     except Exception as e:
         logger.error(os.linesep + traceback.format_exc())
         ppx.shutdown(wait=False)
         raise e
+    except GeneratorExit:
+        ppx.shutdown(wait=False, cancel_futures=True)
+        raise
     else:
-        logger.debug('df_ru:{0}{1}'.format(os.linesep, df_ru))
         ppx.shutdown(wait=True)
-    if df_ru.size:
-        return df_ru.sort_values(by='bed_id').drop(columns='bed_id')
-    else:
-        return df_ru
-
-
-def _identify_repeat_unit(bedline, bed_id, regex_patterns, min_rep_len,
-                          flanking_len):
-    seq = bedline['search_seq']
-    df_line = extract_longest_repeat_df(
-        sequence=seq, regex_patterns=regex_patterns, min_rep_len=min_rep_len,
-        flanking_len=flanking_len, start_pos=bedline['chromStart']
-    ).pipe(
-        lambda d: (
-            d.assign(
-                bed_id=bed_id, **bedline,
-                left_seq=lambda d: d[['start_x', 'end_x']].apply(
-                    lambda r: seq[(r[0] - flanking_len):r[0]], axis=1
-                ),
-                right_seq=lambda d: d[['start_x', 'end_x']].apply(
-                    lambda r: seq[r[1]:(r[1] + flanking_len)], axis=1
-                )
-            ).set_index(['chrom', 'chromStart', 'chromEnd'])[[
-                'bed_id', 'repeat_start', 'repeat_end', 'repeat_unit',
-                'repeat_unit_length', 'repeat_times', 'repeat_seq_length',
-                'left_seq', 'repeat_seq', 'right_seq', 'search_start',
-                'search_end', 'search_seq'
-            ]].sort_index()
-            if d.size else d
+
+
+_CATALOG_CACHE_VERSION = 2
+
+
+def _iterate_repeat_unit_tasks(regions, ref_genome, ex_region_len=20,
+                               chunksize=100000, cache=None, cache_ns=None,
+                               done=None, metrics=None, n_proc=8,
+                               max_chunk_size=100):
+    metrics = metrics or Metrics()
+    i = 0
+    for df_bed in metrics.time_iter(
+            _iterate_region_chunks(regions=regions, chunksize=chunksize),
+            'load_bed'
+    ):
+        block_size = max(
+            1, min(max_chunk_size, -(-df_bed.shape[0] // (n_proc * 4)))
         )
+        for j in range(0, df_bed.shape[0], block_size):
+            df_block = df_bed.iloc[j:(j + block_size)]
+            cached = {
+                id: done[id] for id in df_block.index if id in (done or {})
+            }
+            if cached:
+                df_block = df_block.loc[
+                    [id for id in df_block.index if id not in cached]
+                ]
+            if cache:
+                t0 = time.perf_counter()
+                keys = OrderedDict([
+                    (id, make_cache_key(cache_ns, c, s, e))
+                    for id, c, s, e in zip(
+                        df_block.index, df_block['chrom'],
+                        df_block['chromStart'], df_block['chromEnd']
+                    )
+                ])
+                hits = cache.get_many(keys=list(keys.values()))
+                cached.update(
+                    {id: hits[k] for id, k in keys.items() if k in hits}
+                )
+                new_keys = OrderedDict([
+                    (id, k) for id, k in keys.items() if k not in hits
+                ])
+                df_block = df_block.loc[list(new_keys.keys())]
+                metrics.seconds['cache_lookup'] += time.perf_counter() - t0
+            else:
+                new_keys = OrderedDict([(id, None) for id in df_block.index])
+            if df_block.size:
+                with metrics.timer('fetch'):
+                    df_exbed = _make_extented_bed_df(
+                        df_bed=df_block, ref_genome=ref_genome,
+                        ex_region_len=ex_region_len
+                    )
+                yield (i, cached, new_keys), match_repeat_units, (
+                    list(df_exbed.to_dict('index').items()),
+                )
+            else:
+                yield (i, cached, new_keys), None, None
+            i += 1
+
+
+def _iterate_region_chunks(regions, chunksize=100000):
+    if isinstance(regions, str):
+        yield from iterate_bed_chunks(path=regions, chunksize=chunksize)
+    else:
+        it = iter(regions)
+        i = 0
+        while True:
+            chunk = [tuple(r[:3]) for r in islice(it, chunksize)]
+            if not chunk:
+                break
+            yield pd.DataFrame(
+                chunk, columns=['chrom', 'chromStart', 'chromEnd'],
+                index=range(i, i + len(chunk))
+            )
+            i += len(chunk)
+
+
+def _iterate_shard_regions(bed_path, shard, ex_region_len=20,
+                           chunksize=100000):
+    total_cost = sum(
+        int(_calculate_region_costs(df_bed, ex_region_len).sum())
+        for df_bed in iterate_bed_chunks(path=bed_path, chunksize=chunksize)
     )
-    _print_state_line(
-        region=convert_bed_line_to_sam_region(bedline), df=df_line
+    start_cost = 0
+    for df_bed in iterate_bed_chunks(path=bed_path, chunksize=chunksize):
+        costs = _calculate_region_costs(df_bed, ex_region_len)
+        shards = assign_shards(
+            costs=costs, total_cost=total_cost, n_shards=shard[1],
+            start_cost=start_cost
+        )
+        yield from df_bed.loc[
+            shards == shard[0], ['chrom', 'chromStart', 'chromEnd']
+        ].itertuples(index=False, name=None)
+        if shards[-1] > shard[0]:
+            break
+        start_cost += int(costs.sum())
+
+
+def _calculate_region_costs(df_bed, ex_region_len=20):
+    return np.maximum(
+        (df_bed['chromEnd'] - df_bed['chromStart']).to_numpy(dtype=np.int64)
+        + 2 * ex_region_len, 1
     )
-    return df_line
+
+
+def _make_repeat_unit_df(rows):
+    if rows:
+        return pd.DataFrame(rows).sort_values(
+            by='bed_id', kind='mergesort'
+        ).set_index(['chrom', 'chromStart', 'chromEnd']).drop(
+            columns='bed_id'
+        )
+    else:
+        return pd.DataFrame()
 
 
 def extract_longest_repeat_df(sequence, regex_patterns, min_rep_len=2,
                               flanking_len=0, start_pos=0):
-    lsl = len(regex_patterns.get('left_seq') or '')
-    rsl = len(regex_patterns.get('right_seq') or '')
-    hits = [
-        t for t in chain.from_iterable([
-            [(m.group(0), u, *m.span()) for m in r.finditer(sequence)]
-            for u, r in regex_patterns['patterns'].items() if u in sequence
-        ])
-        if (len(t[0]) >= sum([min_rep_len, lsl, rsl]) and
-            t[2] >= flanking_len and t[3] + flanking_len <= len(sequence))
-    ]
-    if not hits:
+    hit = extract_longest_repeat(
+        sequence=sequence, regex_patterns=regex_patterns,
+        min_rep_len=min_rep_len, flanking_len=flanking_len,
+        start_pos=start_pos
+    )
+    if hit is None:
         return pd.DataFrame()
     else:
-        return pd.DataFrame(
-            hits, columns=['repeat_seq', 'repeat_unit', 'start_x', 'end_x']
-        ).assign(
-            repeat_start=lambda d: d['start_x'] + lsl + start_pos,
-            repeat_end=lambda d: d['end_x'] - rsl + start_pos,
-            repeat_unit_length=lambda d: d['repeat_unit'].apply(len),
-            left_seq=lambda d: (d['repeat_seq'].str[:lsl] if lsl else ''),
-            right_seq=lambda d: (d['repeat_seq'].str[-rsl:] if rsl else '')
-        ).assign(
-            repeat_seq_length=lambda d: d['repeat_end'] - d['repeat_start']
-        ).assign(
-            repeat_times=lambda d:
-            (d['repeat_seq_length'] / d['repeat_unit_length']).astype(int)
-        ).pipe(
-            lambda d: d[d['repeat_seq_length'] == d['repeat_seq_length'].max()]
-        ).reset_index(drop=True).pipe(
-            lambda d: d.iloc[[d['repeat_times'].idxmax()]]
-        )
-
-
-def _print_state_line(region, df):
-    d = df.iloc[0].to_dict() if df.size else dict()
-    line = '  {0:<25}\t{1:<10}\t{2}'.format(
-        region,
-        ('{0}x{1}'.format(d['repeat_times'], d['repeat_unit']) if d else '-'),
-        (d['left_seq'] + d['repeat_seq'] + d['right_seq'] if d else '-')
-    )
-    print(line, flush=True)
+        return pd.DataFrame([hit], columns=RepeatHit._fields)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+from collections import namedtuple, OrderedDict
+from functools import lru_cache
+from itertools import chain
+import re
+from ..util.biotools import iterate_unique_repeat_units
+from ..util.metrics import task_metrics
+from .scanner import scan_tandem_repeats
+
+
+@lru_cache(maxsize=None)
+def prepare_repeat_unit_matcher(engine='scan', max_unit_len=6,
+                                min_rep_times=3):
+    if engine == 'regex':
+        return _compile_repeat_unit_regex_patterns(
+            max_unit_len=max_unit_len, min_rep_times=min_rep_times
+        )
+    elif engine == 'scan':
+        return {
+            'engine': 'scan', 'max_unit_len': max_unit_len,
+            'min_rep_times': min_rep_times
+        }
+    else:
+        raise ValueError('invalid engine: {}'.format(engine))
+
+
+def _compile_repeat_unit_regex_patterns(max_unit_len=6, **kwargs):
+    return {
+        'patterns': OrderedDict([
+            (s, compile_str_regex(repeat_unit=s, **kwargs))
+            for s in iterate_unique_repeat_units(max_unit_len=max_unit_len)
+        ]),
+        'max_unit_len': max_unit_len,
+        **kwargs
+    }
+
+
+def compile_str_regex(repeat_unit, min_rep_times=1, left_seq='', right_seq=''):
+    if left_seq or right_seq:
+        return re.compile(
+            r'%s(%s){%d,}%s' %
+            (left_seq, repeat_unit, min_rep_times, right_seq)
+        )
+    else:
+        return re.compile(r'(%s){%d,}' % (repeat_unit, min_rep_times))
+
+
+RepeatHit = namedtuple(
+    'RepeatHit', [
+        'repeat_seq', 'repeat_unit', 'start_x', 'end_x', 'repeat_start',
+        'repeat_end', 'repeat_unit_length', 'left_seq', 'right_seq',
+        'repeat_seq_length', 'repeat_times'
+    ]
+)
+
+
+def extract_longest_repeat(sequence, regex_patterns, min_rep_len=2,
+                           flanking_len=0, start_pos=0):
+    lsl = len(regex_patterns.get('left_seq') or '')
+    rsl = len(regex_patterns.get('right_seq') or '')
+    if regex_patterns.get('engine') == 'scan':
+        raw_hits = scan_tandem_repeats(
+            sequence=sequence, max_unit_len=regex_patterns['max_unit_len'],
+            min_rep_times=regex_patterns.get('min_rep_times', 1)
+        )
+    else:
+        raw_hits = chain.from_iterable([
+            [(m.group(0), u, *m.span()) for m in r.finditer(sequence)]
+            for u, r in regex_patterns['patterns'].items() if u in sequence
+        ])
+    min_hit_len = min_rep_len + lsl + rsl
+    max_end_x = len(sequence) - flanking_len
+    longest = None
+    for rs, ru, start_x, end_x in raw_hits:
+        if (len(rs) >= min_hit_len and start_x >= flanking_len and
+                end_x <= max_end_x):
+            rsl_len = end_x - start_x - lsl - rsl
+            rep_times = rsl_len // len(ru)
+            if (longest is None or
+                    (rsl_len, rep_times) >
+                    (longest.repeat_seq_length, longest.repeat_times)):
+                longest = RepeatHit(
+                    repeat_seq=rs, repeat_unit=ru, start_x=start_x,
+                    end_x=end_x, repeat_start=(start_x + lsl + start_pos),
+                    repeat_end=(end_x - rsl + start_pos),
+                    repeat_unit_length=len(ru), left_seq=rs[:lsl],
+                    right_seq=(rs[-rsl:] if rsl else ''),
+                    repeat_seq_length=rsl_len, repeat_times=rep_times
+                )
+    return longest
+
+
+def extract_flanked_repeat(sequence, repeat_unit, left_seq, right_seq,
+                           start_pos=0):
+    ul, lsl, rsl = len(repeat_unit), len(left_seq), len(right_seq)
+    longest = None
+    i = sequence.find(left_seq)
+    while i >= 0:
+        x = i + lsl
+        k = 0
+        while sequence.startswith(repeat_unit, x + k * ul):
+            k += 1
+        while k > 0 and not sequence.startswith(right_seq, x + k * ul):
+            k -= 1
+        if k == 0:
+            i = sequence.find(left_seq, i + 1)
+        else:
+            end_x = x + k * ul + rsl
+            if longest is None or k > longest.repeat_times:
+                longest = RepeatHit(
+                    repeat_seq=sequence[i:end_x], repeat_unit=repeat_unit,
+                    start_x=i, end_x=end_x, repeat_start=(x + start_pos),
+                    repeat_end=(x + k * ul + start_pos),
+                    repeat_unit_length=ul, left_seq=left_seq,
+                    right_seq=right_seq, repeat_seq_length=(k * ul),
+                    repeat_times=k
+                )
+            i = sequence.find(left_seq, end_x)
+    return longest
+
+
+_worker_state = dict()
+
+
+def init_matcher_worker(matcher_args, min_rep_len, flanking_len):
+    with task_metrics.timer('compile_patterns'):
+        regex_patterns = prepare_repeat_unit_matcher(**matcher_args)
+    _worker_state.update({
+        'regex_patterns': regex_patterns, 'min_rep_len': min_rep_len,
+        'flanking_len': flanking_len
+    })
+
+
+def match_repeat_units(bedlines):
+    with task_metrics.timer('match'):
+        return [
+            r for r in [
+                _identify_repeat_unit(
+                    bedline=bedline, bed_id=id, **_worker_state
+                ) for id, bedline in bedlines
+            ] if r
+        ]
+
+
+def _identify_repeat_unit(bedline, bed_id, regex_patterns, min_rep_len,
+                          flanking_len):
+    seq = bedline['search_seq']
+    hit = extract_longest_repeat(
+        sequence=seq, regex_patterns=regex_patterns, min_rep_len=min_rep_len,
+        flanking_len=flanking_len, start_pos=bedline['search_start']
+    )
+    if hit is None:
+        row = None
+    else:
+        row = OrderedDict([
+            *[(k, bedline[k]) for k in ['chrom', 'chromStart', 'chromEnd']],
+            ('bed_id', bed_id),
+            *[
+                (k, getattr(hit, k)) for k in [
+                    'repeat_start', 'repeat_end', 'repeat_unit',
+                    'repeat_unit_length', 'repeat_times', 'repeat_seq_length'
+                ]
+            ],
+            ('left_seq', seq[(hit.start_x - flanking_len):hit.start_x]),
+            ('repeat_seq', hit.repeat_seq),
+            ('right_seq', seq[hit.end_x:(hit.end_x + flanking_len)]),
+            *[
+                (k, bedline[k])
+                for k in ['search_start', 'search_end', 'search_seq']
+            ]
+        ])
+    return row
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import gzip
+import os
+import time
+from ..util.helper import fetch_abspath, print_log, validate_files_and_dirs
+from ..util.metrics import Metrics
+from ..util.shard import make_shard_manifest_path, read_shard_manifest
+from ..util.tablewriter import OrderedTableWriter
+
+
+def merge_sharded_tables(shard_tsv_paths, merged_tsv_path,
+                         chunk_size=(1024 * 1024), metrics=None):
+    t0 = time.perf_counter()
+    metrics = metrics or Metrics()
+    validate_files_and_dirs(files=shard_tsv_paths)
+    sorted_paths = _sort_shard_paths(shard_tsv_paths=shard_tsv_paths)
+    print_log('Merge sharded tables:')
+    for i, p in enumerate(sorted_paths):
+        print(
+            '  {0}/{1}:\t{2}'.format(i + 1, len(sorted_paths), p), flush=True
+        )
+    header = None
+    i = 0
+    with OrderedTableWriter(path=merged_tsv_path) as writer:
+        for p in sorted_paths:
+            with _open_table(path=p, sep=writer.sep) as f, \
+                    metrics.timer('merge'):
+                h = f.readline()
+                if not h:
+                    continue
+                elif header is None:
+                    header = h
+                elif h != header:
+                    raise TableMergeError(
+                        'columns differ from the first shard: {}'.format(p)
+                    )
+                for data in iter(lambda: f.read(chunk_size), b''):
+                    writer.write_raw(key=i, header=header, data=data)
+                    metrics.counts['bytes'] += len(data)
+                    i += 1
+            metrics.counts['shards'] += 1
+    metrics.counts['rows'] += writer.n_rows
+    if writer.n_rows:
+        print_log(
+            'Write merged data:\t{0}\t{1} rows'.format(
+                merged_tsv_path, writer.n_rows
+            )
+        )
+    else:
+        print_log('No rows to merge.')
+    metrics.seconds['total'] += time.perf_counter() - t0
+
+
+class TableMergeError(RuntimeError):
+    pass
+
+
+def _sort_shard_paths(shard_tsv_paths):
+    shards = dict()
+    n_shards = set()
+    for p in shard_tsv_paths:
+        if not os.path.isfile(make_shard_manifest_path(p)):
+            raise TableMergeError(
+                'shard manifest not found: {}'.format(
+                    make_shard_manifest_path(p)
+                )
+            )
+        i, n = read_shard_manifest(p)
+        if i in shards:
+            raise TableMergeError(
+                'duplicate shard {0}/{1}: {2}, {3}'.format(
+                    i + 1, n, shards[i], p
+                )
+            )
+        shards[i] = p
+        n_shards.add(n)
+    if len(n_shards) > 1:
+        raise TableMergeError(
+            'different numbers of shards: {}'.format(
+                ', '.join(str(n) for n in sorted(n_shards))
+            )
+        )
+    n = n_shards.pop()
+    missing = [str(i + 1) for i in range(n) if i not in shards]
+    if missing:
+        raise TableMergeError(
+            'missing shards of {0}: {1}'.format(n, ', '.join(missing))
+        )
+    return [shards[i] for i in range(n)]
+
+
+def _open_table(path, sep='\t'):
+    p = fetch_abspath(path)
+    root, ext = os.path.splitext(p)
+    compressed = ext in ['.gz', '.bgz']
+    if (',' if (root if compressed else p).endswith('.csv') else '\t') != sep:
+        raise TableMergeError(
+            'separator differs from the merged output: {}'.format(path)
+        )
+    return gzip.open(p, 'rb') if compressed else open(p, 'rb')
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+
+_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _i, _b in enumerate(b'ACGT'):
+    _BASE_CODES[_b] = _i
+
+
+def encode_sequence(sequence):
+    return _BASE_CODES[
+        np.frombuffer(sequence.encode('ascii', 'replace'), dtype=np.uint8)
+    ]
+
+
+def scan_tandem_repeats(sequence, max_unit_len=6, min_rep_times=1,
+                        min_rep_len=1):
+    codes = encode_sequence(sequence)
+    n_invalid = np.concatenate([[0], np.cumsum(codes > 3)])
+    hits = []
+    for p in range(1, max_unit_len + 1):
+        hits.extend(
+            _scan_period(
+                sequence=sequence, codes=codes, n_invalid=n_invalid, period=p,
+                min_rep_times=max(min_rep_times, -(-min_rep_len // p))
+            )
+        )
+    return sorted(hits, key=lambda t: (len(t[1]), t[1], t[2]))
+
+
+def _scan_period(sequence, codes, n_invalid, period, min_rep_times=1):
+    n_win = codes.size - period + 1
+    if n_win < 1:
+        return []
+    eq = (codes[:-period] == codes[period:]) & (codes[period:] < 4)
+    arange = np.arange(eq.size)
+    next_ne = np.minimum.accumulate(
+        np.where(eq, eq.size, arange)[::-1]
+    )[::-1] if eq.size else arange
+    run_lens = np.append(next_ne - arange, 0)
+    rep_times = run_lens // period + 1
+    is_head = np.ones(n_win, dtype=bool)
+    is_head[period:] = run_lens[:-period] < period
+    is_valid = (n_invalid[period:] - n_invalid[:n_win]) == 0
+    hits = []
+    last_ends = dict()
+    for x in np.flatnonzero(
+            is_head & is_valid & (rep_times >= min_rep_times)
+    ).tolist():
+        ru = sequence[x:(x + period)]
+        if (ru + ru).find(ru, 1) != period:
+            continue
+        t = int(rep_times[x])
+        last_end = last_ends.get(ru, 0)
+        if x < last_end:
+            skipped = -(-(last_end - x) // period)
+            x += skipped * period
+            t -= skipped
+            if t < min_rep_times:
+                continue
+        end = x + period * t
+        last_ends[ru] = end
+        hits.append((sequence[x:end], ru, x, end))
+    return hits
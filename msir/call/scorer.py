@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import re
+import time
+import traceback
+import numpy as np
+import pandas as pd
+from ..util.helper import fetch_abspath, print_log, \
+    run_tasks_with_bounded_queue, validate_files_and_dirs
+from ..util.metrics import init_profiled_worker, Metrics, task_metrics
+from ..util.tablewriter import OrderedTableWriter
+
+
+def score_microsatellite_instability(obs_tsv_paths, normal_names,
+                                     score_tsv_path, locus_tsv_path=None,
+                                     min_reads=20, alpha=0.05,
+                                     chunksize=1000000, metrics=None,
+                                     profile_dir=None, n_proc=8):
+    t0 = time.perf_counter()
+    metrics = metrics or Metrics()
+    validate_files_and_dirs(files=obs_tsv_paths)
+    print_log('Load observed repeat data:')
+    for p in obs_tsv_paths:
+        print('  {}'.format(p), flush=True)
+    df_loci, samples, hist = _load_repeat_times_histograms(
+        obs_tsv_paths=obs_tsv_paths, chunksize=chunksize, metrics=metrics
+    )
+    print('  loci:\t{}'.format(df_loci.shape[0]), flush=True)
+    normals = _match_sample_names(samples=samples, names=normal_names)
+    tumors = [s for s in samples if s not in normals]
+    if not tumors:
+        raise ObservationFormatError('no samples to score against normals')
+    print_log(
+        'Score samples against {0}:\t{1}'.format(
+            ('a panel of normals' if len(normals) > 1 else 'a paired normal'),
+            ', '.join(normals)
+        )
+    )
+    with metrics.timer('baseline'):
+        baseline_probs, baseline_reads = _make_baseline_distribution(
+            hist=hist[[samples.index(s) for s in normals]]
+        )
+    stats = _score_samples(
+        tumor_hists=[hist[samples.index(s)] for s in tumors],
+        baseline_probs=baseline_probs, baseline_reads=baseline_reads,
+        min_reads=int(min_reads), metrics=metrics, profile_dir=profile_dir,
+        n_proc=n_proc
+    )
+    for d in stats:
+        d['ks_qvalue'] = _adjust_pvalues(pvalues=d['ks_pvalue'])
+        d['unstable'] = d['ks_qvalue'] < float(alpha)
+    scores = pd.DataFrame([
+        _summarize_sample(sample=s, baseline=normals, locus_stats=d)
+        for s, d in zip(tumors, stats)
+    ])
+    with metrics.timer('write'):
+        if locus_tsv_path:
+            with OrderedTableWriter(path=locus_tsv_path) as writer:
+                for i, (s, d) in enumerate(zip(tumors, stats)):
+                    writer.write(
+                        key=i,
+                        df=df_loci.assign(sam_path=s, **d).set_index(
+                            ['sam_path', *_LOCUS_KEYS]
+                        )
+                    )
+        with OrderedTableWriter(path=score_tsv_path) as writer:
+            writer.write(key=0, df=scores.set_index('sam_path'))
+    for _, r in scores.iterrows():
+        print_log(
+            'MSI score:\t{0}\t{1:.2f} ({2}/{3} loci)'.format(
+                r['sam_path'], r['msi_score'], r['unstable_loci'],
+                r['evaluable_loci']
+            )
+        )
+    if locus_tsv_path:
+        print_log('Write locus statistics:\t{}'.format(locus_tsv_path))
+    print_log('Write MSI scores:\t{}'.format(score_tsv_path))
+    metrics.counts['loci'] += df_loci.shape[0] * len(tumors)
+    metrics.seconds['total'] += time.perf_counter() - t0
+    return scores
+
+
+class ObservationFormatError(RuntimeError):
+    pass
+
+
+_LOCUS_KEYS = [
+    'chrom', 'chromStart', 'chromEnd', 'repeat_unit',
+    'referenced_repeat_times'
+]
+
+
+def _load_repeat_times_histograms(obs_tsv_paths, chunksize=1000000,
+                                  metrics=None, max_partials=16):
+    keys = ['sam_path', *_LOCUS_KEYS, 'observed_repeat_times']
+    partials = list()
+    with metrics.timer('load'):
+        for p in obs_tsv_paths:
+            for df in _read_obs_tsv(path=p, chunksize=chunksize):
+                metrics.counts['rows'] += df.shape[0]
+                df = df.dropna(subset=['observed_repeat_times']).astype(
+                    {'observed_repeat_times': np.int64}
+                )
+                if 'read_count' in df.columns:
+                    partials.append(
+                        df.groupby(keys, sort=False)['read_count'].sum()
+                    )
+                else:
+                    partials.append(df.groupby(keys, sort=False).size())
+                if len(partials) >= max_partials:
+                    partials = [_sum_partial_counts(partials=partials)]
+    if not any(len(s) for s in partials):
+        raise ObservationFormatError('no observed repeats')
+    with metrics.timer('histogram'):
+        df = _sum_partial_counts(partials=partials).reset_index(name='n')
+        sample_ids, samples = pd.factorize(df['sam_path'])
+        locus_ids = df.groupby(_LOCUS_KEYS, sort=False).ngroup().to_numpy()
+        df_loci = df[_LOCUS_KEYS].drop_duplicates().reset_index(drop=True)
+        times = df['observed_repeat_times'].to_numpy()
+        hist = np.zeros(
+            (len(samples), df_loci.shape[0], times.max() + 1), dtype=np.int64
+        )
+        hist[sample_ids, locus_ids, times] = df['n'].to_numpy()
+    return df_loci, list(samples), hist
+
+
+def _read_obs_tsv(path, chunksize=1000000):
+    p = fetch_abspath(path)
+    root, ext = os.path.splitext(p)
+    compression = {'.gz': 'gzip', '.bgz': 'gzip'}.get(ext)
+    args = {
+        'sep': (
+            ',' if (root if compression else p).endswith('.csv') else '\t'
+        ),
+        'compression': compression
+    }
+    columns = pd.read_csv(p, nrows=0, **args).columns
+    usecols = [
+        'sam_path', *_LOCUS_KEYS, 'observed_repeat_times',
+        *(['read_count'] if 'read_count' in columns else [])
+    ]
+    missing = [c for c in usecols if c not in columns]
+    if missing:
+        raise ObservationFormatError(
+            'missing columns in {0}: {1}'.format(path, ', '.join(missing))
+        )
+    return pd.read_csv(
+        p, usecols=usecols, chunksize=chunksize,
+        dtype={'sam_path': str, 'chrom': str, 'repeat_unit': str}, **args
+    )
+
+
+def _sum_partial_counts(partials):
+    return pd.concat(partials).groupby(
+        level=list(range(partials[0].index.nlevels)), sort=False
+    ).sum()
+
+
+def _match_sample_names(samples, names):
+    matched = list()
+    for n in names:
+        hits = [
+            s for s in samples if n in [
+                s, os.path.basename(s),
+                re.sub(r'\.(bam|cram|sam)$', '', os.path.basename(s))
+            ]
+        ]
+        if len(hits) != 1:
+            raise ObservationFormatError(
+                '{0} normal sample: {1}'.format(
+                    ('ambiguous' if hits else 'unknown'), n
+                )
+            )
+        elif hits[0] not in matched:
+            matched.append(hits[0])
+    return matched
+
+
+def _make_baseline_distribution(hist):
+    n = hist.sum(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        probs = np.where(n[..., None] > 0, hist / n[..., None], 0)
+    n_normals = (n > 0).sum(axis=0)
+    return (
+        probs.sum(axis=0) / np.maximum(n_normals, 1)[:, None], n.sum(axis=0)
+    )
+
+
+def _score_samples(tumor_hists, baseline_probs, baseline_reads, min_reads=20,
+                   metrics=None, profile_dir=None, n_proc=8,
+                   max_block_size=100000):
+    logger = logging.getLogger(__name__)
+    n_loci = baseline_reads.shape[0]
+    block_size = max(
+        1, min(max_block_size, -(-n_loci // (n_proc * 4)))
+    )
+    blocks = [
+        (i, j) for i in range(len(tumor_hists))
+        for j in range(0, n_loci, block_size)
+    ]
+    stats = [dict() for _ in tumor_hists]
+    ppx = ProcessPoolExecutor(
+        max_workers=n_proc, initializer=init_profiled_worker,
+        initargs=(profile_dir, _init_worker, min_reads)
+    )
+    try:
+        with metrics.timer('pool'):
+            for (i, j), d in run_tasks_with_bounded_queue(
+                    executor=ppx,
+                    tasks=(
+                        (
+                            (i, j), _score_loci, (
+                                tumor_hists[i][j:(j + block_size)],
+                                baseline_probs[j:(j + block_size)],
+                                baseline_reads[j:(j + block_size)]
+                            )
+                        ) for i, j in blocks
+                    ),
+                    max_in_flight=(n_proc * 4), metrics=metrics
+            ):
+                stats[i][j] = d
+    except Exception as e:
+        logger.error(os.linesep + traceback.format_exc())
+        ppx.shutdown(wait=False)
+        raise e
+    else:
+        ppx.shutdown(wait=True)
+    return [
+        {
+            k: np.concatenate([d[j][k] for j in sorted(d)])
+            for k in d[min(d)]
+        } for d in stats
+    ]
+
+
+_worker_state = dict()
+
+
+def _init_worker(min_reads):
+    _worker_state.update({'min_reads': min_reads})
+
+
+def _score_loci(tumor_hist, baseline_probs, baseline_reads):
+    with task_metrics.timer('score'):
+        tumor_reads = tumor_hist.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tumor_probs = tumor_hist / tumor_reads[:, None]
+        evaluable = (
+            (tumor_reads >= _worker_state['min_reads'])
+            & (baseline_reads >= _worker_state['min_reads'])
+        )
+        shift = np.abs(tumor_probs - baseline_probs).sum(axis=1) / 2
+        ks_statistic = np.abs(
+            np.cumsum(tumor_probs, axis=1) - np.cumsum(baseline_probs, axis=1)
+        ).max(axis=1)
+        return {
+            'tumor_reads': tumor_reads, 'baseline_reads': baseline_reads,
+            'unstable_fraction': np.where(evaluable, shift, np.nan),
+            'ks_statistic': np.where(evaluable, ks_statistic, np.nan),
+            'ks_pvalue': np.where(
+                evaluable,
+                _calculate_ks_pvalues(
+                    statistics=ks_statistic, n=tumor_reads, m=baseline_reads
+                ),
+                np.nan
+            )
+        }
+
+
+def _calculate_ks_pvalues(statistics, n, m, n_terms=10):
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        ne = np.sqrt(n * m / (n + m))
+        x = (ne + 0.12 + 0.11 / ne) * statistics
+        k = np.arange(1, n_terms + 1)[:, None]
+        lower = 1 - np.sqrt(2 * np.pi) / x * np.exp(
+            -(2 * k - 1) ** 2 * np.pi ** 2 / (8 * x ** 2)
+        ).sum(axis=0)
+        upper = 2 * (
+            (-1) ** (k - 1) * np.exp(-2 * k ** 2 * x ** 2)
+        ).sum(axis=0)
+        pvalues = np.where(x < 1.18, lower, upper)
+    return np.clip(np.where(x > 0, pvalues, 1), 0, 1)
+
+
+def _adjust_pvalues(pvalues):
+    qvalues = np.full(pvalues.shape, np.nan)
+    tested = ~np.isnan(pvalues)
+    p = pvalues[tested]
+    if p.size:
+        order = np.argsort(p)[::-1]
+        q = np.minimum.accumulate(
+            p[order] * p.size / np.arange(p.size, 0, -1)
+        )
+        adjusted = np.empty(p.size)
+        adjusted[order] = np.minimum(q, 1)
+        qvalues[tested] = adjusted
+    return qvalues
+
+
+def _summarize_sample(sample, baseline, locus_stats):
+    evaluable = ~np.isnan(locus_stats['ks_pvalue'])
+    n_evaluable = int(evaluable.sum())
+    n_unstable = int(locus_stats['unstable'].sum())
+    return {
+        'sam_path': sample, 'baseline': ','.join(baseline),
+        'evaluable_loci': n_evaluable, 'unstable_loci': n_unstable,
+        'msi_score': (100 * n_unstable / n_evaluable if n_evaluable else 0),
+        'mean_unstable_fraction': (
+            float(np.mean(locus_stats['unstable_fraction'][evaluable]))
+            if n_evaluable else np.nan
+        )
+    }
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import re
+import signal
+import socketserver
+import stat
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from urllib.parse import parse_qs, urlsplit
+from ..util.biotools import validate_or_prepare_bam_indexes
+from ..util.catalog import RepeatCatalog, write_repeat_catalog
+from ..util.helper import fetch_abspath, print_log, validate_files_and_dirs
+from .detector import iterate_observed_repeats, make_detection_executor
+
+
+def serve_repeat_detection(bam_paths, trunit_tsv_path, catalog_path=None,
+                           socket_path=None, port=8765, index_bam=False,
+                           reader='auto', samtools=None, min_mapq=0,
+                           include_flags=0, exclude_flags=0,
+                           skip_duplicates=False, max_open_bams=64,
+                           n_proc=8):
+    validate_files_and_dirs(files=[catalog_path or trunit_tsv_path])
+    with DetectionService(
+            bam_paths=bam_paths, trunit_tsv_path=trunit_tsv_path,
+            catalog_path=catalog_path, index_bam=index_bam, reader=reader,
+            samtools=samtools, min_mapq=min_mapq,
+            include_flags=include_flags, exclude_flags=exclude_flags,
+            skip_duplicates=skip_duplicates, max_open_bams=max_open_bams,
+            n_proc=n_proc
+    ) as service:
+        server = make_detection_server(
+            service=service, socket_path=socket_path, port=port
+        )
+        for s in [signal.SIGINT, signal.SIGTERM]:
+            signal.signal(s, _make_signal_handler(server=server))
+        print_log(
+            'Serve repeat-length distributions:\t{}'.format(
+                'unix:{}'.format(server.server_address) if socket_path else
+                'http://{0}:{1}'.format(*server.server_address[:2])
+            )
+        )
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            if socket_path:
+                os.unlink(server.server_address)
+    print_log('The server stopped.')
+
+
+def _make_signal_handler(server):
+    pid = os.getpid()
+
+    def _handle_signal(signum, frame):
+        if os.getpid() == pid:
+            threading.Thread(target=server.shutdown).start()
+        else:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    return _handle_signal
+
+
+class DetectionService(object):
+    def __init__(self, bam_paths, trunit_tsv_path=None, catalog_path=None,
+                 index_bam=False, reader='auto', samtools=None, min_mapq=0,
+                 include_flags=0, exclude_flags=0, skip_duplicates=False,
+                 max_open_bams=64, n_proc=8):
+        validate_files_and_dirs(files=bam_paths)
+        validate_or_prepare_bam_indexes(
+            bam_paths=bam_paths, index_bam=index_bam, n_proc=n_proc,
+            samtools_path=samtools
+        )
+        self.samples = _make_sample_names(bam_paths=bam_paths)
+        self.detect_args = {
+            'reader': reader, 'samtools': samtools, 'min_mapq': min_mapq,
+            'include_flags': include_flags, 'exclude_flags': exclude_flags,
+            'skip_duplicates': skip_duplicates
+        }
+        self.max_open_bams = int(max_open_bams)
+        self.n_proc = n_proc
+        self.__tmp_dir = None
+        if catalog_path:
+            print_log('Load a repeat catalog:\t{}'.format(catalog_path))
+        else:
+            print_log('Load repeat units data:\t{}'.format(trunit_tsv_path))
+            self.__tmp_dir = tempfile.TemporaryDirectory()
+            catalog_path = os.path.join(self.__tmp_dir.name, 'tr_unit.msircat')
+            write_repeat_catalog(
+                tsv_path=trunit_tsv_path, catalog_path=catalog_path
+            )
+        self.catalog = RepeatCatalog(path=catalog_path)
+        self.catalog.find_loci(regions=[])
+        print('  loci:\t{}'.format(len(self.catalog)), flush=True)
+        for k, v in self.samples.items():
+            print('  {0}:\t{1}'.format(k, v), flush=True)
+        self.__lock = threading.Lock()
+        self.__executor = self._make_executor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+        self.catalog.close()
+        if self.__tmp_dir:
+            self.__tmp_dir.cleanup()
+
+    def describe(self):
+        return {
+            'loci': len(self.catalog), 'samples': self.samples,
+            'processes': self.n_proc
+        }
+
+    def query(self, sample, regions):
+        if not isinstance(sample, str) or sample not in self.samples:
+            raise DetectionRequestError('unknown sample: {}'.format(sample))
+        elif not regions:
+            raise DetectionRequestError('no regions')
+        elif not isinstance(regions, list):
+            raise DetectionRequestError(
+                'regions must be a list: {}'.format(regions)
+            )
+        parsed = [
+            (parse_region(r) if isinstance(r, str) else _parse_bed_region(r))
+            for r in regions
+        ]
+        t0 = time.perf_counter()
+        executor = self.__executor
+        try:
+            loci = self._query(
+                bam_path=self.samples[sample], regions=parsed,
+                executor=executor
+            )
+        except BrokenProcessPool:
+            logging.getLogger(__name__).warning(
+                'Restart the worker pool after a broken process'
+            )
+            with self.__lock:
+                if self.__executor is executor:
+                    self.__executor = self._make_executor()
+            loci = self._query(
+                bam_path=self.samples[sample], regions=parsed,
+                executor=self.__executor
+            )
+        return {
+            'sample': sample, 'loci': loci,
+            'seconds': time.perf_counter() - t0
+        }
+
+    def _query(self, bam_path, regions, executor):
+        return list(
+            iterate_observed_repeats(
+                bam_paths=[bam_path], catalog=self.catalog, regions=regions,
+                summary=True, executor=executor, n_proc=self.n_proc,
+                **self.detect_args
+            )
+        )
+
+    def _make_executor(self):
+        return make_detection_executor(
+            catalog=self.catalog, summary=True,
+            max_open_bams=self.max_open_bams, n_proc=self.n_proc
+        )
+
+
+class DetectionRequestError(RuntimeError):
+    pass
+
+
+def parse_region(region):
+    m = re.match(r'^(.+?)(?::([0-9,]+)(?:-([0-9,]+))?)?$', region.strip())
+    if not m:
+        raise DetectionRequestError('invalid region: {}'.format(region))
+    chrom, start, end = m.groups()
+    start = int(start.replace(',', '')) if start else 1
+    end = int(end.replace(',', '')) if end else (start if m.group(2) else 0)
+    if start < 1 or (end and end < start):
+        raise DetectionRequestError('invalid region: {}'.format(region))
+    return chrom, start - 1, (end or sys.maxsize)
+
+
+def _parse_bed_region(region):
+    try:
+        chrom, start, end = region
+        return str(chrom), int(start), int(end)
+    except (TypeError, ValueError):
+        raise DetectionRequestError('invalid region: {}'.format(region))
+
+
+def _make_sample_names(bam_paths):
+    names = [
+        re.sub(r'\.(bam|cram|sam)$', '', os.path.basename(p))
+        for p in bam_paths
+    ]
+    return {
+        (n if names.count(n) == 1 else p): fetch_abspath(p)
+        for n, p in zip(names, bam_paths)
+    }
+
+
+def make_detection_server(service, socket_path=None, port=8765):
+    if socket_path:
+        path = fetch_abspath(socket_path)
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        server = _UnixHTTPServer(path, _DetectionRequestHandler)
+    else:
+        server = ThreadingHTTPServer(
+            ('127.0.0.1', int(port)), _DetectionRequestHandler
+        )
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    pass
+
+
+class _DetectionRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        q = parse_qs(url.query)
+        self._respond(
+            path=url.path,
+            request={
+                'sample': (q.get('sample') or [None])[0],
+                'regions': q.get('region')
+            }
+        )
+
+    def do_POST(self):
+        try:
+            request = json.loads(
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                or b'{}'
+            )
+        except ValueError as e:
+            self._send_json(status=400, body={'error': str(e)})
+        else:
+            if isinstance(request, dict):
+                self._respond(path=urlsplit(self.path).path, request=request)
+            else:
+                self._send_json(
+                    status=400, body={'error': 'request must be an object'}
+                )
+
+    def address_string(self):
+        return str(self.client_address[0] if self.client_address else '-')
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+    def _respond(self, path, request):
+        try:
+            if path == '/health':
+                self._send_json(
+                    status=200, body=self.server.service.describe()
+                )
+            elif path == '/distribution':
+                self._send_json(
+                    status=200,
+                    body=self.server.service.query(
+                        sample=request.get('sample'),
+                        regions=request.get('regions')
+                    )
+                )
+            else:
+                self._send_json(
+                    status=404, body={'error': 'not found: {}'.format(path)}
+                )
+        except DetectionRequestError as e:
+            self._send_json(status=400, body={'error': str(e)})
+        except Exception as e:
+            logging.getLogger(__name__).error(
+                os.linesep + traceback.format_exc()
+            )
+            self._send_json(status=500, body={'error': str(e)})
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
@@ -5,17 +5,48 @@ Tandem repeat analyzer for microsatellite instability detection by DNA-seq
 Usage:
     msir id [--debug] [--unit-tsv=<path>] [--max-unit-len=<int>]
             [--min-rep-times=<int>] [--min-rep-len=<int>]
-            [--flanking-len=<int>] [--ex-region-len=<int>] [--processes=<int>]
+            [--flanking-len=<int>] [--ex-region-len=<int>] [--engine=<str>]
+            [--no-cache] [--cache-dir=<path>] [--buffer-mb=<int>]
+            [--catalog=<path>] [--resume] [--shard=<i/n>]
+            [--metrics=<path>] [--profile=<dir>] [--processes=<int>]
             <bed> <fasta>
+    msir scan [--debug] [--unit-tsv=<path>] [--max-unit-len=<int>]
+              [--min-rep-times=<int>] [--min-rep-len=<int>]
+              [--flanking-len=<int>] [--chunk-len=<int>] [--buffer-mb=<int>]
+              [--catalog=<path>] [--metrics=<path>] [--profile=<dir>]
+              [--processes=<int>] <fasta> [<chrom>...]
     msir detect [--debug] [--unit-tsv=<path>] [--obs-tsv=<path>][--index-bam]
-                [--append-read-seq] [--samtools=<path>]
-                [--processes=<int>] <bam>...
+                [--append-read-seq] [--summary] [--sweep] [--reader=<str>]
+                [--samtools=<path>] [--min-mapq=<int>]
+                [--include-flags=<int>] [--exclude-flags=<int>]
+                [--skip-duplicates] [--max-reads-per-locus=<int>]
+                [--early-stop=<float>] [--seed=<int>] [--buffer-mb=<int>]
+                [--catalog=<path>] [--resume] [--shard=<i/n>]
+                [--metrics=<path>] [--profile=<dir>] [--processes=<int>]
+                <bam>...
     msir pipeline [--debug] [--unit-tsv=<path>] [--obs-tsv=<path>]
                   [--index-bam] [--max-unit-len=<int>] [--min-rep-times=<int>]
                   [--min-rep-len=<int>] [--flanking-len=<int>]
-                  [--ex-region-len=<int>] [--append-read-seq]
-                  [--samtools=<path>] [--processes=<int>] <bed> <fasta>
-                  <bam>...
+                  [--ex-region-len=<int>] [--engine=<str>] [--append-read-seq]
+                  [--summary] [--sweep] [--reader=<str>] [--samtools=<path>]
+                  [--min-mapq=<int>] [--include-flags=<int>]
+                  [--exclude-flags=<int>] [--skip-duplicates]
+                  [--max-reads-per-locus=<int>] [--early-stop=<float>]
+                  [--seed=<int>] [--no-cache] [--cache-dir=<path>]
+                  [--buffer-mb=<int>] [--catalog=<path>] [--resume]
+                  [--metrics=<path>] [--profile=<dir>] [--processes=<int>]
+                  <bed> <fasta> <bam>...
+    msir serve [--debug] [--unit-tsv=<path>] [--catalog=<path>]
+               [--socket=<path>] [--port=<int>] [--index-bam]
+               [--reader=<str>] [--samtools=<path>] [--min-mapq=<int>]
+               [--include-flags=<int>] [--exclude-flags=<int>]
+               [--skip-duplicates] [--max-open-bams=<int>]
+               [--processes=<int>] <bam>...
+    msir score [--debug] --normal=<name>... [--score-tsv=<path>]
+               [--locus-tsv=<path>] [--min-reads=<int>] [--alpha=<float>]
+               [--metrics=<path>] [--profile=<dir>] [--processes=<int>]
+               <obs_tsv>...
+    msir merge [--debug] --out-tsv=<path> [--metrics=<path>] <shard_tsv>...
     msir -h|--help
     msir -v|--version
 
@@ -24,36 +55,114 @@ Options:
     -v, --version           Print version and exit
     --debug                 Execute a command with debug messages
     --max-unit-len=<int>    Set a maximum length for repeat units [default: 8]
-    --min-rep-times=<int>   Set a minimum repeat times [default: 2]
-    --min-rep-len=<int>     Set a minimum length for repeats [default: 5]
+    --min-rep-times=<int>   Set a minimum repeat times
+                            (default: 2 for id, 3 for scan)
+    --min-rep-len=<int>     Set a minimum length for repeats
+                            (default: 5 for id, 10 for scan)
     --flanking-len=<int>    Set a flanking sequence legnth [default: 5]
     --ex-region-len=<int>   Search around extra regions [default: 20]
+    --chunk-len=<int>       Scan a genome by chunks of this length
+                            [default: 1000000]
+    --engine=<str>          Set a repeat search engine {scan, regex}
+                            [default: scan]
+    --no-cache              Identify repeat units without the cache
+    --cache-dir=<path>      Set a cache directory
+                            (default: $XDG_CACHE_HOME/msir or ~/.cache/msir)
+    --buffer-mb=<int>       Set a memory ceiling for reordering outputs
+                            (MB) [default: 256]
+    --metrics=<path>        Write stage timings, throughput, queue depth, and
+                            worker utilization into a report
+                            (JSON if it ends with .json, otherwise TSV)
+    --profile=<dir>         Dump cProfile stats of the main and worker
+                            processes into a directory
     --processes=<int>       Limit max cores for multiprocessing
     --unit-tsv=<path>       Set a TSV of repeat units [default: tr_unit.tsv]
+                            (compressed if it ends with .gz or .bgz)
     --obs-tsv=<path>        Set a TSV of observed repeats [default: tr_obs.tsv]
+                            (compressed if it ends with .gz or .bgz)
+    --catalog=<path>        Write a binary catalog of repeat units with id
+                            or scan, and read it with detect or serve
+                            instead of the TSV
+    --resume                Save finished work into a checkpoint directory
+                            next to an output (`<path>.ckpt`), and resume
+                            from it after an interruption (not for `-`)
+    --shard=<i/n>           Process only the i-th of n contiguous slices of
+                            BED regions (id) or sample loci (detect),
+                            balanced by region lengths or read bytes around
+                            loci in BAM indexes (or BAM sizes without them)
     --index-bam             Index BAM or CRAM if required
     --append-read-seq       Append SEQ and QUAL of SAM data into an output TSV
+    --summary               Write read counts per observed repeat times
+                            instead of a row for each read
+    --sweep                 Stream each coordinate-sorted BAM/CRAM/SAM once
+                            instead of querying every locus
+                            (no index is required)
+    --reader=<str>          Set a BAM/CRAM reader
+                            {auto, pysam, native, samtools} [default: auto]
     --samtools=<path>       Set a path to samtools command
+    --min-mapq=<int>        Skip reads with MAPQ below this [default: 0]
+    --include-flags=<int>   Use only reads with all of these FLAG bits
+                            [default: 0]
+    --exclude-flags=<int>   Skip reads with any of these FLAG bits
+                            (e.g., 0x900 for secondary and supplementary)
+                            [default: 0]
+    --skip-duplicates       Skip reads flagged as PCR or optical duplicates
+    --max-reads-per-locus=<int>
+                            Match at most this many spanning reads per locus
+                            by seeded reservoir sampling
+    --early-stop=<float>    Stop matching reads at a locus once the
+                            distribution of observed repeat times moves less
+                            than this total variation distance per 100 reads
+    --seed=<int>            Set a random seed for sampling reads [default: 0]
+    --socket=<path>         Listen on a Unix socket instead of a local port
+    --port=<int>            Listen on a port of 127.0.0.1 [default: 8765]
+    --max-open-bams=<int>   Keep at most this many BAM/CRAM handles open in
+                            each worker [default: 64]
+    --normal=<name>         Set a normal sample by `sam_path` in observed
+                            repeat data (or its file name with or without an
+                            extension), and more than one for a panel of
+                            normals
+    --score-tsv=<path>      Set a TSV of MSI scores [default: msi_score.tsv]
+    --locus-tsv=<path>      Write statistics of each locus into a TSV
+    --min-reads=<int>       Score loci with at least this many reads in both
+                            a sample and normals [default: 20]
+    --alpha=<float>         Call loci unstable below this false discovery
+                            rate of KS tests [default: 0.05]
+    --out-tsv=<path>        Set a TSV of merged shard outputs
+                            (compressed if it ends with .gz or .bgz)
 
 Arguments:
     <bed>                   Path to a BED file of repetitive regions
     <fasta>                 Path to a reference genome FASTA file
+    <chrom>                 Chromosome to scan (default: all)
     <bam>                   Path to an input BAM/CRAM file
+                            (or SAM, and `-` for SAM on stdin with --sweep)
+    <obs_tsv>               Path to a TSV of observed repeats (or summary)
+    <shard_tsv>             Path to a TSV written with --shard
+                            (ordered by its `<path>.shard.json`)
 
 Commands:
     id                      Indentify repeat units from reference sequences
+    scan                    Identify repeat units across a reference genome
     detect                  Detect tandem repeats within read sequences
     pipeline                Execute both of the above commands
+    serve                   Answer repeat-length distribution requests over
+                            HTTP with a warm catalog and worker pool
+    score                   Score microsatellite instability of samples
+                            against normals from observed repeats
+    merge                   Merge sharded outputs of id or detect into the
+                            output of a single run
 """
 
+from collections import OrderedDict
 import logging
 from multiprocessing import cpu_count
 import os
 import signal
 from docopt import docopt
 from .. import __version__
-from ..call.identifier import identify_repeat_units_on_bed
-from ..call.detector import detect_tandem_repeats_in_reads
+from ..util.helper import fetch_abspath, print_log
+from ..util.metrics import Metrics, start_profiler, write_metrics_report
 
 
 def main():
@@ -68,20 +177,98 @@ def main():
     n_proc = int(args['--processes'] or cpu_count())
     logger.debug('n_proc: {}'.format(n_proc))
     signal.signal(signal.SIGINT, signal.SIG_DFL)
+    profile_dir = (
+        fetch_abspath(args['--profile']) if args['--profile'] else None
+    )
+    if profile_dir:
+        start_profiler(
+            path=os.path.join(profile_dir, 'main.{}.prof'.format(os.getpid()))
+        )
+    metrics = OrderedDict([
+        (k, Metrics()) for k in ['id', 'scan', 'detect', 'score', 'merge']
+        if args[k] or (args['pipeline'] and k != 'scan')
+    ])
+    catalog = None
     if args['id'] or args['pipeline']:
-        identify_repeat_units_on_bed(
+        from ..call.identifier import identify_repeat_units_on_bed
+        catalog = identify_repeat_units_on_bed(
             bed_path=args['<bed>'], genome_fa_path=args['<fasta>'],
             trunit_tsv_path=args['--unit-tsv'],
             max_unit_len=args['--max-unit-len'],
-            min_rep_times=args['--min-rep-times'],
-            min_rep_len=args['--min-rep-len'],
+            min_rep_times=(args['--min-rep-times'] or 2),
+            min_rep_len=(args['--min-rep-len'] or 5),
             flanking_len=args['--flanking-len'],
-            ex_region_len=args['--ex-region-len'], n_proc=n_proc
+            ex_region_len=args['--ex-region-len'], engine=args['--engine'],
+            max_buffer_mb=args['--buffer-mb'], no_cache=args['--no-cache'],
+            cache_dir=args['--cache-dir'], catalog_path=args['--catalog'],
+            return_catalog=args['pipeline'], resume=args['--resume'],
+            shard=args['--shard'], metrics=metrics['id'],
+            profile_dir=profile_dir, n_proc=n_proc
+        )
+    if args['scan']:
+        from ..call.identifier import identify_repeat_units_on_genome
+        identify_repeat_units_on_genome(
+            genome_fa_path=args['<fasta>'], trunit_tsv_path=args['--unit-tsv'],
+            chroms=args['<chrom>'], max_unit_len=args['--max-unit-len'],
+            min_rep_times=(args['--min-rep-times'] or 3),
+            min_rep_len=(args['--min-rep-len'] or 10),
+            flanking_len=args['--flanking-len'],
+            chunk_len=args['--chunk-len'], max_buffer_mb=args['--buffer-mb'],
+            catalog_path=args['--catalog'], metrics=metrics['scan'],
+            profile_dir=profile_dir, n_proc=n_proc
         )
     if args['detect'] or args['pipeline']:
+        from ..call.detector import detect_tandem_repeats_in_reads
         detect_tandem_repeats_in_reads(
             bam_paths=args['<bam>'], trunit_tsv_path=args['--unit-tsv'],
             obs_tsv_path=args['--obs-tsv'], index_bam=args['--index-bam'],
-            append_read_seq=args['--append-read-seq'],
-            samtools=args['--samtools'], n_proc=n_proc
+            append_read_seq=args['--append-read-seq'], sweep=args['--sweep'],
+            summary=args['--summary'],
+            reader=args['--reader'], samtools=args['--samtools'],
+            min_mapq=args['--min-mapq'],
+            include_flags=args['--include-flags'],
+            exclude_flags=args['--exclude-flags'],
+            skip_duplicates=args['--skip-duplicates'],
+            max_reads_per_locus=args['--max-reads-per-locus'],
+            early_stop=args['--early-stop'], seed=args['--seed'],
+            max_buffer_mb=args['--buffer-mb'],
+            catalog_path=args['--catalog'], catalog=catalog,
+            resume=args['--resume'], shard=args['--shard'],
+            metrics=metrics['detect'], profile_dir=profile_dir, n_proc=n_proc
+        )
+    if args['serve']:
+        from ..call.server import serve_repeat_detection
+        serve_repeat_detection(
+            bam_paths=args['<bam>'], trunit_tsv_path=args['--unit-tsv'],
+            catalog_path=args['--catalog'], socket_path=args['--socket'],
+            port=args['--port'], index_bam=args['--index-bam'],
+            reader=args['--reader'], samtools=args['--samtools'],
+            min_mapq=args['--min-mapq'],
+            include_flags=args['--include-flags'],
+            exclude_flags=args['--exclude-flags'],
+            skip_duplicates=args['--skip-duplicates'],
+            max_open_bams=args['--max-open-bams'], n_proc=n_proc
+        )
+    if args['score']:
+        from ..call.scorer import score_microsatellite_instability
+        score_microsatellite_instability(
+            obs_tsv_paths=args['<obs_tsv>'], normal_names=args['--normal'],
+            score_tsv_path=args['--score-tsv'],
+            locus_tsv_path=args['--locus-tsv'], min_reads=args['--min-reads'],
+            alpha=args['--alpha'], metrics=metrics['score'],
+            profile_dir=profile_dir, n_proc=n_proc
+        )
+    if args['merge']:
+        from ..call.merger import merge_sharded_tables
+        merge_sharded_tables(
+            shard_tsv_paths=args['<shard_tsv>'],
+            merged_tsv_path=args['--out-tsv'], metrics=metrics['merge']
+        )
+    if args['--metrics']:
+        write_metrics_report(
+            path=fetch_abspath(args['--metrics']),
+            reports=OrderedDict([
+                (k, v.summarize(n_proc=n_proc)) for k, v in metrics.items()
+            ])
         )
+        print_log('Write a metrics report:\t{}'.format(args['--metrics']))
@@ -3,14 +3,22 @@
 # Pandas-based Data Frame Handlers DNA-sequencing
 # https://github.com/dceoy/pandna
 
-import io
+import bz2
+import gzip
+import numpy as np
 import pandas as pd
-from .basebiodf import BaseBioDataFrame
+from .basebiodf import BaseBioDataFrame, BioDataFrameError
 
 
 class BedDataFrame(BaseBioDataFrame):
     def __init__(self, path, opt_cols=[]):
-        super().__init__(path=path, supported_exts=['.bed', '.txt', '.tsv'])
+        super().__init__(
+            path=path,
+            supported_exts=[
+                (e + c) for e in ['.bed', '.txt', '.tsv']
+                for c in ['', '.gz', '.bz2']
+            ]
+        )
         self.__fixed_cols = ['chrom', 'chromStart', 'chromEnd']
         self.__opt_cols = opt_cols or [
             'name', 'score', 'strand', 'thickStart', 'thickEnd', 'itemRgb',
@@ -24,30 +32,89 @@ class BedDataFrame(BaseBioDataFrame):
         }
         self.__detected_cols = []
         self.__detected_col_dtypes = {}
+        self.__n_skipped_lines = 0
         self.header = []
 
     def load(self):
-        with open(self.path, 'r') as f:
-            for s in f:
-                self._load_bed_line(string=s)
-        self.df = self.df.reset_index(drop=True)
-
-    def _load_bed_line(self, string):
-        if string.startswith(('browser', 'track')):
-            self.header.append(string.strip())
+        self._detect_header_and_cols()
+        if self.__detected_cols:
+            self.df = self._cast_bed_df(df=self._read_bed()).reset_index(
+                drop=True
+            )
         else:
-            if not self.__detected_cols:
-                self.__detected_cols = [
-                    *self.__fixed_cols, *self.__opt_cols
-                ][:(string.count('\t') + 1)]
-                self.__detected_col_dtypes = {
-                    k: (self.__fixed_col_dtypes.get(k) or str)
-                    for k in self.__detected_cols
-                }
-            self.df = self.df.append(
-                pd.read_csv(
-                    io.StringIO(string), header=None,
-                    names=self.__detected_cols,
-                    dtype=self.__detected_col_dtypes, sep='\t'
+            self.df = pd.DataFrame(columns=self.__fixed_cols)
+
+    def iterate_chunks(self, chunksize=100000):
+        self._detect_header_and_cols()
+        if self.__detected_cols:
+            n = 0
+            with self._read_bed(chunksize=chunksize) as reader:
+                for df in reader:
+                    df = self._cast_bed_df(df=df)
+                    df.index = pd.RangeIndex(n, n + df.shape[0])
+                    n += df.shape[0]
+                    yield df
+
+    def _read_bed(self, **kwargs):
+        return pd.read_csv(
+            self.path, sep='\t', header=None,
+            skiprows=self.__n_skipped_lines, names=self.__detected_cols,
+            dtype=str, skip_blank_lines=False,
+            compression='infer', **kwargs
+        )
+
+    def _cast_bed_df(self, df):
+        df = df[
+            df['chrom'].notna()
+            & ~df['chrom'].str.startswith(('#', 'browser', 'track'), na=False)
+        ]
+        for k, t in self.__detected_col_dtypes.items():
+            if t is not int:
+                continue
+            v = pd.to_numeric(df[k], errors='coerce')
+            invalid = v.isna() & (
+                df[k].notna() if k not in self.__fixed_cols else True
+            )
+            if invalid.any():
+                raise BioDataFrameError(
+                    'invalid {0} at line {1}: {2}'.format(
+                        k, self.__n_skipped_lines + invalid.idxmax() + 1,
+                        self.path
+                    )
                 )
+            df = df.assign(
+                **{k: v.astype(np.int64 if v.notna().all() else 'Int64')}
             )
+        return df
+
+    def _detect_header_and_cols(self):
+        self.header = []
+        self.__detected_cols = []
+        self.__n_skipped_lines = 0
+        with self._open() as f:
+            for s in f:
+                if s.startswith(('browser', 'track', '#')):
+                    self.header.append(s.strip())
+                elif s.strip():
+                    n_cols = s.rstrip('\r\n').count('\t') + 1
+                    if n_cols < len(self.__fixed_cols):
+                        raise BioDataFrameError(
+                            'invalid BED line: {}'.format(s.strip())
+                        )
+                    self.__detected_cols = [
+                        *self.__fixed_cols, *self.__opt_cols
+                    ][:n_cols]
+                    self.__detected_col_dtypes = {
+                        k: (self.__fixed_col_dtypes.get(k) or str)
+                        for k in self.__detected_cols
+                    }
+                    break
+                self.__n_skipped_lines += 1
+
+    def _open(self):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, 'rt')
+        elif self.path.endswith('.bz2'):
+            return bz2.open(self.path, 'rt')
+        else:
+            return open(self.path, 'r')
@@ -0,0 +1,509 @@
+#!/usr/bin/env python
+
+from abc import ABCMeta, abstractmethod
+from collections import namedtuple, OrderedDict
+from functools import partial
+import os
+import re
+import struct
+import sys
+import threading
+from .bgzf import BgzfReader
+from .biotools import view_bam_lines_including_region
+from .helper import fetch_abspath, fetch_executable, run_and_parse_subprocess
+from .samrecord import parse_sam_line, SamRecord
+
+
+ReadFilter = namedtuple(
+    'ReadFilter', ['min_mapq', 'include_flags', 'exclude_flags']
+)
+
+
+class BaseBamReader(object, metaclass=ABCMeta):
+    def __init__(self, path, read_filter=None):
+        self.path = fetch_abspath(path=path)
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError('File not found: {}'.format(self.path))
+        self.read_filter = read_filter
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def fetch_spanning_reads(self, rname, start_pos, end_pos):
+        pass
+
+    @abstractmethod
+    def iterate_reads(self):
+        pass
+
+
+class SamtoolsBamReader(BaseBamReader):
+    def __init__(self, path, samtools_path=None, read_filter=None):
+        super().__init__(path=path, read_filter=read_filter)
+        self.samtools_path = samtools_path
+        self.__options = (
+            [
+                *(['-q', str(read_filter.min_mapq)]
+                  if read_filter.min_mapq else []),
+                *(['-f', str(read_filter.include_flags)]
+                  if read_filter.include_flags else []),
+                *(['-F', str(read_filter.exclude_flags)]
+                  if read_filter.exclude_flags else [])
+            ] if read_filter else []
+        )
+
+    def fetch_spanning_reads(self, rname, start_pos, end_pos):
+        return view_bam_lines_including_region(
+            bam_path=self.path, rname=rname, start_pos=start_pos,
+            end_pos=end_pos, options=self.__options,
+            samtools_path=self.samtools_path
+        )
+
+    def iterate_reads(self):
+        args = [
+            self.samtools_path or fetch_executable('samtools'), 'view',
+            *self.__options, self.path
+        ]
+        for s in run_and_parse_subprocess(args=args):
+            yield parse_sam_line(line=s)
+
+
+class SamTextReader(BaseBamReader):
+    def __init__(self, path, read_filter=None):
+        if path == '-':
+            self.path = path
+            self.read_filter = read_filter
+        else:
+            super().__init__(path=path, read_filter=read_filter)
+
+    def fetch_spanning_reads(self, rname, start_pos, end_pos):
+        raise BamReaderError(
+            'random access not supported for SAM text: {}'.format(self.path)
+        )
+
+    def iterate_reads(self):
+        f = sys.stdin if self.path == '-' else open(self.path, 'r')
+        try:
+            for s in f:
+                if not s.startswith('@'):
+                    r = parse_sam_line(line=s)
+                    if passes_read_filter(
+                            flag=r['FLAG'], mapq=r['MAPQ'],
+                            read_filter=self.read_filter
+                    ):
+                        yield r
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+class PysamBamReader(BaseBamReader):
+    def __init__(self, path, read_filter=None):
+        super().__init__(path=path, read_filter=read_filter)
+        import pysam
+        self.__pysam = pysam
+        self.__file = pysam.AlignmentFile(self.path)
+
+    def close(self):
+        self.__file.close()
+
+    def fetch_spanning_reads(self, rname, start_pos, end_pos):
+        if self.__file.get_tid(rname) < 0:
+            return
+        for r in self.__file.fetch(rname, start_pos - 1, start_pos):
+            if not passes_read_filter(
+                    flag=r.flag, mapq=r.mapping_quality,
+                    read_filter=self.read_filter
+            ):
+                continue
+            r_end = (
+                r.reference_start + 1 if r.is_unmapped or not r.cigartuples
+                else r.reference_end
+            )
+            if r.reference_start < start_pos and r_end >= end_pos:
+                yield SamRecord(
+                    decoder=partial(self._convert_values, r), opt=None
+                )
+
+    def iterate_reads(self):
+        self.__file.reset()
+        for r in self.__file.fetch(until_eof=True):
+            if passes_read_filter(
+                    flag=r.flag, mapq=r.mapping_quality,
+                    read_filter=self.read_filter
+            ):
+                yield self._convert_record(r)
+
+    def _convert_record(self, r):
+        return SamRecord(values=self._convert_values(r), opt=None)
+
+    def _convert_values(self, r):
+        return [
+            r.query_name, r.flag, r.reference_name or '*',
+            r.reference_start + 1, r.mapping_quality, r.cigarstring or '*',
+            (
+                '*' if r.next_reference_id < 0 else
+                '=' if r.next_reference_id == r.reference_id
+                else r.next_reference_name
+            ),
+            r.next_reference_start + 1, r.template_length,
+            r.query_sequence or '*',
+            (
+                self.__pysam.qualities_to_qualitystring(r.query_qualities)
+                if r.query_qualities is not None else '*'
+            )
+        ]
+
+
+class NativeBamReader(BaseBamReader):
+    def __init__(self, path, read_filter=None):
+        super().__init__(path=path, read_filter=read_filter)
+        if not self.path.endswith('.bam'):
+            raise BamReaderError('BAM file required: {}'.format(self.path))
+        self.__bgzf = BgzfReader(path=self.path)
+        self.ref_names = self._read_header()
+        self.__ref_ids = {k: i for i, k in enumerate(self.ref_names)}
+        self.__first_voffset = self.__bgzf.tell()
+        self.__index = None
+
+    def close(self):
+        self.__bgzf.close()
+
+    def fetch_spanning_reads(self, rname, start_pos, end_pos):
+        if self.__index is None:
+            self.__index = self._load_index()
+        tid = self.__ref_ids.get(rname)
+        if tid is None or tid >= len(self.__index):
+            return
+        beg = start_pos - 1
+        for chunk_beg, chunk_end in self._query_chunks(tid=tid, beg=beg):
+            self.__bgzf.seek(chunk_beg)
+            while self.__bgzf.tell() < chunk_end:
+                raw = self._read_record()
+                if raw is None:
+                    break
+                ref_id, pos = struct.unpack_from('<ii', raw, 0)
+                if ref_id != tid or pos > beg:
+                    return
+                elif (self._passes_read_filter(raw) and
+                      _bam_record_end(raw) >= end_pos):
+                    yield SamRecord(
+                        decoder=partial(self._decode_values, raw), opt=None
+                    )
+
+    def iterate_reads(self):
+        self.__bgzf.seek(self.__first_voffset)
+        while True:
+            raw = self._read_record()
+            if raw is None:
+                break
+            elif self._passes_read_filter(raw):
+                yield self._decode_record(raw)
+
+    def _passes_read_filter(self, raw):
+        return self.read_filter is None or passes_read_filter(
+            flag=struct.unpack_from('<H', raw, 14)[0], mapq=raw[9],
+            read_filter=self.read_filter
+        )
+
+    def _load_index(self):
+        bai_paths = [
+            p for p in [
+                self.path + '.bai', os.path.splitext(self.path)[0] + '.bai'
+            ] if os.path.isfile(p)
+        ]
+        if not bai_paths:
+            raise FileNotFoundError(
+                'BAM index not found: {}'.format(self.path + '.bai')
+            )
+        else:
+            return _read_bai(path=bai_paths[0])
+
+    def _query_chunks(self, tid, beg):
+        bins, linear_index = self.__index[tid]
+        min_offset = (
+            linear_index[beg >> 14] if (beg >> 14) < len(linear_index)
+            else (linear_index[-1] if linear_index else 0)
+        )
+        chunks = sorted(
+            c for b in _reg2bins(beg, beg + 1) for c in bins.get(b, [])
+            if c[1] > min_offset
+        )
+        merged = list()
+        for c in chunks:
+            c = (max(c[0], min_offset), c[1])
+            if merged and c[0] <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], c[1]))
+            else:
+                merged.append(c)
+        return merged
+
+    def _read_header(self):
+        self.__bgzf.seek(0)
+        if self.__bgzf.read(4) != b'BAM\x01':
+            raise BamReaderError('invalid BAM file: {}'.format(self.path))
+        l_text = struct.unpack('<i', self.__bgzf.read(4))[0]
+        self.__bgzf.read(l_text)
+        ref_names = list()
+        for _ in range(struct.unpack('<i', self.__bgzf.read(4))[0]):
+            l_name = struct.unpack('<i', self.__bgzf.read(4))[0]
+            ref_names.append(self.__bgzf.read(l_name)[:-1].decode('ascii'))
+            self.__bgzf.read(4)
+        return ref_names
+
+    def _read_record(self):
+        buf = self.__bgzf.read(4)
+        if len(buf) < 4:
+            return None
+        else:
+            return self.__bgzf.read(struct.unpack('<i', buf)[0])
+
+    def _decode_record(self, raw):
+        return SamRecord(values=self._decode_values(raw), opt=None)
+
+    def _decode_values(self, raw):
+        ref_id, pos, l_read_name, mapq, _, n_cigar_op, flag, l_seq, \
+            next_ref_id, next_pos, tlen = struct.unpack_from(
+                '<iiBBHHHiiii', raw, 0
+            )
+        i = 32 + l_read_name
+        cigar = struct.unpack_from('<{}I'.format(n_cigar_op), raw, i)
+        i += 4 * n_cigar_op
+        seq_bytes = raw[i:(i + (l_seq + 1) // 2)]
+        i += (l_seq + 1) // 2
+        qual = raw[i:(i + l_seq)]
+        return [
+            raw[32:(32 + l_read_name - 1)].decode('ascii'), flag,
+            (self.ref_names[ref_id] if ref_id >= 0 else '*'), pos + 1,
+            mapq,
+            (
+                ''.join(
+                    '{}{}'.format(c >> 4, 'MIDNSHP=X'[c & 0xf])
+                    for c in cigar
+                ) or '*'
+            ),
+            (
+                '*' if next_ref_id < 0 else
+                '=' if next_ref_id == ref_id
+                else self.ref_names[next_ref_id]
+            ),
+            next_pos + 1, tlen,
+            (
+                ''.join(_SEQ_BYTE_TABLE[b] for b in seq_bytes)[:l_seq]
+                if l_seq else '*'
+            ),
+            (
+                '*' if not l_seq or qual[0] == 0xff
+                else bytes(q + 33 for q in qual).decode('ascii')
+            )
+        ]
+
+
+class BamReaderError(RuntimeError):
+    pass
+
+
+_CIGAR_REGEX = re.compile(r'([0-9]+)([MIDNSHP=X])')
+
+_SEQ_BYTE_TABLE = [
+    a + b for a in '=ACMGRSVTWYHKDBN' for b in '=ACMGRSVTWYHKDBN'
+]
+
+
+def _bam_record_end(raw):
+    pos, l_read_name, n_cigar_op, flag = (
+        struct.unpack_from('<i', raw, 4)[0], raw[8],
+        struct.unpack_from('<H', raw, 12)[0],
+        struct.unpack_from('<H', raw, 14)[0]
+    )
+    if flag & 0x4 or not n_cigar_op:
+        return pos + 1
+    else:
+        return pos + sum(
+            c >> 4 for c in struct.unpack_from(
+                '<{}I'.format(n_cigar_op), raw, 32 + l_read_name
+            ) if (c & 0xf) in (0, 2, 3, 7, 8)
+        )
+
+
+def make_read_filter(min_mapq=0, include_flags=0, exclude_flags=0,
+                     skip_duplicates=False):
+    rf = ReadFilter(
+        min_mapq=int(min_mapq), include_flags=_parse_flags(include_flags),
+        exclude_flags=(
+            _parse_flags(exclude_flags) | (0x400 if skip_duplicates else 0)
+        )
+    )
+    return rf if any(rf) else None
+
+
+def _parse_flags(flags):
+    return int(flags, 0) if isinstance(flags, str) else int(flags)
+
+
+def passes_read_filter(flag, mapq, read_filter=None):
+    return read_filter is None or (
+        mapq >= read_filter.min_mapq and
+        (flag & read_filter.include_flags) == read_filter.include_flags and
+        not flag & read_filter.exclude_flags
+    )
+
+
+def calculate_alignment_end(flag, pos, cigar):
+    if flag & 0x4 or cigar == '*':
+        return pos
+    else:
+        return pos - 1 + sum(
+            int(n) for n, op in _CIGAR_REGEX.findall(cigar) if op in 'MDN=X'
+        )
+
+
+def estimate_region_bytes(bam_path, regions):
+    p = fetch_abspath(bam_path)
+    bai_paths = [
+        b for b in [p + '.bai', os.path.splitext(p)[0] + '.bai']
+        if p.endswith('.bam') and os.path.isfile(b)
+    ]
+    if not bai_paths:
+        return None
+    r = NativeBamReader(path=p)
+    try:
+        ref_ids = {k: i for i, k in enumerate(r.ref_names)}
+    finally:
+        r.close()
+    index = _read_bai(path=bai_paths[0])
+    ref_end_offsets = [
+        max([c[1] for v in bins.values() for c in v], default=0)
+        for bins, _ in index
+    ]
+    sizes = list()
+    for rname, start_pos, end_pos in regions:
+        tid = ref_ids.get(rname)
+        if tid is None or tid >= len(index) or not index[tid][1]:
+            sizes.append(0)
+            continue
+        linear_index = index[tid][1]
+        w0 = min((start_pos - 1) >> 14, len(linear_index) - 1)
+        w1 = ((end_pos - 1) >> 14) + 1
+        end_offset = (
+            linear_index[w1] if w1 < len(linear_index)
+            else ref_end_offsets[tid]
+        )
+        sizes.append(max(0, (end_offset >> 16) - (linear_index[w0] >> 16)))
+    return sizes
+
+
+def _reg2bins(beg, end):
+    end -= 1
+    bins = [0]
+    for shift, offset in [(26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)]:
+        bins.extend(
+            range(offset + (beg >> shift), offset + (end >> shift) + 1)
+        )
+    return bins
+
+
+def _read_bai(path):
+    with open(path, 'rb') as f:
+        buf = f.read()
+    if buf[:4] != b'BAI\x01':
+        raise BamReaderError('invalid BAI file: {}'.format(path))
+    i = 8
+    index = list()
+    for _ in range(struct.unpack_from('<i', buf, 4)[0]):
+        bins = dict()
+        n_bin = struct.unpack_from('<i', buf, i)[0]
+        i += 4
+        for _ in range(n_bin):
+            b, n_chunk = struct.unpack_from('<Ii', buf, i)
+            i += 8
+            chunks = [
+                struct.unpack_from('<QQ', buf, i + 16 * j)
+                for j in range(n_chunk)
+            ]
+            i += 16 * n_chunk
+            if b != 37450:
+                bins[b] = chunks
+        n_intv = struct.unpack_from('<i', buf, i)[0]
+        i += 4
+        linear_index = list(struct.unpack_from('<{}Q'.format(n_intv), buf, i))
+        i += 8 * n_intv
+        index.append((bins, linear_index))
+    return index
+
+
+class BamReaderCache(object):
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.__readers = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__readers)
+
+    def open(self, bam_path, reader='auto', samtools_path=None,
+             read_filter=None):
+        key = (bam_path, reader, samtools_path, read_filter)
+        with self.__lock:
+            if key in self.__readers:
+                self.__readers.move_to_end(key)
+                return self.__readers[key]
+            else:
+                r = _make_bam_reader(*key)
+                self.__readers[key] = r
+                while len(self.__readers) > max(1, self.max_size):
+                    self.__readers.popitem(last=False)[1].close()
+                return r
+
+    def clear(self):
+        with self.__lock:
+            while self.__readers:
+                self.__readers.popitem()[1].close()
+
+
+_bam_readers = BamReaderCache()
+
+
+def open_bam_reader(bam_path, reader='auto', samtools_path=None,
+                    read_filter=None):
+    return _bam_readers.open(
+        bam_path=bam_path, reader=reader, samtools_path=samtools_path,
+        read_filter=read_filter
+    )
+
+
+def reset_bam_readers(max_size=None):
+    _bam_readers.clear()
+    if max_size:
+        _bam_readers.max_size = int(max_size)
+
+
+def _make_bam_reader(bam_path, reader='auto', samtools_path=None,
+                     read_filter=None):
+    if bam_path == '-' or bam_path.endswith('.sam'):
+        return SamTextReader(path=bam_path, read_filter=read_filter)
+    elif reader == 'auto':
+        try:
+            import pysam  # noqa: F401
+        except ImportError:
+            reader = ('native' if bam_path.endswith('.bam') else 'samtools')
+        else:
+            reader = 'pysam'
+    if reader == 'pysam':
+        return PysamBamReader(path=bam_path, read_filter=read_filter)
+    elif reader == 'native':
+        return NativeBamReader(path=bam_path, read_filter=read_filter)
+    elif reader == 'samtools':
+        return SamtoolsBamReader(
+            path=bam_path, samtools_path=samtools_path,
+            read_filter=read_filter
+        )
+    else:
+        raise ValueError('invalid reader: {}'.format(reader))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+import struct
+import zlib
+
+
+class BgzfReader(object):
+    def __init__(self, path):
+        self.path = path
+        self.__file = open(path, 'rb')
+        self.__block_coffset = None
+        self.__block_size = 0
+        self.__block_data = b''
+        self.__uoffset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.__file.close()
+
+    def seek(self, voffset):
+        coffset, uoffset = voffset >> 16, voffset & 0xffff
+        if coffset != self.__block_coffset:
+            self._load_block(coffset=coffset)
+        self.__uoffset = uoffset
+
+    def tell(self):
+        if (self.__uoffset >= len(self.__block_data) and
+                self.__block_coffset is not None):
+            return (self.__block_coffset + self.__block_size) << 16
+        else:
+            return ((self.__block_coffset or 0) << 16) | self.__uoffset
+
+    def read(self, size):
+        chunks = list()
+        while size > 0:
+            if self.__uoffset >= len(self.__block_data):
+                if not self._load_block(
+                        coffset=(
+                            0 if self.__block_coffset is None
+                            else self.__block_coffset + self.__block_size
+                        )
+                ):
+                    break
+                elif not self.__block_data:
+                    continue
+            data = self.__block_data[self.__uoffset:(self.__uoffset + size)]
+            chunks.append(data)
+            self.__uoffset += len(data)
+            size -= len(data)
+        return b''.join(chunks)
+
+    def _load_block(self, coffset):
+        self.__file.seek(coffset)
+        header = self.__file.read(18)
+        if not header:
+            return False
+        elif not is_bgzf(header):
+            raise BgzfError('invalid BGZF block at: {}'.format(coffset))
+        block_size = bgzf_block_size(header + self.__file.read(
+            max(0, struct.unpack_from('<H', header, 10)[0] - 6)
+        ), 0)
+        self.__file.seek(coffset)
+        self.__block_data = zlib.decompress(
+            self.__file.read(block_size), wbits=31
+        )
+        self.__block_coffset = coffset
+        self.__block_size = block_size
+        self.__uoffset = 0
+        return True
+
+
+class BgzfWriter(object):
+    def __init__(self, path, compresslevel=6):
+        self.path = path
+        self.compresslevel = compresslevel
+        self.__file = open(path, 'wb')
+        self.__buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data):
+        self.__buffer.extend(data)
+        while len(self.__buffer) >= _MAX_BLOCK_DATA_SIZE:
+            self._write_block(bytes(self.__buffer[:_MAX_BLOCK_DATA_SIZE]))
+            del self.__buffer[:_MAX_BLOCK_DATA_SIZE]
+
+    def close(self):
+        if self.__buffer:
+            self._write_block(bytes(self.__buffer))
+            self.__buffer = bytearray()
+        self.__file.write(_BGZF_EOF)
+        self.__file.close()
+
+    def _write_block(self, data):
+        c = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        cdata = c.compress(data) + c.flush()
+        self.__file.write(
+            struct.pack(
+                '<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2,
+                len(cdata) + 25
+            ) + cdata +
+            struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+        )
+
+
+class BgzfError(RuntimeError):
+    pass
+
+
+_MAX_BLOCK_DATA_SIZE = 0xff00
+
+_BGZF_EOF = bytes.fromhex(
+    '1f8b08040000000000ff0600424302001b0003000000000000000000'
+)
+
+
+def is_bgzf(header):
+    return (
+        len(header) >= 18 and header[:4] == b'\x1f\x8b\x08\x04' and
+        header[12:14] == b'BC'
+    )
+
+
+def bgzf_block_size(buf, c_offset):
+    xlen = struct.unpack_from('<H', buf, c_offset + 10)[0]
+    i = c_offset + 12
+    while i < c_offset + 12 + xlen:
+        si, slen = buf[i:(i + 2)], struct.unpack_from('<H', buf, i + 2)[0]
+        if si == b'BC':
+            return struct.unpack_from('<H', buf, i + 4)[0] + 1
+        i += 4 + slen
+    raise BgzfError('invalid BGZF block at: {}'.format(c_offset))
+
+
+def iterate_bgzf_blocks(buf):
+    c_offset = 0
+    u_offset = 0
+    while c_offset < len(buf):
+        block_size = bgzf_block_size(buf, c_offset)
+        yield c_offset, u_offset
+        u_offset += struct.unpack_from(
+            '<I', buf, c_offset + block_size - 4
+        )[0]
+        c_offset += block_size
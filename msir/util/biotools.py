@@ -1,21 +1,18 @@
 #!/usr/bin/env python
 
 import bz2
-from collections import OrderedDict
 import gzip
-import io
 from itertools import chain, product
 import logging
 import os
 import subprocess
-from Bio import SeqIO
-import pandas as pd
-from ..df.beddf import BedDataFrame
 from .helper import fetch_abspath, fetch_executable, print_log, \
     run_and_parse_subprocess
+from .samrecord import parse_sam_lines
 
 
 def read_fasta(path):
+    from Bio import SeqIO
     p = fetch_abspath(path=path)
     if p.endswith('.gz'):
         f = gzip.open(p, 'rt')
@@ -29,9 +26,17 @@ def read_fasta(path):
 
 
 def read_bed(path):
+    from ..df.beddf import BedDataFrame
     return BedDataFrame(path=fetch_abspath(path=path)).load_and_output_df()
 
 
+def iterate_bed_chunks(path, chunksize=100000):
+    from ..df.beddf import BedDataFrame
+    return BedDataFrame(path=fetch_abspath(path=path)).iterate_chunks(
+        chunksize=chunksize
+    )
+
+
 def iterate_unique_repeat_units(max_unit_len=6, bases='ACGT'):
     patterns_by_ul = []
     for ul in range(1, max_unit_len + 1):
@@ -100,31 +105,11 @@ def view_bam_lines_including_region(bam_path, rname, start_pos, end_pos,
         ) for p in [start_pos, end_pos]
     ]
     end_pos_set = set(run_and_parse_subprocess(args=args_list[1]))
-    for r in run_and_parse_subprocess(args=args_list[0]):
-        if r not in end_pos_set:
-            pass
-        elif parse_lines:
-            yield _parse_sam_line(line=r)
-        else:
-            yield r
-
-
-def _parse_sam_line(line):
-    fixed_cols = [
-        'QNAME', 'FLAG', 'RNAME', 'POS', 'MAPQ', 'CIGAR', 'RNEXT', 'PNEXT',
-        'TLEN', 'SEQ', 'QUAL'
+    lines = [
+        r for r in run_and_parse_subprocess(args=args_list[0])
+        if r in end_pos_set
     ]
-    fixed_col_dtypes = {
-        'QNAME': str, 'FLAG': int, 'RNAME': str, 'POS': int, 'MAPQ': int,
-        'CIGAR': str, 'RNEXT': str, 'PNEXT': int, 'TLEN': int, 'SEQ': str,
-        'QUAL': str
-    }
-    n_fixed_cols = len(fixed_cols)
-    cols = fixed_cols + [
-        'OPT{}'.format(i)
-        for i in range(max(0, (line.count('\t') + 1) - n_fixed_cols))
-    ]
-    col_dtypes = {k: (fixed_col_dtypes.get(k) or str) for k in cols}
-    return pd.read_csv(
-        io.StringIO(line), header=None, names=cols, dtype=col_dtypes, sep='\t'
-    ).iloc[0].to_dict(into=OrderedDict)
+    if parse_lines:
+        yield from parse_sam_lines(buffer=''.join(lines))
+    else:
+        yield from lines
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from .helper import fetch_abspath
+
+
+class IntervalCache(object):
+    def __init__(self, path, max_size=(1024 * 1024 * 1024),
+                 min_vacuum_size=(64 * 1024 * 1024)):
+        self.path = fetch_abspath(path)
+        self.max_size = max_size
+        self.min_vacuum_size = min_vacuum_size
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.__db = sqlite3.connect(self.path, timeout=60)
+        self.__db.executescript(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            ' key TEXT PRIMARY KEY, value TEXT, size INTEGER, atime REAL'
+            ');'
+            'CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime);'
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,'
+            ' digest TEXT'
+            ');'
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.evict()
+        self.__db.close()
+
+    def fetch_file_digest(self, path):
+        abspath = fetch_abspath(path)
+        st = os.stat(abspath)
+        cached = self.__db.execute(
+            'SELECT digest FROM files WHERE path = ? AND size = ?'
+            ' AND mtime_ns = ?', (abspath, st.st_size, st.st_mtime_ns)
+        ).fetchone()
+        if cached:
+            return cached[0]
+        else:
+            h = hashlib.sha1()
+            with open(abspath, 'rb') as f:
+                for b in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(b)
+            with self.__db:
+                self.__db.execute(
+                    'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                    (abspath, st.st_size, st.st_mtime_ns, h.hexdigest())
+                )
+            return h.hexdigest()
+
+    def get_many(self, keys, batch_size=500):
+        hits = dict()
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:(i + batch_size)]
+            hits.update(
+                self.__db.execute(
+                    'SELECT key, value FROM entries WHERE key IN ({})'.format(
+                        ', '.join('?' for _ in batch)
+                    ), batch
+                ).fetchall()
+            )
+        if hits:
+            with self.__db:
+                self.__db.executemany(
+                    'UPDATE entries SET atime = ? WHERE key = ?',
+                    [(time.time(), k) for k in hits.keys()]
+                )
+        return {k: (json.loads(v) if v else None) for k, v in hits.items()}
+
+    def put_many(self, items):
+        now = time.time()
+        records = list()
+        for k, v in items:
+            s = '' if v is None else json.dumps(v, default=_to_json_value)
+            records.append((k, s, len(k) + len(s), now))
+        with self.__db:
+            self.__db.executemany(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', records
+            )
+
+    def evict(self):
+        total_size = self.__db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries'
+        ).fetchone()[0]
+        if total_size <= self.max_size:
+            return 0
+        else:
+            logger = logging.getLogger(__name__)
+            logger.debug(
+                'evict cache entries: {0} > {1} B'.format(
+                    total_size, self.max_size
+                )
+            )
+            excess = total_size - self.max_size
+            cur = self.__db.execute(
+                'SELECT key, size FROM entries ORDER BY atime, rowid'
+            )
+            keys = list()
+            for k, s in cur:
+                keys.append((k,))
+                excess -= s
+                if excess <= 0:
+                    break
+            cur.close()
+            with self.__db:
+                self.__db.executemany(
+                    'DELETE FROM entries WHERE key = ?', keys
+                )
+            page_size, page_count, freelist_count = [
+                self.__db.execute('PRAGMA {}'.format(k)).fetchone()[0]
+                for k in ['page_size', 'page_count', 'freelist_count']
+            ]
+            if freelist_count * page_size >= max(
+                    self.min_vacuum_size, page_count * page_size // 4
+            ):
+                logger.debug(
+                    'vacuum a cache: {} B free'.format(
+                        freelist_count * page_size
+                    )
+                )
+                self.__db.execute('VACUUM')
+            return len(keys)
+
+
+def make_cache_key(*args):
+    return hashlib.sha1(
+        '\t'.join(str(a) for a in args).encode('utf-8')
+    ).hexdigest()
+
+
+def _to_json_value(v):
+    if hasattr(v, 'item'):
+        return v.item()
+    else:
+        raise TypeError('not JSON serializable: {!r}'.format(v))
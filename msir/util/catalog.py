@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+
+from bisect import bisect_right
+import mmap
+import os
+import struct
+import tempfile
+import numpy as np
+import pandas as pd
+from .helper import fetch_abspath
+
+
+_MAGIC = b'MSIRCAT\x01'
+
+_HEADER = struct.Struct('<8sIIQQQQQ')
+
+_SEQ_REF_DTYPE = np.dtype(
+    [('offset', '<u8'), ('length', '<u4'), ('packed', 'u1')]
+)
+
+_RECORD_DTYPE = np.dtype([
+    ('contig', '<u4'), ('chrom_start', '<i8'), ('chrom_end', '<i8'),
+    ('repeat_start', '<i8'), ('repeat_end', '<i8'), ('repeat_times', '<u4'),
+    ('unit', _SEQ_REF_DTYPE), ('left', _SEQ_REF_DTYPE),
+    ('right', _SEQ_REF_DTYPE)
+])
+
+_BASE_CODES = {b: i for i, b in enumerate('ACGT')}
+
+_DECODED_BYTES = [
+    ''.join('ACGT'[(b >> s) & 3] for s in (0, 2, 4, 6)) for b in range(256)
+]
+
+
+class RepeatCatalog(object):
+    def __init__(self, path):
+        self.path = fetch_abspath(path)
+        self._open()
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.__records.shape[0]
+
+    def __getitem__(self, id):
+        r = self.__records[id]
+        return {
+            'chrom': self.contigs[r['contig']],
+            'chromStart': int(r['chrom_start']),
+            'chromEnd': int(r['chrom_end']),
+            'repeat_start': int(r['repeat_start']),
+            'repeat_end': int(r['repeat_end']),
+            'repeat_unit': self._decode(r['unit']),
+            'repeat_unit_length': int(r['unit']['length']),
+            'repeat_times': int(r['repeat_times']),
+            'left_seq': self._decode(r['left']),
+            'right_seq': self._decode(r['right'])
+        }
+
+    def close(self):
+        self.__records = None
+        self.__index = None
+        self.__mm = None
+        self.__locus_index = None
+
+    def find_loci(self, regions):
+        if self.__locus_index is None:
+            self.__locus_index = self.make_locus_index()
+        return _find_overlapping_loci(
+            locus_index=self.__locus_index, regions=regions
+        )
+
+    def make_locus_index(self):
+        r = self.__records
+        starts = r['repeat_start'] + 1 - r['left']['length']
+        ends = r['repeat_end'] + r['right']['length']
+        locus_index = dict()
+        contigs = r['contig'][self.__index]
+        bounds = np.flatnonzero(np.diff(contigs)) + 1
+        for ids in np.split(self.__index, bounds):
+            if ids.size:
+                s = starts[ids].tolist()
+                locus_index[self.contigs[r['contig'][ids[0]]]] = (
+                    s, list(zip(s, ends[ids].tolist(), ids.tolist()))
+                )
+        return locus_index
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            self.__mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.__mm.size() < _HEADER.size:
+            raise CatalogFormatError('truncated catalog: {}'.format(self.path))
+        (magic, record_size, n_contigs, n_loci, records_offset, index_offset,
+         pool_offset, contigs_offset) = _HEADER.unpack_from(self.__mm, 0)
+        if magic != _MAGIC or record_size != _RECORD_DTYPE.itemsize:
+            raise CatalogFormatError('invalid catalog: {}'.format(self.path))
+        self.__records = np.frombuffer(
+            self.__mm, dtype=_RECORD_DTYPE, count=n_loci,
+            offset=records_offset
+        )
+        self.__index = np.frombuffer(
+            self.__mm, dtype='<u8', count=n_loci, offset=index_offset
+        )
+        self.__pool_offset = pool_offset
+        self.__locus_index = None
+        self.contigs = [
+            s.decode('utf-8') for s in
+            self.__mm[contigs_offset:].split(b'\n')[:n_contigs]
+        ]
+
+    def _decode(self, ref):
+        n = int(ref['length'])
+        if not n:
+            return None
+        start = self.__pool_offset + int(ref['offset'])
+        if ref['packed']:
+            return ''.join(
+                _DECODED_BYTES[b]
+                for b in self.__mm[start:(start + (n + 3) // 4)]
+            )[:n]
+        else:
+            return self.__mm[start:(start + n)].decode('ascii')
+
+
+class MemoryRepeatCatalog(object):
+    def __init__(self, records):
+        self.__records = [make_catalog_record(record=r) for r in records]
+        self.__locus_index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.__records)
+
+    def __getitem__(self, id):
+        return self.__records[id]
+
+    def close(self):
+        self.__locus_index = None
+
+    def find_loci(self, regions):
+        if self.__locus_index is None:
+            self.__locus_index = self.make_locus_index()
+        return _find_overlapping_loci(
+            locus_index=self.__locus_index, regions=regions
+        )
+
+    def make_locus_index(self):
+        loci = dict()
+        for id, r in enumerate(self.__records):
+            loci.setdefault(r['chrom'], list()).append((
+                r['repeat_start'] + 1 - len(r['left_seq'] or ''),
+                r['repeat_end'] + len(r['right_seq'] or ''), id
+            ))
+        return {
+            c: ([t[0] for t in v], v)
+            for c, v in ((c, sorted(v)) for c, v in loci.items())
+        }
+
+
+def make_catalog_record(record):
+    return {
+        k: (
+            (record[k] if isinstance(record[k], str) and record[k] else None)
+            if k in _SEQ_KEYS else
+            (str(record[k]) if k == 'chrom' else int(record[k]))
+        ) for k in _LOCUS_KEYS
+    }
+
+
+_LOCUS_KEYS = [
+    'chrom', 'chromStart', 'chromEnd', 'repeat_start', 'repeat_end',
+    'repeat_unit', 'repeat_unit_length', 'repeat_times', 'left_seq',
+    'right_seq'
+]
+
+_SEQ_KEYS = {'repeat_unit', 'left_seq', 'right_seq'}
+
+
+class CatalogFormatError(RuntimeError):
+    pass
+
+
+def write_repeat_catalog(tsv_path, catalog_path, chunksize=100000):
+    path = fetch_abspath(catalog_path)
+    contig_ids = dict()
+    spans = list()
+    n_loci = 0
+    pool_size = 0
+    with open(path, 'wb') as f, tempfile.TemporaryFile(
+            dir=os.path.dirname(path)
+    ) as pool:
+        f.write(b'\0' * _HEADER.size)
+        for df in pd.read_csv(
+                fetch_abspath(tsv_path), sep='\t', chunksize=chunksize,
+                usecols=[
+                    'chrom', 'chromStart', 'chromEnd', 'repeat_start',
+                    'repeat_end', 'repeat_unit', 'repeat_times', 'left_seq',
+                    'right_seq'
+                ],
+                dtype={
+                    'chrom': str, 'repeat_unit': str, 'left_seq': str,
+                    'right_seq': str
+                },
+                keep_default_na=False
+        ):
+            records = np.zeros(df.shape[0], dtype=_RECORD_DTYPE)
+            records['contig'] = [
+                contig_ids.setdefault(c, len(contig_ids)) for c in df['chrom']
+            ]
+            for k, c in [('chrom_start', 'chromStart'),
+                         ('chrom_end', 'chromEnd'),
+                         ('repeat_start', 'repeat_start'),
+                         ('repeat_end', 'repeat_end'),
+                         ('repeat_times', 'repeat_times')]:
+                records[k] = df[c].values
+            for k, c in [('unit', 'repeat_unit'), ('left', 'left_seq'),
+                         ('right', 'right_seq')]:
+                refs = list()
+                for s in df[c]:
+                    data, packed = _encode_sequence(s)
+                    refs.append((pool_size, len(s), packed))
+                    pool.write(data)
+                    pool_size += len(data)
+                records[k] = refs
+            f.write(records.tobytes())
+            spans.append(
+                np.stack([
+                    records['contig'],
+                    records['repeat_start'] + 1 - records['left']['length'],
+                    records['repeat_end'] + records['right']['length']
+                ])
+            )
+            n_loci += df.shape[0]
+        records_offset = _HEADER.size
+        index_offset = records_offset + n_loci * _RECORD_DTYPE.itemsize
+        if spans:
+            contigs, starts, ends = np.concatenate(spans, axis=1)
+            index = np.lexsort((np.arange(n_loci), ends, starts, contigs))
+        else:
+            index = np.zeros(0)
+        f.write(index.astype('<u8').tobytes())
+        pool_offset = index_offset + n_loci * 8
+        pool.seek(0)
+        for b in iter(lambda: pool.read(1024 * 1024), b''):
+            f.write(b)
+        contigs_offset = pool_offset + pool_size
+        f.write(
+            b''.join(
+                c.encode('utf-8') + b'\n' for c in contig_ids.keys()
+            )
+        )
+        f.seek(0)
+        f.write(
+            _HEADER.pack(
+                _MAGIC, _RECORD_DTYPE.itemsize, len(contig_ids), n_loci,
+                records_offset, index_offset, pool_offset, contigs_offset
+            )
+        )
+    return n_loci
+
+
+def _find_overlapping_loci(locus_index, regions):
+    ids = set()
+    for chrom, start, end in (tuple(r[:3]) for r in regions):
+        if chrom in locus_index:
+            starts, loci = locus_index[chrom]
+            ids.update(
+                id for _, end_pos, id in loci[:bisect_right(starts, end)]
+                if end_pos > start
+            )
+    return sorted(ids)
+
+
+def _encode_sequence(seq):
+    codes = [_BASE_CODES.get(b) for b in seq]
+    if None in codes:
+        return seq.encode('ascii'), 0
+    else:
+        codes.extend([0] * (-len(codes) % 4))
+        return bytes(
+            c0 | c1 << 2 | c2 << 4 | c3 << 6
+            for c0, c1, c2, c3 in zip(*[iter(codes)] * 4)
+        ), 1
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from .helper import fetch_abspath
+
+
+class TaskCheckpoint(object):
+    def __init__(self, path, fingerprint):
+        self.path = fetch_abspath(path)
+        self.fingerprint = fingerprint
+        manifest_path = os.path.join(self.path, 'manifest.json')
+        os.makedirs(self.path, exist_ok=True)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as f:
+                if json.load(f).get('fingerprint') != fingerprint:
+                    raise CheckpointError(
+                        'checkpoint for different inputs or options: '
+                        '{}'.format(self.path)
+                    )
+            for n in os.listdir(self.path):
+                if n.endswith('.tmp'):
+                    os.remove(os.path.join(self.path, n))
+        else:
+            _write_atomically(
+                path=manifest_path,
+                data=json.dumps({'fingerprint': fingerprint}).encode('utf-8')
+            )
+
+    def __len__(self):
+        return len(self._list_parts())
+
+    def load(self):
+        for n in self._list_parts():
+            with open(os.path.join(self.path, n), 'rb') as f:
+                yield pickle.load(f)
+
+    def save(self, name, obj):
+        _write_atomically(
+            path=os.path.join(self.path, '{}.part'.format(name)),
+            data=pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        )
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _list_parts(self):
+        return sorted(n for n in os.listdir(self.path) if n.endswith('.part'))
+
+
+class CheckpointError(RuntimeError):
+    pass
+
+
+def make_checkpoint_path(output_path):
+    return fetch_abspath(output_path) + '.ckpt'
+
+
+def describe_input_file(path):
+    if path == '-':
+        return path
+    else:
+        st = os.stat(fetch_abspath(path))
+        return '{0}:{1}:{2}'.format(
+            fetch_abspath(path), st.st_size, st.st_mtime_ns
+        )
+
+
+def make_catalog_digest(catalog):
+    h = hashlib.sha1()
+    for i in range(len(catalog)):
+        r = catalog[i]
+        h.update(
+            '\t'.join(
+                str(r[k]) for k in [
+                    'chrom', 'chromStart', 'chromEnd', 'repeat_start',
+                    'repeat_end', 'repeat_unit', 'repeat_times', 'left_seq',
+                    'right_seq'
+                ]
+            ).encode('utf-8') + b'\n'
+        )
+    return h.hexdigest()
+
+
+def _write_atomically(path, data):
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
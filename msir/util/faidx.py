@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+import bz2
+from bisect import bisect_right
+from collections import OrderedDict
+import gzip
+import logging
+import mmap
+import os
+import struct
+import zlib
+from .bgzf import bgzf_block_size, is_bgzf, iterate_bgzf_blocks
+from .helper import fetch_abspath
+
+
+class IndexedFasta(object):
+    def __init__(self, path, create_index=True, max_cached_blocks=256):
+        self.path = fetch_abspath(path=path)
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError('File not found: {}'.format(self.path))
+        self.__logger = logging.getLogger(__name__)
+        self.__file = open(self.path, 'rb')
+        self.__mmap = (
+            mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+            if os.path.getsize(self.path) else b''
+        )
+        self.__seqs = dict()
+        self.__gzi = None
+        self.__blocks = OrderedDict()
+        self.max_cached_blocks = max_cached_blocks
+        self.is_bgzf = is_bgzf(self.__mmap[:18])
+        if self.is_bgzf:
+            self.__gzi = self._load_or_create_gzi(create_index=create_index)
+        elif self.path.endswith(('.gz', '.bz2')):
+            self.__logger.warning(
+                'Load the whole FASTA into memory (not bgzip): {}'.format(
+                    self.path
+                )
+            )
+            self._load_compressed_seqs()
+        if self.__seqs:
+            self.index = OrderedDict([
+                (k, (len(v), None, None, None))
+                for k, v in self.__seqs.items()
+            ])
+        else:
+            self.index = self._load_or_create_fai(create_index=create_index)
+        self.lengths = OrderedDict([(k, v[0]) for k, v in self.index.items()])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.__blocks.clear()
+        if isinstance(self.__mmap, mmap.mmap):
+            self.__mmap.close()
+        self.__file.close()
+
+    def fetch(self, chrom, start=0, end=None):
+        length, offset, linebases, linewidth = self.index[chrom]
+        start = max(0, int(start))
+        end = length if end is None else min(length, int(end))
+        if start >= end:
+            return ''
+        elif self.__seqs:
+            return self.__seqs[chrom][start:end]
+        else:
+            byte_start = offset + (start // linebases) * linewidth + (
+                start % linebases
+            )
+            byte_end = offset + ((end - 1) // linebases) * linewidth + (
+                (end - 1) % linebases
+            ) + 1
+            return self._read_bytes(
+                start=byte_start, end=byte_end
+            ).replace(b'\n', b'').replace(b'\r', b'').decode('ascii')
+
+    def fetch_many(self, regions):
+        regions = list(regions)
+        seqs = [None] * len(regions)
+        for i in sorted(
+                range(len(regions)),
+                key=lambda i: (self.index[regions[i][0]][1] or 0,
+                               regions[i][1])
+        ):
+            seqs[i] = self.fetch(*regions[i])
+        return seqs
+
+    def _read_bytes(self, start, end):
+        if self.is_bgzf:
+            u_offsets = self.__gzi[1]
+            first = bisect_right(u_offsets, start) - 1
+            blocks = list()
+            i = first
+            while i < len(u_offsets) and u_offsets[i] < end:
+                blocks.append(self._decompress_block(i))
+                i += 1
+            skip = start - u_offsets[first]
+            return b''.join(blocks)[skip:(skip + end - start)]
+        else:
+            return self.__mmap[start:end]
+
+    def _decompress_block(self, i):
+        if i in self.__blocks:
+            self.__blocks.move_to_end(i)
+            return self.__blocks[i]
+        c_offset = self.__gzi[0][i]
+        block = zlib.decompress(
+            self.__mmap[c_offset:(c_offset + bgzf_block_size(
+                self.__mmap, c_offset
+            ))],
+            wbits=31
+        )
+        self.__blocks[i] = block
+        while len(self.__blocks) > max(1, self.max_cached_blocks):
+            self.__blocks.popitem(last=False)
+        return block
+
+    def _load_or_create_gzi(self, create_index=True):
+        gzi_path = self.path + '.gzi'
+        if os.path.isfile(gzi_path):
+            with open(gzi_path, 'rb') as f:
+                buf = f.read()
+            n_entries = struct.unpack_from('<Q', buf, 0)[0]
+            entries = [
+                struct.unpack_from('<QQ', buf, 8 + 16 * i)
+                for i in range(n_entries)
+            ]
+        elif create_index:
+            entries = list(iterate_bgzf_blocks(self.__mmap))[1:]
+            try:
+                with open(gzi_path, 'wb') as f:
+                    f.write(struct.pack('<Q', len(entries)))
+                    for e in entries:
+                        f.write(struct.pack('<QQ', *e))
+            except OSError as e:
+                self.__logger.warning('Failed to write: {}'.format(e))
+        else:
+            raise FastaIndexError('index not found: {}'.format(gzi_path))
+        return (
+            [0, *[e[0] for e in entries]], [0, *[e[1] for e in entries]]
+        )
+
+    def _load_or_create_fai(self, create_index=True):
+        fai_path = self.path + '.fai'
+        if os.path.isfile(fai_path):
+            with open(fai_path, 'r') as f:
+                return OrderedDict([
+                    (v[0], tuple(int(i) for i in v[1:5]))
+                    for v in [s.rstrip('\r\n').split('\t') for s in f] if v[0]
+                ])
+        elif create_index:
+            index = _build_fai(self._iterate_lines())
+            try:
+                with open(fai_path, 'w') as f:
+                    for k, v in index.items():
+                        f.write('\t'.join([k, *[str(i) for i in v]]) + '\n')
+            except OSError as e:
+                self.__logger.warning('Failed to write: {}'.format(e))
+            return index
+        else:
+            raise FastaIndexError('index not found: {}'.format(fai_path))
+
+    def _iterate_lines(self):
+        if self.is_bgzf:
+            chunks = (
+                self._decompress_block(i) for i in range(len(self.__gzi[0]))
+            )
+        else:
+            chunks = (
+                self.__mmap[i:(i + 1048576)]
+                for i in range(0, len(self.__mmap), 1048576)
+            )
+        offset = 0
+        rest = b''
+        for c in chunks:
+            lines = (rest + c).split(b'\n')
+            rest = lines.pop()
+            for s in lines:
+                yield offset, s + b'\n'
+                offset += len(s) + 1
+        if rest:
+            yield offset, rest
+
+    def _load_compressed_seqs(self):
+        opener = bz2.open if self.path.endswith('.bz2') else gzip.open
+        name = None
+        seq_lines = list()
+        with opener(self.path, 'rt') as f:
+            for s in f:
+                if s.startswith('>'):
+                    if name is not None:
+                        self.__seqs[name] = ''.join(seq_lines)
+                    name = s[1:].split()[0]
+                    seq_lines = list()
+                else:
+                    seq_lines.append(s.strip())
+        if name is not None:
+            self.__seqs[name] = ''.join(seq_lines)
+
+
+class FastaIndexError(RuntimeError):
+    pass
+
+
+def _build_fai(lines):
+    index = OrderedDict()
+    name = None
+    length = seq_offset = linebases = linewidth = 0
+    short_line_seen = False
+    for offset, line in lines:
+        if line.startswith(b'>'):
+            if name is not None:
+                index[name] = (length, seq_offset, linebases, linewidth)
+            name = line[1:].split()[0].decode('ascii')
+            length = 0
+            seq_offset = offset + len(line)
+            linebases = linewidth = 0
+            short_line_seen = False
+        elif name is not None:
+            bases = len(line.rstrip(b'\r\n'))
+            if not bases:
+                continue
+            elif short_line_seen:
+                raise FastaIndexError(
+                    'different line length in sequence: {}'.format(name)
+                )
+            elif not linebases:
+                linebases = bases
+                linewidth = len(line)
+            elif bases > linebases:
+                raise FastaIndexError(
+                    'different line length in sequence: {}'.format(name)
+                )
+            short_line_seen = (bases < linebases)
+            length += bases
+    if name is not None:
+        index[name] = (length, seq_offset, linebases, linewidth)
+    return index
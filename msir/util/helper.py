@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 
+from concurrent.futures import FIRST_COMPLETED, wait
 import logging
 import os
 import subprocess
+from .metrics import run_timed_task
 
 
 def validate_files_and_dirs(files=[], dirs=[]):
@@ -55,3 +57,34 @@ def run_and_parse_subprocess(args, stdout=subprocess.PIPE,
             raise subprocess.CalledProcessError(
                 returncode=p.returncode, cmd=p.args, output=outs, stderr=errs
             )
+
+
+def run_tasks_with_bounded_queue(executor, tasks, max_in_flight=8,
+                                 metrics=None):
+    pending = dict()
+    tasks = iter(tasks)
+    exhausted = False
+    while pending or not exhausted:
+        while not exhausted and len(pending) < max_in_flight:
+            try:
+                key, fn, args = next(tasks)
+            except StopIteration:
+                exhausted = True
+            else:
+                if fn is None:
+                    yield key, None
+                elif metrics is None:
+                    pending[executor.submit(fn, *args)] = key
+                else:
+                    pending[executor.submit(run_timed_task, fn, *args)] = key
+        if pending:
+            if metrics is not None:
+                metrics.observe('queue_depth', len(pending))
+            done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+            for f in done:
+                if metrics is None:
+                    yield pending.pop(f), f.result()
+                else:
+                    result, snapshot = f.result()
+                    metrics.merge(snapshot)
+                    yield pending.pop(f), result
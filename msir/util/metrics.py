@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+import cProfile
+import json
+from multiprocessing.util import Finalize
+import os
+import time
+
+
+class Metrics(object):
+    def __init__(self):
+        self.seconds = Counter()
+        self.counts = Counter()
+        self.peaks = Counter()
+
+    @contextmanager
+    def timer(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - t0
+
+    def time_iter(self, iterable, name):
+        it = iter(iterable)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                v = next(it)
+            except StopIteration:
+                return
+            finally:
+                self.seconds[name] += time.perf_counter() - t0
+            yield v
+
+    def observe(self, name, value):
+        self.counts['{}_total'.format(name)] += value
+        self.counts['{}_samples'.format(name)] += 1
+        self.peaks[name] = max(self.peaks[name], value)
+
+    def merge(self, snapshot):
+        seconds, counts, peaks = snapshot
+        self.seconds.update(seconds)
+        self.counts.update(counts)
+        for k, v in peaks.items():
+            self.peaks[k] = max(self.peaks[k], v)
+
+    def pop(self):
+        snapshot = (dict(self.seconds), dict(self.counts), dict(self.peaks))
+        self.seconds.clear()
+        self.counts.clear()
+        self.peaks.clear()
+        return snapshot
+
+    def summarize(self, n_proc=1):
+        total = self.seconds['total']
+        counts = OrderedDict([
+            (k, v) for k, v in sorted(self.counts.items())
+            if not k.endswith(('_total', '_samples'))
+        ])
+        return OrderedDict([
+            ('n_proc', n_proc),
+            ('seconds', OrderedDict(sorted(self.seconds.items()))),
+            ('counts', counts),
+            (
+                'per_second', OrderedDict([
+                    (k, (v / total if total else None))
+                    for k, v in counts.items()
+                ])
+            ),
+            (
+                'seconds_per_locus', OrderedDict([
+                    (
+                        k,
+                        (self.seconds[k] / counts['loci']
+                         if counts.get('loci') else None)
+                    ) for k in ['fetch', 'match'] if k in self.seconds
+                ])
+            ),
+            *[
+                (
+                    n, OrderedDict([
+                        (
+                            'mean',
+                            self.counts['{}_total'.format(n)]
+                            / self.counts['{}_samples'.format(n)]
+                        ),
+                        ('max', self.peaks[n])
+                    ])
+                ) for n in sorted(self.peaks)
+            ],
+            (
+                'worker_utilization',
+                (
+                    self.seconds['busy'] / (self.seconds['pool'] * n_proc)
+                    if self.seconds['pool'] else None
+                )
+            ),
+            (
+                'unattributed_worker_fraction',
+                (
+                    self.seconds['unattributed'] / self.seconds['busy']
+                    if self.seconds['busy'] else None
+                )
+            )
+        ])
+
+
+class ProgressReporter(object):
+    def __init__(self, total=None, unit='loci', interval=10):
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.done = 0
+        self.__start = time.perf_counter()
+        self.__last = self.__start
+
+    def update(self, n=1):
+        self.done += n
+        now = time.perf_counter()
+        if now - self.__last >= self.interval:
+            self.__last = now
+            self._print_line(now=now)
+
+    def close(self):
+        self._print_line(now=time.perf_counter())
+
+    def _print_line(self, now):
+        elapsed = now - self.__start
+        print(
+            '  {0}{1} {2}\t{3:.1f} {2}/s'.format(
+                self.done,
+                (
+                    '/{0} ({1:.1f}%)'.format(
+                        self.total, 100 * self.done / self.total
+                    ) if self.total else ''
+                ),
+                self.unit, (self.done / elapsed if elapsed else 0)
+            ),
+            flush=True
+        )
+
+
+task_metrics = Metrics()
+
+
+def run_timed_task(fn, *args):
+    timed = sum(task_metrics.seconds.values())
+    t0 = time.perf_counter()
+    result = fn(*args)
+    busy = time.perf_counter() - t0
+    timed = sum(task_metrics.seconds.values()) - timed
+    task_metrics.seconds['busy'] += busy
+    task_metrics.seconds['unattributed'] += max(0, busy - timed)
+    return result, task_metrics.pop()
+
+
+def init_profiled_worker(profile_dir, initializer, *initargs):
+    if profile_dir:
+        start_profiler(
+            path=os.path.join(
+                profile_dir, 'worker.{}.prof'.format(os.getpid())
+            )
+        )
+    with task_metrics.timer('init_worker'):
+        initializer(*initargs)
+
+
+_profiles = list()
+
+
+def start_profiler(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    while _profiles:
+        _profiles.pop().disable()
+    profile = cProfile.Profile()
+    Finalize(None, _dump_profile, args=(profile, path), exitpriority=10)
+    profile.enable()
+    _profiles.append(profile)
+    return profile
+
+
+def _dump_profile(profile, path):
+    profile.disable()
+    profile.dump_stats(path)
+
+
+def write_metrics_report(path, reports):
+    with open(path, 'w') as f:
+        if path.endswith('.json'):
+            json.dump(reports, f, indent=2)
+            f.write(os.linesep)
+        else:
+            f.write('command\tmetric\tvalue' + os.linesep)
+            for c, r in reports.items():
+                for k, v in _flatten_dict(r):
+                    f.write('{0}\t{1}\t{2}{3}'.format(c, k, v, os.linesep))
+
+
+def _flatten_dict(d, prefix=''):
+    for k, v in d.items():
+        if isinstance(v, dict):
+            yield from _flatten_dict(v, prefix='{0}{1}.'.format(prefix, k))
+        else:
+            yield '{0}{1}'.format(prefix, k), ('' if v is None else v)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict
+
+
+SAM_FIXED_COLS = (
+    'QNAME', 'FLAG', 'RNAME', 'POS', 'MAPQ', 'CIGAR', 'RNEXT', 'PNEXT',
+    'TLEN', 'SEQ', 'QUAL'
+)
+_COL_INDEXES = {k: i for i, k in enumerate(SAM_FIXED_COLS)}
+_INT_COL_INDEXES = frozenset(
+    _COL_INDEXES[k] for k in ['FLAG', 'POS', 'MAPQ', 'PNEXT', 'TLEN']
+)
+
+
+class SamRecord(object):
+    __slots__ = ('_values', '_opt', '_decoder')
+
+    def __init__(self, values=None, opt='', decoder=None):
+        self._values = values
+        self._opt = opt
+        self._decoder = decoder
+
+    def __getitem__(self, key):
+        i = _COL_INDEXES[key]
+        if self._values is None:
+            self._values = self._decoder()
+            self._decoder = None
+        v = self._values[i]
+        if i in _INT_COL_INDEXES and isinstance(v, str):
+            v = self._values[i] = int(v)
+        return v
+
+    def __getstate__(self):
+        if self._values is None:
+            self._values = self._decoder()
+            self._decoder = None
+        return (self._values, self._opt)
+
+    def __setstate__(self, state):
+        self._values, self._opt = state
+        self._decoder = None
+
+    def __repr__(self):
+        return 'SamRecord({})'.format(
+            ', '.join('{0}={1!r}'.format(k, self[k]) for k in SAM_FIXED_COLS)
+        )
+
+    def get(self, key, default=None):
+        return self[key] if key in _COL_INDEXES else default
+
+    def keys(self):
+        return list(SAM_FIXED_COLS)
+
+    def to_dict(self):
+        return OrderedDict([(k, self[k]) for k in SAM_FIXED_COLS])
+
+    @property
+    def tags(self):
+        return OrderedDict([
+            _parse_sam_tag(s) for s in (self._opt or '').split('\t') if s
+        ])
+
+
+class SamFormatError(ValueError):
+    pass
+
+
+def parse_sam_line(line):
+    values = line.rstrip('\r\n').split('\t', 11)
+    if len(values) < 11:
+        raise SamFormatError('invalid SAM line: {}'.format(line.strip()))
+    else:
+        return SamRecord(
+            values=values[:11], opt=(values[11] if len(values) > 11 else '')
+        )
+
+
+def parse_sam_lines(buffer):
+    if isinstance(buffer, bytes):
+        buffer = buffer.decode('utf-8')
+    return [
+        parse_sam_line(line=s) for s in buffer.splitlines()
+        if s and not s.startswith('@')
+    ]
+
+
+def _parse_sam_tag(string):
+    tag, tag_type, value = string.split(':', 2)
+    if tag_type == 'i':
+        return tag, int(value)
+    elif tag_type == 'f':
+        return tag, float(value)
+    else:
+        return tag, value
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+import json
+import re
+import numpy as np
+from .helper import fetch_abspath
+
+
+def parse_shard(shard):
+    m = re.match(r'^\s*([0-9]+)\s*/\s*([0-9]+)\s*$', str(shard))
+    if not (m and 1 <= int(m.group(1)) <= int(m.group(2))):
+        raise ValueError('invalid shard: {}'.format(shard))
+    return int(m.group(1)) - 1, int(m.group(2))
+
+
+def assign_shards(costs, total_cost, n_shards, start_cost=0):
+    costs = np.asarray(costs, dtype=np.int64)
+    ends = start_cost + np.cumsum(costs)
+    return (2 * ends - costs) * n_shards // (2 * total_cost)
+
+
+def find_shard_range(costs, total_cost, shard, start_cost=0):
+    start, end = np.searchsorted(
+        assign_shards(
+            costs=costs, total_cost=total_cost, n_shards=shard[1],
+            start_cost=start_cost
+        ),
+        [shard[0], shard[0] + 1]
+    )
+    return range(int(start), int(end))
+
+
+def make_shard_manifest_path(path):
+    return fetch_abspath(path) + '.shard.json'
+
+
+def write_shard_manifest(path, shard):
+    with open(make_shard_manifest_path(path), 'w') as f:
+        json.dump({'shard': shard[0] + 1, 'n_shards': shard[1]}, f)
+
+
+def read_shard_manifest(path):
+    with open(make_shard_manifest_path(path)) as f:
+        d = json.load(f)
+    return parse_shard('{0}/{1}'.format(d['shard'], d['n_shards']))
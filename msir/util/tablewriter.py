@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import gzip
+import logging
+import os
+import tempfile
+from .bgzf import BgzfWriter
+from .helper import fetch_abspath
+
+
+class OrderedTableWriter(object):
+    def __init__(self, path, max_buffer_size=(256 * 1024 * 1024),
+                 keep_empty=False):
+        self.path = fetch_abspath(path)
+        self.max_buffer_size = max_buffer_size
+        self.keep_empty = keep_empty
+        root, ext = os.path.splitext(self.path)
+        self.compression = {'.gz': 'gzip', '.bgz': 'bgzf'}.get(ext)
+        self.sep = (
+            ',' if (root if self.compression else self.path).endswith('.csv')
+            else '\t'
+        )
+        self.n_rows = 0
+        self.__header = None
+        self.__file = None
+        self.__spill = None
+        self.__buffer = dict()
+        self.__buffered_size = 0
+        self.__next_key = 0
+        self.__tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(flush=(exc_type is None))
+
+    def write(self, key, df=None):
+        if df is None or not df.size:
+            data = b''
+        else:
+            if self.__header is None:
+                self.__header = df.iloc[:0].to_csv(sep=self.sep).encode()
+            data = df.to_csv(sep=self.sep, header=False).encode()
+            self.n_rows += df.shape[0]
+        self._write_in_order(key=key, data=data)
+
+    def write_raw(self, key, header, data):
+        if data:
+            if self.__header is None:
+                self.__header = header
+            self.n_rows += data.count(b'\n')
+        self._write_in_order(key=key, data=data)
+
+    def close(self, flush=True):
+        if flush:
+            self._flush_ready()
+            if self.__buffer:
+                logging.getLogger(__name__).warning(
+                    'missing keys before: {}'.format(min(self.__buffer))
+                )
+                for k in sorted(self.__buffer):
+                    self._write_data(self._pop_buffered(key=k))
+            if self.__file is None and self.keep_empty:
+                self.__file = self._open()
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+            if flush:
+                os.replace(self.__tmp_path, self.path)
+            else:
+                os.remove(self.__tmp_path)
+        elif flush and os.path.exists(self.path):
+            os.remove(self.path)
+        if self.__spill is not None:
+            self.__spill.close()
+            self.__spill = None
+
+    def _write_in_order(self, key, data):
+        if key == self.__next_key:
+            self._write_data(data)
+            self.__next_key += 1
+            self._flush_ready()
+        else:
+            self.__buffer[key] = data
+            self.__buffered_size += len(data)
+            if self.__buffered_size > self.max_buffer_size:
+                self._spill_buffer()
+
+    def _flush_ready(self):
+        while self.__next_key in self.__buffer:
+            self._write_data(self._pop_buffered(key=self.__next_key))
+            self.__next_key += 1
+
+    def _pop_buffered(self, key):
+        data = self.__buffer.pop(key)
+        if isinstance(data, tuple):
+            self.__spill.seek(data[0])
+            return self.__spill.read(data[1])
+        else:
+            self.__buffered_size -= len(data)
+            return data
+
+    def _spill_buffer(self):
+        logger = logging.getLogger(__name__)
+        logger.debug('spill buffered data: {} B'.format(self.__buffered_size))
+        if self.__spill is None:
+            self.__spill = tempfile.TemporaryFile(
+                dir=os.path.dirname(self.path)
+            )
+        for k, v in self.__buffer.items():
+            if not isinstance(v, tuple):
+                self.__spill.seek(0, os.SEEK_END)
+                self.__buffer[k] = (self.__spill.tell(), len(v))
+                self.__spill.write(v)
+        self.__buffered_size = 0
+
+    def _write_data(self, data):
+        if data:
+            if self.__file is None:
+                self.__file = self._open()
+                self.__file.write(self.__header)
+            self.__file.write(data)
+
+    def _open(self):
+        if self.compression == 'gzip':
+            return gzip.open(self.__tmp_path, 'wb')
+        elif self.compression == 'bgzf':
+            return BgzfWriter(path=self.__tmp_path)
+        else:
+            return open(self.__tmp_path, 'wb')
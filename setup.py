@@ -11,12 +11,12 @@ setup(
         'Tandem repeat analyzer for microsatellite instability detection'
         ' by DNA-seq'
     ),
-    packages=find_packages(),
+    packages=find_packages(exclude=['bench', 'bench.*']),
     author='Daichi Narushima',
     author_email='dnarsil+github@gmail.com',
     url='https://github.com/dceoy/msir',
     include_package_data=True,
-    install_requires=['biopython', 'docopt', 'pandas'],
+    install_requires=['biopython', 'docopt', 'numpy', 'pandas'],
     entry_points={'console_scripts': ['msir=msir.cli.main:main']},
     classifiers=[
         'Development Status :: 3 - Alpha',
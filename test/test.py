@@ -1,9 +1,55 @@
 #!/usr/bin/env python
 
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+from http.client import HTTPConnection
+import json
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
-from msir.call.identifier import compile_str_regex, \
-    extract_longest_repeat_df
+import weakref
+import zlib
+import pandas as pd
+try:
+    import pysam
+except ImportError:
+    pysam = None
+from msir.call.detector import _assign_reads_to_loci, \
+    _convert_df_to_records, _extract_repeats_from_reads, _init_worker, \
+    detect_tandem_repeats_in_reads, iterate_observed_repeats, \
+    make_read_sampling, ReadOrderError
+from msir.call.identifier import extract_longest_repeat_df, \
+    identify_repeat_units_on_bed, identify_repeat_units_on_genome, \
+    iterate_repeat_units
+from msir.call.matcher import _compile_repeat_unit_regex_patterns, \
+    compile_str_regex, extract_flanked_repeat, extract_longest_repeat
+from msir.call.merger import merge_sharded_tables, TableMergeError
+from msir.call.scorer import score_microsatellite_instability
+from msir.call.server import DetectionService, make_detection_server, \
+    parse_region
+from msir.df.basebiodf import BioDataFrameError
+from msir.df.beddf import BedDataFrame
+from msir.util.bamreader import calculate_alignment_end, \
+    estimate_region_bytes, make_read_filter, NativeBamReader, \
+    passes_read_filter, PysamBamReader, SamTextReader
+from msir.util.bgzf import BgzfReader
+from msir.util.cache import IntervalCache, make_cache_key
+from msir.util.catalog import MemoryRepeatCatalog, RepeatCatalog, \
+    write_repeat_catalog
+from msir.util.checkpoint import CheckpointError, TaskCheckpoint
 from msir.util.biotools import iterate_unique_repeat_units
+from msir.util.faidx import IndexedFasta
+from msir.util.helper import run_tasks_with_bounded_queue
+from msir.util.metrics import Metrics, write_metrics_report
+from msir.util.samrecord import parse_sam_line, parse_sam_lines, SamRecord
+from msir.util.shard import find_shard_range, parse_shard, \
+    write_shard_manifest
+from msir.util.tablewriter import OrderedTableWriter
 
 
 class TandemRepeats(unittest.TestCase):
@@ -68,6 +114,1110 @@ class TandemRepeats(unittest.TestCase):
             for k, v in d.items():
                 self.assertEqual(v, df1[k].iloc[0] if k in df1 else None)
 
+    def test_extract_longest_repeat(self):
+        """lightweight hit records from sequences
+        """
+        for s, d in self.reads.items():
+            ru = d['repeat_unit']
+            hit = extract_longest_repeat(
+                sequence=s,
+                regex_patterns={'patterns': {ru: compile_str_regex(ru)}},
+                flanking_len=2, start_pos=100
+            )
+            self.assertEqual(hit.repeat_unit, ru)
+            self.assertEqual(hit.repeat_times, d['repeat_times'])
+            self.assertEqual(hit.repeat_start, d['repeat_start'] + 100)
+            self.assertEqual(hit.repeat_end, d['repeat_end'] + 100)
+        self.assertIsNone(
+            extract_longest_repeat(
+                sequence='ACGT',
+                regex_patterns={'patterns': {'A': compile_str_regex('A', 2)}}
+            )
+        )
+
+    def test_flanked_repeat_consistent_with_regex(self):
+        """flank-anchored matching vs regular expressions
+        """
+        random.seed(1)
+        for _ in range(2000):
+            ru = ''.join(random.choices('AC', k=random.randint(1, 3)))
+            ls, rs = [
+                ''.join(random.choices('ACG', k=random.randint(0, 2)))
+                for _ in range(2)
+            ]
+            s = ''.join(random.choices([ru, ls, rs, 'A', 'C', 'G'], k=12))
+            hit = extract_flanked_repeat(
+                sequence=s, repeat_unit=ru, left_seq=ls, right_seq=rs,
+                start_pos=5
+            )
+            self.assertEqual(
+                hit,
+                extract_longest_repeat(
+                    sequence=s,
+                    regex_patterns={
+                        'patterns': {
+                            ru: compile_str_regex(
+                                ru, left_seq=ls, right_seq=rs
+                            )
+                        },
+                        'left_seq': ls, 'right_seq': rs
+                    },
+                    min_rep_len=1, start_pos=5
+                )
+            )
+
+    def test_scan_engine_consistent_with_regex(self, max_unit_len=4):
+        """period-scanning engine vs regular expressions
+        """
+        random.seed(0)
+        for min_rep_times in [1, 2, 3]:
+            rp = _compile_repeat_unit_regex_patterns(
+                max_unit_len=max_unit_len, min_rep_times=min_rep_times
+            )
+            sp = {
+                'engine': 'scan', 'max_unit_len': max_unit_len,
+                'min_rep_times': min_rep_times
+            }
+            for _ in range(100):
+                units = [
+                    ''.join(random.choices('ACGTN', k=random.randint(1, 4)))
+                    for _ in range(3)
+                ]
+                s = ''.join([
+                    random.choice(units) * random.randint(1, 4)
+                    for _ in range(random.randint(2, 12))
+                ])
+                args = {
+                    'sequence': s, 'min_rep_len': random.randint(1, 8),
+                    'flanking_len': random.randint(0, 3)
+                }
+                df_r = extract_longest_repeat_df(regex_patterns=rp, **args)
+                df_s = extract_longest_repeat_df(regex_patterns=sp, **args)
+                self.assertEqual(
+                    df_r.to_dict(orient='records'),
+                    df_s.to_dict(orient='records')
+                )
+            for s in self.reads.keys():
+                self.assertEqual(
+                    extract_longest_repeat_df(
+                        sequence=s, regex_patterns=rp
+                    ).to_dict(orient='records'),
+                    extract_longest_repeat_df(
+                        sequence=s, regex_patterns=sp
+                    ).to_dict(orient='records')
+                )
+
+
+class RepeatUnitCoordinates(unittest.TestCase):
+    """Reference coordinates of repeats identified on BED regions
+    """
+    seq = (
+        'TTGACCGATCCGATGCATGGACTAGCTAGGCTAAGTCGAT' + 'GT' * 8 +
+        'ACCTTGACTTAGCGATGCAAGTCCGATCGGTACAT'
+    )
+
+    def test_count_positions_from_search_start(self):
+        """place repeats by the extended search region, not chromStart
+        """
+        with tempfile.TemporaryDirectory() as d:
+            fa_path = os.path.join(d, 'ref.fa')
+            with open(fa_path, 'w') as f:
+                f.write('>chrA\n{}\n'.format(self.seq))
+            for ex_region_len in [5, 10, 20]:
+                r = next(
+                    iterate_repeat_units(
+                        regions=[('chrA', 38, 60)], genome_fa_path=fa_path,
+                        min_rep_times=3, min_rep_len=10, flanking_len=5,
+                        ex_region_len=ex_region_len, no_cache=True, n_proc=1
+                    )
+                )
+                self.assertEqual(
+                    (r['repeat_start'], r['repeat_end'], r['search_start']),
+                    (40, 56, 38 - ex_region_len)
+                )
+                self.assertEqual(
+                    self.seq[r['repeat_start']:r['repeat_end']], 'GT' * 8
+                )
+                self.assertEqual(
+                    self.seq[(r['repeat_start'] - 5):r['repeat_start']],
+                    r['left_seq']
+                )
+
+
+class ReferenceGenome(unittest.TestCase):
+    """Indexed reference genome
+    """
+    seqs = {
+        'chr1': 'ACGTNACGTACGTTTTTTTTTTGCA' * 7,
+        'chr2': 'GGGCCCAAATTT' * 11 + 'A',
+        'chr3': 'C'
+    }
+
+    def test_fetch_indexed_fasta(self):
+        """random access to sequences with a FASTA index
+        """
+        with tempfile.TemporaryDirectory() as d:
+            fa_path = os.path.join(d, 'ref.fa')
+            with open(fa_path, 'w') as f:
+                for k, v in self.seqs.items():
+                    f.write('>{} description\n'.format(k))
+                    for i in range(0, len(v), 60):
+                        f.write(v[i:(i + 60)] + '\n')
+            for _ in range(2):
+                with IndexedFasta(path=fa_path) as fa:
+                    self.assertTrue(os.path.isfile(fa_path + '.fai'))
+                    self.assertEqual(
+                        dict(fa.lengths),
+                        {k: len(v) for k, v in self.seqs.items()}
+                    )
+                    for k, v in self.seqs.items():
+                        for s, e in [(0, 1), (0, None), (55, 125), (3, 500)]:
+                            self.assertEqual(fa.fetch(k, s, e), v[s:e])
+                    self.assertEqual(
+                        fa.fetch_many([('chr2', 10, 20), ('chr1', 1, 4)]),
+                        [self.seqs['chr2'][10:20], self.seqs['chr1'][1:4]]
+                    )
+
+    def test_fetch_bgzip_fasta(self):
+        """random access to bgzip-compressed sequences
+        """
+        with tempfile.TemporaryDirectory() as d:
+            fa_path = os.path.join(d, 'ref.fa.gz')
+            _write_bgzf(
+                path=fa_path,
+                data=''.join([
+                    '>{0}\n{1}\n'.format(k, v) for k, v in self.seqs.items()
+                ]).encode('ascii'),
+                block_size=50
+            )
+            for max_cached_blocks in [256, 1]:
+                with IndexedFasta(
+                        path=fa_path, max_cached_blocks=max_cached_blocks
+                ) as fa:
+                    self.assertTrue(os.path.isfile(fa_path + '.gzi'))
+                    for k, v in self.seqs.items():
+                        self.assertEqual(fa.fetch(k, 0, None), v)
+                        self.assertEqual(fa.fetch(k, 40, 111), v[40:111])
+                ref = weakref.ref(fa)
+                del fa
+                self.assertIsNone(ref())
+            with BgzfReader(path=fa_path) as f:
+                f.seek(0)
+                self.assertEqual(f.read(6), b'>chr1\n')
+                f.seek((f.tell() >> 16) << 16 | 3)
+                self.assertEqual(f.read(4), b'r1\nA')
+
+
+def _write_bgzf(path, data, block_size=65280):
+    with open(path, 'wb') as f:
+        for i in [*range(0, len(data), block_size), len(data)]:
+            b = data[i:(i + block_size)]
+            c = zlib.compressobj(6, zlib.DEFLATED, -15)
+            cdata = c.compress(b) + c.flush()
+            f.write(
+                b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+                + struct.pack('<H', len(cdata) + 25) + cdata
+                + struct.pack('<II', zlib.crc32(b), len(b))
+            )
+
+
+class GenomeScan(unittest.TestCase):
+    """Genome-wide scan for tandem repeats
+    """
+    seq = (
+        'GATCCGTAGCTAGGCTAAGT' + 'CA' * 30 + 'GGTACCTTGACTTAG' + 'T' * 12 +
+        'CGATGCAAGTCCATGA' + 'AGC' * 9 + 'TTGACCGATCCGATGCAT'
+    )
+
+    def test_scan_genome_in_chunks(self):
+        """identical repeat units regardless of chunk boundaries
+        """
+        with tempfile.TemporaryDirectory() as d:
+            fa_path = os.path.join(d, 'ref.fa')
+            with open(fa_path, 'w') as f:
+                f.write('>chrA\n{}\n'.format(self.seq))
+            dfs = list()
+            for chunk_len in [1000, 37]:
+                tsv_path = os.path.join(d, 'ru{}.tsv'.format(chunk_len))
+                identify_repeat_units_on_genome(
+                    genome_fa_path=fa_path, trunit_tsv_path=tsv_path,
+                    min_rep_times=3, min_rep_len=10, flanking_len=5,
+                    chunk_len=chunk_len, n_proc=2
+                )
+                dfs.append(pd.read_csv(tsv_path, sep='\t'))
+            self.assertTrue(dfs[0].equals(dfs[1]))
+            self.assertEqual(
+                dfs[0]['repeat_unit'].tolist(), ['CA', 'T', 'AGC']
+            )
+            for _, r in dfs[0].iterrows():
+                self.assertEqual(
+                    self.seq[r['repeat_start']:r['repeat_end']],
+                    r['repeat_seq']
+                )
+
+
+class BedFile(unittest.TestCase):
+    """BED file loading
+    """
+    lines = [
+        'chr1\t{0}\t{1}\tms{0}\t0\t+'.format(i, i + 20)
+        for i in range(0, 2500, 100)
+    ]
+
+    def test_load_bed(self):
+        """bulk and chunked BED loading with headers and gzip
+        """
+        with tempfile.TemporaryDirectory() as d:
+            bed_path = os.path.join(d, 'ms.bed.gz')
+            with gzip.open(bed_path, 'wt') as f:
+                f.write('browser hide all\ntrack name=ms\n')
+                f.write('\n'.join(self.lines) + '\n')
+            bdf = BedDataFrame(path=bed_path)
+            df = bdf.load_and_output_df()
+            self.assertEqual(bdf.header, ['browser hide all', 'track name=ms'])
+            self.assertEqual(
+                list(df.columns),
+                ['chrom', 'chromStart', 'chromEnd', 'name', 'score', 'strand']
+            )
+            self.assertEqual(df.shape[0], len(self.lines))
+            self.assertEqual(df['chromEnd'].sum(), 30000 + 20 * 25)
+            chunks = list(bdf.iterate_chunks(chunksize=10))
+            self.assertEqual([c.shape[0] for c in chunks], [10, 10, 5])
+            self.assertEqual(chunks[-1].index[0], 20)
+            bed_path = os.path.join(d, 'ms.bed')
+            with open(bed_path, 'w') as f:
+                f.write(
+                    'track name=a\n{0}\n#c\n{1}\n\ntrack name=b\n{2}\n'.format(
+                        *self.lines[:3]
+                    )
+                )
+            df = BedDataFrame(path=bed_path).load_and_output_df()
+            self.assertEqual(df['chromStart'].tolist(), [0, 100, 200])
+            self.assertEqual(
+                [
+                    c.index.tolist() for c in BedDataFrame(
+                        path=bed_path
+                    ).iterate_chunks(chunksize=4)
+                ],
+                [[0, 1], [2]]
+            )
+            with open(bed_path, 'a') as f:
+                f.write('chr1\tx\t20\n')
+            self.assertRaisesRegex(
+                BioDataFrameError, 'line 8', BedDataFrame(path=bed_path).load
+            )
+
+
+class SamText(unittest.TestCase):
+    """SAM text records
+    """
+    lines = [
+        '@HD\tVN:1.6\tSO:coordinate',
+        'r0\t99\tchr1\t101\t60\t5M\t=\t151\t55\tACGTA\tIIIII\tNM:i:0',
+        'r1\t1024\tchr1\t102\t0\t4M1I\t*\t0\t0\tCGTAC\t*'
+    ]
+
+    def test_parse_sam_lines(self):
+        """parse fixed fields and optional tags
+        """
+        r0 = parse_sam_line(line=self.lines[1] + '\n')
+        self.assertEqual(
+            [r0['QNAME'], r0['FLAG'], r0['POS'], r0['TLEN'], r0['SEQ']],
+            ['r0', 99, 101, 55, 'ACGTA']
+        )
+        self.assertEqual(dict(r0.tags), {'NM': 0})
+        self.assertRaises(KeyError, lambda: r0['OPT0'])
+        records = parse_sam_lines(buffer='\n'.join(self.lines).encode())
+        self.assertEqual([r['QNAME'] for r in records], ['r0', 'r1'])
+        self.assertEqual(records[1].to_dict()['MAPQ'], 0)
+        self.assertEqual(dict(records[1].tags), {})
+
+    def test_filter_reads(self):
+        """keep reads by MAPQ and FLAG bits
+        """
+        self.assertIsNone(make_read_filter())
+        rf = make_read_filter(
+            min_mapq=10, include_flags='0x1', exclude_flags=0x100,
+            skip_duplicates=True
+        )
+        self.assertEqual(tuple(rf), (10, 0x1, 0x500))
+        for flag, mapq, passed in [(0x1, 10, True), (0x1, 9, False),
+                                   (0x0, 60, False), (0x401, 60, False),
+                                   (0x103, 60, False), (0x3, 60, True)]:
+            self.assertEqual(
+                passes_read_filter(flag=flag, mapq=mapq, read_filter=rf),
+                passed
+            )
+
+
+class ReadAssignment(unittest.TestCase):
+    """Single-sweep read-to-locus assignment
+    """
+    locus_index = {
+        'chr1': ([10, 15, 40], [(10, 20, 0), (15, 30, 1), (40, 45, 2)]),
+        'chr2': ([5], [(5, 8, 3)])
+    }
+    reads = [
+        ('r0', 'chr1', 5, '20M'), ('r1', 'chr1', 10, '11M'),
+        ('r2', 'chr1', 12, '5M3D15M'), ('r3', 'chr1', 38, '4M'),
+        ('r4', 'chr2', 1, '8M'), ('r5', 'chr2', 2, '*'),
+        ('r6', 'chr3', 1, '9M')
+    ]
+
+    def test_assign_reads_to_loci(self):
+        """assign reads to every locus they span
+        """
+        assigned = {
+            id: [r['QNAME'] for r in reads]
+            for id, reads in _assign_reads_to_loci(
+                reads=[
+                    {'QNAME': q, 'RNAME': c, 'POS': p, 'CIGAR': g, 'FLAG': 0}
+                    for q, c, p, g in self.reads
+                ],
+                locus_index=self.locus_index
+            )
+        }
+        self.assertEqual(assigned, {0: ['r0', 'r1'], 1: ['r2'], 3: ['r4']})
+        for i, j in [(1, 2), (0, 4)]:
+            reads = [
+                {'QNAME': q, 'RNAME': c, 'POS': p, 'CIGAR': g, 'FLAG': 0}
+                for q, c, p, g in self.reads
+            ]
+            reads[i], reads[j] = reads[j], reads[i]
+            self.assertRaises(
+                ReadOrderError, list,
+                _assign_reads_to_loci(
+                    reads=reads, locus_index=self.locus_index
+                )
+            )
+
+
+def _write_bam_dataset(dir_path, n_loci=12, depths=(40, 40), read_len=100,
+                       seed=0):
+    rng = random.Random(seed)
+    genome = {c: rng.choices('ACGT', k=(n_loci * 500)) for c in ['c1', 'c2']}
+    depths = dict(zip(genome.keys(), depths))
+    loci = list()
+    for c, seq in genome.items():
+        for start in range(200, len(seq) - 300, 1000):
+            unit = rng.choice(['A', 'CA', 'GTT', 'AGAT'])
+            times = 20 // len(unit)
+            seq[start:(start + len(unit) * times)] = unit * times
+            loci.append((c, start, start + len(unit) * times, unit))
+        genome[c] = ''.join(seq)
+    paths = {
+        k: os.path.join(dir_path, n) for k, n in [
+            ('fasta', 'ref.fa'), ('bed', 'ref.bed'), ('sam', 'reads.sam'),
+            ('bam', 'reads.bam')
+        ]
+    }
+    with open(paths['fasta'], 'w') as f:
+        for c, seq in genome.items():
+            f.write('>{0}\n{1}\n'.format(c, seq))
+    with open(paths['bed'], 'w') as f:
+        for c, start, end, _ in loci:
+            f.write('{0}\t{1}\t{2}\n'.format(c, start, end))
+    reads = list()
+    for c, start, end, unit in loci:
+        ref = genome[c]
+        for i in range(depths[c]):
+            rs = start - rng.randint(10, read_len - (end - start) - 20)
+            a = start - rs
+            seq, cigar = [
+                (ref[rs:(rs + read_len)], '{}M'.format(read_len)),
+                (
+                    ref[rs:start] + ref[(start + len(unit)):(
+                        rs + read_len + len(unit)
+                    )],
+                    '{0}M{1}D{2}M'.format(a, len(unit), read_len - a)
+                ),
+                (
+                    ref[rs:start] + unit + ref[start:(
+                        rs + read_len - len(unit)
+                    )],
+                    '{0}M{1}I{2}M'.format(
+                        a, len(unit), read_len - len(unit) - a
+                    )
+                )
+            ][i % 3]
+            reads.append(
+                (c, rs + 1, '{0}:{1}:{2}'.format(c, start, i), cigar, seq)
+            )
+    with open(paths['sam'], 'w') as f:
+        f.write('@HD\tVN:1.6\tSO:coordinate\n')
+        for c, seq in genome.items():
+            f.write('@SQ\tSN:{0}\tLN:{1}\n'.format(c, len(seq)))
+        for c, pos, q, cigar, seq in sorted(reads):
+            f.write(
+                '{0}\t0\t{1}\t{2}\t60\t{3}\t*\t0\t0\t{4}\t{5}\n'.format(
+                    q, c, pos, cigar, seq, 'I' * len(seq)
+                )
+            )
+        f.write('u0\t4\t*\t0\t0\t*\t*\t0\t0\tACGT\tIIII\n')
+    with pysam.AlignmentFile(paths['sam'], 'r') as fi:
+        with pysam.AlignmentFile(paths['bam'], 'wb', template=fi) as fo:
+            for r in fi:
+                fo.write(r)
+    pysam.index(paths['bam'])
+    return paths
+
+
+@unittest.skipUnless(pysam, 'pysam is required to write BAM files')
+class SweepDetection(unittest.TestCase):
+    """Single-sweep detection against indexed queries
+    """
+    def test_sweep_consistent_with_index(self):
+        """detect identical repeats by a sweep and by indexed queries
+        """
+        with tempfile.TemporaryDirectory() as d:
+            paths = _write_bam_dataset(dir_path=d)
+            tsv_path = os.path.join(d, 'tr_unit.tsv')
+            identify_repeat_units_on_bed(
+                bed_path=paths['bed'], genome_fa_path=paths['fasta'],
+                trunit_tsv_path=tsv_path, no_cache=True, n_proc=1
+            )
+            for summary in [False, True]:
+                outputs = list()
+                for sweep in [False, True]:
+                    obs_path = os.path.join(
+                        d, 'obs.{0:d}{1:d}.tsv'.format(summary, sweep)
+                    )
+                    detect_tandem_repeats_in_reads(
+                        bam_paths=[paths['bam']], trunit_tsv_path=tsv_path,
+                        obs_tsv_path=obs_path, sweep=sweep, summary=summary,
+                        n_proc=1
+                    )
+                    with open(obs_path) as f:
+                        outputs.append(f.read())
+                self.assertGreater(len(outputs[0].splitlines()), 24)
+                self.assertEqual(outputs[0], outputs[1])
+
+
+@unittest.skipUnless(pysam, 'pysam is required to write BAM files')
+class NativeBamReading(unittest.TestCase):
+    """BAM decoding and BAI queries without pysam or samtools
+    """
+    def test_fetch_consistent_with_pysam(self):
+        """fetch the same reads as pysam and SAM text around block bounds
+        """
+        with tempfile.TemporaryDirectory() as d:
+            paths = _write_bam_dataset(dir_path=d, n_loci=80, depths=(60, 60))
+            sam_reads = [
+                r.to_dict() for r in SamTextReader(
+                    path=paths['sam']
+                ).iterate_reads()
+            ]
+            bounds = list()
+            with pysam.AlignmentFile(paths['bam']) as f:
+                block = None
+                for _ in range(len(sam_reads)):
+                    v = f.tell()
+                    r = next(f)
+                    if (v >> 16) != block and not r.is_unmapped:
+                        bounds.append((r.reference_name, r.reference_start))
+                    block = v >> 16
+            self.assertGreater(len(bounds), 10)
+            with open(paths['bed']) as f:
+                loci = [s.split('\t') for s in f]
+            regions = [
+                *[(c, int(s) - 9, int(e) + 10) for c, s, e in loci],
+                *[(c, p + j, p + 60) for c, p in bounds for j in [0, 1, 2]],
+                ('c1', 39990, 40100), ('c3', 100, 200)
+            ]
+            readers = [
+                NativeBamReader(path=paths['bam']),
+                PysamBamReader(path=paths['bam'])
+            ]
+            try:
+                for r in readers:
+                    self.assertEqual(
+                        [b.to_dict() for b in r.iterate_reads()], sam_reads
+                    )
+                for c, start_pos, end_pos in regions:
+                    expected = [
+                        b for b in sam_reads
+                        if b['RNAME'] == c and b['POS'] <= start_pos
+                        and calculate_alignment_end(
+                            flag=b['FLAG'], pos=b['POS'], cigar=b['CIGAR']
+                        ) >= end_pos
+                    ]
+                    for r in readers:
+                        self.assertEqual(
+                            [
+                                b.to_dict() for b in r.fetch_spanning_reads(
+                                    rname=c, start_pos=start_pos,
+                                    end_pos=end_pos
+                                )
+                            ],
+                            expected
+                        )
+            finally:
+                for r in readers:
+                    r.close()
+
+
+class RepeatTimesSummary(unittest.TestCase):
+    """Per-locus histogram of observed repeat times
+    """
+    catalog = {
+        7: {
+            'chrom': 'chr1', 'chromStart': 10, 'chromEnd': 20,
+            'repeat_start': 12, 'repeat_end': 20, 'repeat_unit': 'CA',
+            'repeat_unit_length': 2, 'repeat_times': 4, 'left_seq': 'GT',
+            'right_seq': 'TT'
+        }
+    }
+    seqs = ['GTCACACACATT', 'AGTCACACACATTG', 'GTCACACATT', 'GTGGGG']
+
+    def test_summarize_repeat_times(self):
+        """count reads by observed repeat times
+        """
+        reads = [{'SEQ': s, 'POS': 9} for s in self.seqs]
+        _init_worker(catalog=self.catalog, summary=True)
+        df, read_counts = _extract_repeats_from_reads(
+            bam_path='a.bam', bed_id=7, reads=reads
+        )
+        df = df.reset_index()
+        self.assertEqual(df['observed_repeat_times'].tolist(), [3, 4])
+        self.assertEqual(df['read_count'].tolist(), [1, 2])
+        self.assertEqual(set(df['sam_region']), {'chr1:11-21'})
+        self.assertEqual(read_counts, {'total': 4, 'rejected': 1})
+
+
+class ReadSampling(unittest.TestCase):
+    """Per-locus read cap and early stop
+    """
+    def test_sample_reads_per_locus(self):
+        """cap reads reproducibly and stop once the histogram converges
+        """
+        reads = [
+            {'SEQ': s, 'POS': 9}
+            for s in RepeatTimesSummary.seqs[:3] * 400
+        ]
+        dfs = list()
+        for _ in range(2):
+            _init_worker(
+                catalog=RepeatTimesSummary.catalog, summary=True,
+                sampling=make_read_sampling(max_reads_per_locus=50, seed=1)
+            )
+            df, read_counts = _extract_repeats_from_reads(
+                bam_path='a.bam', bed_id=7, reads=reads
+            )
+            dfs.append(df.reset_index())
+        self.assertTrue(dfs[0].equals(dfs[1]))
+        self.assertEqual(dfs[0]['read_count'].sum(), 50)
+        self.assertEqual(set(dfs[0]['spanning_reads']), {1200})
+        self.assertEqual(read_counts['total'], 50)
+        _init_worker(
+            catalog=RepeatTimesSummary.catalog, summary=True,
+            sampling=make_read_sampling(early_stop=0.1)
+        )
+        _, read_counts = _extract_repeats_from_reads(
+            bam_path='a.bam', bed_id=7, reads=reads
+        )
+        self.assertLess(read_counts['total'], 1200)
+        self.assertEqual(read_counts['spanning'], 1200)
+        decoded = list()
+        _init_worker(
+            catalog=RepeatTimesSummary.catalog, summary=True,
+            sampling=make_read_sampling(max_reads_per_locus=50)
+        )
+        _, read_counts = _extract_repeats_from_reads(
+            bam_path='a.bam', bed_id=7,
+            reads=(
+                SamRecord(
+                    decoder=(
+                        lambda s=b['SEQ']: decoded.append(s) or [
+                            'r', 0, 'chr1', 9, 60, '*', '*', 0, 0, s, '*'
+                        ]
+                    )
+                ) for b in reads
+            )
+        )
+        self.assertEqual(read_counts['spanning'], 1200)
+        self.assertEqual(len(decoded), 50)
+        df, _ = _extract_repeats_from_reads(
+            bam_path='a.bam', bed_id=7,
+            reads=[{'SEQ': RepeatTimesSummary.seqs[3], 'POS': 9}] * 3
+        )
+        df = df.reset_index()
+        self.assertEqual(df['read_count'].tolist(), [0])
+        self.assertEqual(df['spanning_reads'].tolist(), [3])
+        self.assertEqual(df['matched_reads'].tolist(), [3])
+        records = _convert_df_to_records(df=df, summary=True)
+        self.assertEqual(dict(records[0]['read_counts']), {})
+
+
+class TableWriter(unittest.TestCase):
+    """Streaming table output in key order
+    """
+    df = pd.DataFrame(
+        {'chrom': ['chr1'] * 6, 'pos': range(6), 'v': list('abcdef')}
+    ).set_index(['chrom', 'pos'])
+
+    def test_write_chunks_in_key_order(self):
+        """reorder chunks and spill them over the buffer size
+        """
+        with tempfile.TemporaryDirectory() as d:
+            for n, max_buffer_size in [('t.tsv', 1000), ('t.tsv.gz', 0)]:
+                path = os.path.join(d, n)
+                with OrderedTableWriter(
+                        path=path, max_buffer_size=max_buffer_size
+                ) as w:
+                    for k in [3, 1, 4, 0, 2]:
+                        w.write(
+                            key=k,
+                            df=(self.df.iloc[(k * 2):(k * 2 + 2)] if k < 3
+                                else None)
+                        )
+                self.assertEqual(w.n_rows, 6)
+                self.assertTrue(
+                    pd.read_csv(path, sep='\t', index_col=[0, 1]).equals(
+                        self.df
+                    )
+                )
+
+
+class CatalogCache(unittest.TestCase):
+    """Content-addressed cache of repeat units
+    """
+    def test_get_put_and_evict(self):
+        """reuse cached entries and evict the least recently used ones
+        """
+        with tempfile.TemporaryDirectory() as d:
+            keys = [make_cache_key('ns', 'chr1', i, i + 10) for i in range(4)]
+            with IntervalCache(path=os.path.join(d, 'c.db')) as c:
+                c.put_many([(keys[0], {'a': 1}), (keys[1], None)])
+                self.assertEqual(
+                    c.get_many(keys), {keys[0]: {'a': 1}, keys[1]: None}
+                )
+                c.max_size = 100
+                c.put_many([(k, {'b': 'x' * 10}) for k in keys[2:]])
+                c.get_many(keys[3:])
+                self.assertEqual(c.evict(), 3)
+                self.assertEqual(c.evict(), 0)
+                self.assertEqual(list(c.get_many(keys).keys()), [keys[3]])
+            db_path = os.path.join(d, 'v.db')
+            for min_vacuum_size, shrunk in [(1 << 30, False), (0, True)]:
+                with IntervalCache(
+                        path=db_path, min_vacuum_size=min_vacuum_size
+                ) as c:
+                    c.put_many([(k, {'b': 'x' * 100000}) for k in keys])
+                    size = os.path.getsize(db_path)
+                    c.max_size = 1000
+                self.assertEqual(os.path.getsize(db_path) < size, shrunk)
+
+
+class TaskMetrics(unittest.TestCase):
+    """Stage timings and queue depth of pooled tasks
+    """
+    def test_collect_and_write_metrics(self):
+        """merge worker timings and write JSON and TSV reports
+        """
+        metrics = Metrics()
+        with ThreadPoolExecutor(max_workers=1) as x, metrics.timer('pool'):
+            results = dict(
+                run_tasks_with_bounded_queue(
+                    executor=x, max_in_flight=2, metrics=metrics,
+                    tasks=[
+                        (i, (sum if i % 3 else None), ([i, i],))
+                        for i in range(6)
+                    ]
+                )
+            )
+        self.assertEqual(results, {0: None, 1: 2, 2: 4, 3: None, 4: 8, 5: 10})
+        metrics.seconds['total'] = metrics.seconds['pool']
+        metrics.counts['loci'] += 6
+        report = metrics.summarize(n_proc=1)
+        self.assertGreater(report['seconds']['busy'], 0)
+        self.assertLessEqual(report['queue_depth']['max'], 2)
+        self.assertLessEqual(report['worker_utilization'], 1)
+        self.assertAlmostEqual(report['unattributed_worker_fraction'], 1)
+        with tempfile.TemporaryDirectory() as d:
+            for n in ['m.json', 'm.tsv']:
+                write_metrics_report(
+                    path=os.path.join(d, n), reports={'id': report}
+                )
+            with open(os.path.join(d, 'm.json')) as f:
+                self.assertEqual(json.load(f)['id']['counts'], {'loci': 6})
+            df = pd.read_csv(os.path.join(d, 'm.tsv'), sep='\t')
+            self.assertIn('queue_depth.max', set(df['metric']))
+
+
+class RepeatCatalogFormat(unittest.TestCase):
+    """Binary repeat catalog converted from a repeat unit TSV
+    """
+    def test_write_and_read_catalog(self):
+        """round-trip packed and raw sequences and sort the locus index
+        """
+        df = pd.DataFrame([
+            ['chr2', 100, 200, 150, 160, 'CA', 2, 5, 'ACGTA', 'GGT'],
+            ['chr1', 300, 400, 350, 356, 'T', 1, 6, 'ANNC', ''],
+            ['chr1', 0, 100, 20, 30, 'AG', 2, 5, 'TTTTT', 'CCCCC']
+        ], columns=[
+            'chrom', 'chromStart', 'chromEnd', 'repeat_start', 'repeat_end',
+            'repeat_unit', 'repeat_unit_length', 'repeat_times', 'left_seq',
+            'right_seq'
+        ])
+        with tempfile.TemporaryDirectory() as d:
+            tsv_path = os.path.join(d, 'tr_unit.tsv')
+            df.to_csv(tsv_path, sep='\t', index=False)
+            catalog_path = os.path.join(d, 'tr_unit.msircat')
+            self.assertEqual(
+                write_repeat_catalog(
+                    tsv_path=tsv_path, catalog_path=catalog_path
+                ), 3
+            )
+            with RepeatCatalog(catalog_path) as catalog:
+                self.assertEqual(len(catalog), 3)
+                for i, r in enumerate(df.to_dict(orient='records')):
+                    r['right_seq'] = r['right_seq'] or None
+                    self.assertEqual(catalog[i], r)
+                self.assertEqual(
+                    catalog.make_locus_index(),
+                    {
+                        'chr1': ([16, 347], [(16, 35, 2), (347, 356, 1)]),
+                        'chr2': ([146], [(146, 163, 0)])
+                    }
+                )
+
+
+class StreamingApi(unittest.TestCase):
+    """Repeat units and observed repeats passed in memory
+    """
+    seq = (
+        'GATCCGTAGCTAGGCTAAGT' + 'CA' * 10 + 'GGTACCTTGACTTAGCGATGCAAGTCC' +
+        'TTGACCGATCCGATGCATGGACT'
+    )
+
+    def test_identify_and_detect_in_memory(self):
+        """stream repeat units into detection without TSV files
+        """
+        with tempfile.TemporaryDirectory() as d:
+            fa_path = os.path.join(d, 'ref.fa')
+            with open(fa_path, 'w') as f:
+                f.write('>chrA\n{}\n'.format(self.seq))
+            records = list(
+                iterate_repeat_units(
+                    regions=[('chrA', 15, 45), ('chrA', 70, 80)],
+                    genome_fa_path=fa_path, min_rep_times=3, min_rep_len=10,
+                    flanking_len=5, no_cache=True, n_proc=1
+                )
+            )
+            self.assertEqual(
+                [(r['repeat_unit'], r['repeat_times']) for r in records],
+                [('CA', 10)]
+            )
+            bed_path = os.path.join(d, 'ref.bed')
+            with open(bed_path, 'w') as f:
+                f.write('chrA\t15\t45\n')
+            returned = identify_repeat_units_on_bed(
+                bed_path=bed_path, genome_fa_path=fa_path,
+                trunit_tsv_path=os.path.join(d, 'tr_unit.tsv'),
+                min_rep_times=3, min_rep_len=10, flanking_len=5,
+                no_cache=True, return_catalog=True, n_proc=1
+            )
+            self.assertEqual(returned[0]['repeat_start'], 20)
+            self.assertNotIn('search_seq', returned[0])
+            sam_path = os.path.join(d, 'reads.sam')
+            with open(sam_path, 'w') as f:
+                f.write('@SQ\tSN:chrA\tLN:{}\n'.format(len(self.seq)))
+                for i, (cigar, s) in enumerate([
+                        ('50M', self.seq[10:60]), ('50M', self.seq[10:60]),
+                        ('30M4I20M',
+                         self.seq[10:20] + 'CA' * 12 + self.seq[40:60])
+                ]):
+                    f.write(
+                        'r{0}\t0\tchrA\t11\t60\t{1}\t*\t0\t0\t{2}\t*\n'
+                        .format(i, cigar, s)
+                    )
+            catalog = MemoryRepeatCatalog(records=records)
+            hists = [
+                list(
+                    iterate_observed_repeats(
+                        bam_paths=[sam_path], catalog=catalog,
+                        regions=regions, sweep=True, summary=True, n_proc=1
+                    )
+                ) for regions in [None, [('chrA', 60, 90)]]
+            ]
+            self.assertEqual(len(hists[0]), 1)
+            self.assertEqual(hists[0][0]['chromStart'], 15)
+            self.assertEqual(dict(hists[0][0]['read_counts']), {10: 2, 12: 1})
+            self.assertEqual(hists[1], [])
+
+
+@unittest.skipUnless(pysam, 'pysam is required to write BAM files')
+class DetectionServer(unittest.TestCase):
+    """Repeat-length distributions served over HTTP
+    """
+    def test_serve_distribution_requests(self):
+        """answer requests with the same histograms as msir detect
+        """
+        self.assertEqual(parse_region('chr1:1,001-2000'), ('chr1', 1000, 2000))
+        self.assertEqual(parse_region('chrX:5'), ('chrX', 4, 5))
+        with tempfile.TemporaryDirectory() as d:
+            paths = _write_bam_dataset(dir_path=d)
+            tsv_path = os.path.join(d, 'tr_unit.tsv')
+            identify_repeat_units_on_bed(
+                bed_path=paths['bed'], genome_fa_path=paths['fasta'],
+                trunit_tsv_path=tsv_path, no_cache=True, n_proc=1
+            )
+            obs_path = os.path.join(d, 'tr_obs.tsv')
+            detect_tandem_repeats_in_reads(
+                bam_paths=[paths['bam']], trunit_tsv_path=tsv_path,
+                obs_tsv_path=obs_path, summary=True, n_proc=1
+            )
+            df = pd.read_csv(obs_path, sep='\t')
+            with DetectionService(
+                    bam_paths=[paths['bam']], trunit_tsv_path=tsv_path,
+                    n_proc=1
+            ) as service:
+                server = make_detection_server(service=service, port=0)
+                t = threading.Thread(target=server.serve_forever)
+                t.start()
+                try:
+                    c = HTTPConnection(*server.server_address)
+                    responses = list()
+                    for method, path, body in [
+                            ('GET', '/health', None),
+                            ('GET', '/distribution?sample=x&region=1', None),
+                            ('GET', '/distribution?sample=reads&region=c2',
+                             None),
+                            ('POST', '/distribution',
+                             json.dumps({
+                                 'sample': 'reads',
+                                 'regions': ['c3', ['c1', 1190, 1210]]
+                             })),
+                            ('POST', '/distribution', '[]'),
+                            ('POST', '/distribution', '"x"'),
+                            ('POST', '/distribution',
+                             json.dumps({
+                                 'sample': 'reads', 'regions': 'c1:1-100'
+                             })),
+                            ('POST', '/distribution',
+                             json.dumps({
+                                 'sample': ['reads'], 'regions': ['c1']
+                             }))
+                    ]:
+                        c.request(method, path, body=body)
+                        r = c.getresponse()
+                        responses.append((r.status, json.loads(r.read())))
+                finally:
+                    server.shutdown()
+                    server.server_close()
+                    t.join()
+        self.assertEqual(responses[0][0], 200)
+        self.assertEqual(responses[0][1]['loci'], 12)
+        for status, body in [responses[1], *responses[4:]]:
+            self.assertEqual(status, 400)
+            self.assertIn('error', body)
+        for (status, body), chrom, chrom_starts in [
+                (responses[2], 'c2', range(200, 6000, 1000)),
+                (responses[3], 'c1', [1200])
+        ]:
+            self.assertEqual(status, 200)
+            self.assertEqual(
+                [r['chromStart'] for r in body['loci']], list(chrom_starts)
+            )
+            for r in body['loci']:
+                df_locus = df[
+                    (df['chrom'] == chrom)
+                    & (df['chromStart'] == r['chromStart'])
+                ]
+                self.assertGreater(len(r['read_counts']), 1)
+                self.assertEqual(
+                    r['read_counts'], {
+                        str(k): v for k, v in zip(
+                            df_locus['observed_repeat_times'],
+                            df_locus['read_count']
+                        )
+                    }
+                )
+
+
+class MsiScore(unittest.TestCase):
+    """MSI scores against a panel of normals
+    """
+    counts = [
+        ('n1.bam', 0, 10, 30), ('n1.bam', 1, 10, 30), ('n1.bam', 2, 10, 30),
+        ('n2.bam', 0, 10, 25), ('n2.bam', 1, 10, 25), ('n2.bam', 2, 10, 25),
+        ('t.bam', 0, 10, 30), ('t.bam', 1, 7, 20), ('t.bam', 1, 10, 10),
+        ('t.bam', 2, 7, 5), ('t.bam', 2, None, 0)
+    ]
+
+    def test_score_against_normals(self):
+        """call loci unstable and score samples by the unstable ratio
+        """
+        with tempfile.TemporaryDirectory() as d:
+            obs_tsv = os.path.join(d, 'obs.tsv.gz')
+            pd.DataFrame([
+                {
+                    'sam_path': s, 'chrom': 'chr1', 'chromStart': i * 100,
+                    'chromEnd': i * 100 + 20, 'repeat_unit': 'AC',
+                    'referenced_repeat_times': 10,
+                    'observed_repeat_times': t, 'read_count': n
+                } for s, i, t, n in self.counts
+            ]).to_csv(obs_tsv, sep='\t', index=False)
+            scores = score_microsatellite_instability(
+                obs_tsv_paths=[obs_tsv], normal_names=['n1.bam', 'n2'],
+                score_tsv_path=os.path.join(d, 'score.tsv'),
+                locus_tsv_path=os.path.join(d, 'locus.tsv'), n_proc=1
+            )
+            df = pd.read_csv(os.path.join(d, 'locus.tsv'), sep='\t')
+        self.assertEqual(scores['sam_path'].tolist(), ['t.bam'])
+        self.assertEqual(scores['evaluable_loci'].tolist(), [2])
+        self.assertEqual(scores['msi_score'].tolist(), [50])
+        self.assertEqual(df['unstable'].tolist(), [False, True, False])
+        self.assertEqual(df['baseline_reads'].tolist(), [55, 55, 55])
+        self.assertAlmostEqual(df['unstable_fraction'][1], 2 / 3)
+
+
+class ResumeCheckpoint(unittest.TestCase):
+    """Finished work saved for a resumed run
+    """
+    def test_save_load_and_keep_output(self):
+        """reload saved parts, reject other inputs, and keep an old output
+        """
+        with tempfile.TemporaryDirectory() as d:
+            ckpt_path = os.path.join(d, 'out.tsv.ckpt')
+            checkpoint = TaskCheckpoint(path=ckpt_path, fingerprint='a')
+            for i in [1, 0]:
+                checkpoint.save(name=i, obj=(i, [{'id': i}]))
+            checkpoint = TaskCheckpoint(path=ckpt_path, fingerprint='a')
+            self.assertEqual(len(checkpoint), 2)
+            self.assertEqual(
+                list(checkpoint.load()), [(0, [{'id': 0}]), (1, [{'id': 1}])]
+            )
+            self.assertRaises(
+                CheckpointError, TaskCheckpoint, path=ckpt_path,
+                fingerprint='b'
+            )
+            checkpoint.remove()
+            self.assertFalse(os.path.exists(ckpt_path))
+            path = os.path.join(d, 'out.tsv')
+            with open(path, 'w') as f:
+                f.write('old\n')
+            try:
+                with OrderedTableWriter(path=path) as w:
+                    w.write(key=0, df=TableWriter.df)
+                    raise KeyboardInterrupt
+            except KeyboardInterrupt:
+                pass
+            with open(path) as f:
+                self.assertEqual(f.read(), 'old\n')
+            self.assertEqual(os.listdir(d), ['out.tsv'])
+            self.assertRaises(
+                ValueError, detect_tandem_repeats_in_reads, bam_paths=['-'],
+                trunit_tsv_path=path, obs_tsv_path=path, sweep=True,
+                resume=True, n_proc=1
+            )
+            self.assertEqual(os.listdir(d), ['out.tsv'])
+
+
+class ShardMerge(unittest.TestCase):
+    """Contiguous shards merged into the output of a single run
+    """
+    def test_shard_and_merge(self):
+        """split rows by costs and merge shard tables by their indexes
+        """
+        costs = [1, 1, 1, 1, 1, 10]
+        ranges = [
+            find_shard_range(
+                costs=costs, total_cost=sum(costs),
+                shard=parse_shard('{}/3'.format(i))
+            ) for i in range(1, 4)
+        ]
+        self.assertEqual(ranges, [range(0, 5), range(5, 5), range(5, 6)])
+        self.assertRaises(ValueError, parse_shard, '0/3')
+        df = TableWriter.df
+        with tempfile.TemporaryDirectory() as d:
+            paths = [
+                os.path.join(d, n)
+                for n in ['s1.tsv', 's2.tsv.gz', 's3.tsv.bgz']
+            ]
+            for i, (p, r) in enumerate(zip(paths, ranges)):
+                with OrderedTableWriter(path=p, keep_empty=True) as w:
+                    w.write(key=0, df=df.iloc[r.start:r.stop])
+                write_shard_manifest(path=p, shard=(i, 3))
+            self.assertTrue(all(os.path.isfile(p) for p in paths))
+            merged_path = os.path.join(d, 'merged.tsv')
+            for shard_paths in [paths[:2], [paths[0], *paths[:2]]]:
+                self.assertRaises(
+                    TableMergeError, merge_sharded_tables,
+                    shard_tsv_paths=shard_paths, merged_tsv_path=merged_path
+                )
+            merge_sharded_tables(
+                shard_tsv_paths=paths[::-1], merged_tsv_path=merged_path,
+                chunk_size=16
+            )
+            single_path = os.path.join(d, 'single.tsv')
+            with OrderedTableWriter(path=single_path) as w:
+                w.write(key=0, df=df)
+            with open(merged_path) as f, open(single_path) as g:
+                self.assertEqual(f.read(), g.read())
+
+
+@unittest.skipUnless(pysam, 'pysam is required to write BAM files')
+class ShardedDetection(unittest.TestCase):
+    """Sample loci sharded by read bytes in a BAM index
+    """
+    def test_shard_loci_by_read_bytes(self):
+        """give deeper loci fewer per shard and merge a single-run output
+        """
+        with tempfile.TemporaryDirectory() as d:
+            paths = _write_bam_dataset(dir_path=d, depths=(20, 600))
+            regions = [
+                (c, 100 + i * 1000, 120 + i * 1000)
+                for c in ['c1', 'c2'] for i in range(6)
+            ]
+            sizes = estimate_region_bytes(
+                bam_path=paths['bam'], regions=regions
+            )
+            self.assertGreater(min(sizes[6:]), max(sizes[:6]))
+            self.assertIsNone(
+                estimate_region_bytes(bam_path=paths['sam'], regions=regions)
+            )
+            tsv_path = os.path.join(d, 'tr_unit.tsv')
+            identify_repeat_units_on_bed(
+                bed_path=paths['bed'], genome_fa_path=paths['fasta'],
+                trunit_tsv_path=tsv_path, no_cache=True, n_proc=1
+            )
+            obs_paths = [
+                os.path.join(d, 'obs.{}.tsv'.format(i)) for i in range(3)
+            ]
+            for i, p in enumerate(obs_paths):
+                detect_tandem_repeats_in_reads(
+                    bam_paths=[paths['bam']], trunit_tsv_path=tsv_path,
+                    obs_tsv_path=p, summary=True,
+                    shard=('{}/2'.format(i) if i else None), n_proc=1
+                )
+            shard_dfs = [pd.read_csv(p, sep='\t') for p in obs_paths[1:]]
+            self.assertGreater(
+                shard_dfs[0]['chromStart'].nunique(),
+                shard_dfs[1]['chromStart'].nunique()
+            )
+            merged_path = os.path.join(d, 'merged.tsv')
+            merge_sharded_tables(
+                shard_tsv_paths=obs_paths[1:], merged_tsv_path=merged_path
+            )
+            with open(merged_path) as f, open(obs_paths[0]) as g:
+                self.assertEqual(f.read(), g.read())
+
+
+class LazyImports(unittest.TestCase):
+    """CLI startup and the matching core without pandas
+    """
+    def test_import_without_pandas(self):
+        out = subprocess.run(
+            args=[
+                sys.executable, '-c',
+                'import sys, msir.cli.main, msir.call.matcher; '
+                'print(sorted({"pandas", "Bio"} & set(sys.modules)))'
+            ],
+            stdout=subprocess.PIPE, check=True
+        ).stdout.decode('utf-8').strip()
+        self.assertEqual(out, '[]')
+
 
 if __name__ == '__main__':
     unittest.main()